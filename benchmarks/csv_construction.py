@@ -0,0 +1,119 @@
+""" Compare ClusterServiceVersion construction using the single-pass deployment scanner against the separate passes
+    it replaced (tagged image overrides, operator images, related image annotations) on a large synthetic CSV. The
+    separate passes are kept here, in _SeparatePasses, for the comparison.
+
+    Run from the repository root:
+
+        python -m benchmarks.csv_construction [--deployments 50] [--containers 4] [--annotations 40] [--rounds 20]
+"""
+import argparse, time
+
+from operator_csv_libs.csv import ClusterServiceVersion
+from operator_csv_libs.images import Image
+
+class _SeparatePasses(ClusterServiceVersion):
+    # Construction as it was before the scanner: three walks over the deployments, building the write-back index and
+    # collecting RELATED_IMAGE_* env vars separately the way callers had to. The passes are the ones ClusterServiceVersion
+    # used to have, reading through _get_deployments() and writing through _mutable_deployment() so both sides of the
+    # comparison use the same copy on write storage
+    def _scan_deployments(self):
+        self._manipulate_tag_images()
+        self._get_operator_images()
+        self._get_related_images()
+        self._build_index()
+        for d in self._get_deployments():
+            for c in d['spec']['template']['spec']['containers']:
+                for e in c.get('env') or ():
+                    if e['name'].startswith(self.RELATED_IMAGE_ENV_PREFIX) and 'value' in e:
+                        self.env_related_images.append(Image(name=e['name'], image=e['value'], deployment=d['name'], container=c['name']))
+
+    def _get_operator_images(self):
+        for d in self._get_deployments():
+            for c in d['spec']['template']['spec']['containers']:
+                o = Image(
+                    deployment = d['name'],
+                    container  = c['name'],
+                    image      = c['image']
+                )
+                self.original_operator_images.append(o)
+                self.operator_images.append(o)
+
+    def _get_related_images(self):
+        for d in self._get_deployments():
+            if not 'annotations' in d['spec']['template']['metadata']:
+                continue
+            for a in d['spec']['template']['metadata']['annotations']:
+                if a.startswith(self.RELATED_IMAGE_IDENTIFIER):
+                    o = Image(
+                        deployment  = d['name'],
+                        name        = a.replace(self.RELATED_IMAGE_IDENTIFIER, ''),
+                        image       = d['spec']['template']['metadata']['annotations'][a]
+                    )
+                    self.annotation_related_images.append(o)
+
+    def _manipulate_tag_images(self):
+        taggedImages = {}
+        for d in self._get_deployments():
+            if not 'annotations' in d['spec']['template']['metadata']:
+                continue
+            for a in d['spec']['template']['metadata']['annotations']:
+                if a.startswith(self.TAGGED_RELATED_IMAGE_IDENTIFIER):
+                    taggedImages[a.replace(self.TAGGED_RELATED_IMAGE_IDENTIFIER, self.RELATED_IMAGE_IDENTIFIER)] = d['spec']['template']['metadata']['annotations'][a]
+        if not taggedImages:
+            return
+        for di, d in enumerate(self._get_deployments()):
+            if not 'annotations' in d['spec']['template']['metadata']:
+                continue
+            annotations = self._mutable_deployment(di, 'spec', 'template', 'metadata', 'annotations')
+            for i in taggedImages:
+                annotations[i] = taggedImages[i]
+
+def make_csv(deployments, containers, annotations):
+    csv = {
+        'metadata': {'name': 'bench-operator.v1.0.0', 'annotations': {'alm-examples': '[]' * 5000}},
+        'spec': {
+            'version': '1.0.0',
+            'customresourcedefinitions': {'owned': [{'name': 'crd{}'.format(i), 'description': 'x' * 200} for i in range(50)]},
+            'install': {'spec': {'deployments': []}}
+        }
+    }
+    for d in range(deployments):
+        a = {'olm.relatedImage.operand{}'.format(i): 'quay.io/org/operand{}:1.0'.format(i) for i in range(annotations)}
+        a.update({'description.example.com/{}'.format(i): 'value' for i in range(annotations)})
+        a['olm.tag.relatedImage.operand{}-{}'.format(d, 0)] = 'quay.io/org/operand{}:tagged'.format(d)
+        csv['spec']['install']['spec']['deployments'].append({
+            'name': 'deployment{}'.format(d),
+            'spec': {'template': {
+                'metadata': {'annotations': a},
+                'spec': {'containers': [{
+                    'name': 'container{}'.format(c),
+                    'image': 'quay.io/org/operator{}:1.0'.format(c),
+                    'env': [{'name': 'RELATED_IMAGE_OPERAND{}'.format(i), 'value': 'quay.io/org/operand{}:1.0'.format(i)} for i in range(5)]
+                } for c in range(containers)]}
+            }}
+        })
+    return csv
+
+def timeit(cls, csv, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        cls(csv)
+    return (time.perf_counter() - start) / rounds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--deployments', type=int, default=50)
+    parser.add_argument('--containers', type=int, default=4)
+    parser.add_argument('--annotations', type=int, default=40)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    csv = make_csv(args.deployments, args.containers, args.annotations)
+    separate = timeit(_SeparatePasses, csv, args.rounds)
+    scanner = timeit(ClusterServiceVersion, csv, args.rounds)
+
+    print('separate passes: {:8.2f} ms per CSV'.format(separate * 1000))
+    print('single pass:     {:8.2f} ms per CSV ({:.1f}x)'.format(scanner * 1000, separate / scanner))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+""" Measure image reference parsing throughput: the memoized parser on a working set of references that fits the
+    cache (the common case, a CSV or catalog refers to the same images over and over), uncached parsing, and the
+    string splitting Image did before.
+
+    Run from the repository root:
+
+        python -m benchmarks.references [--references 2000] [--rounds 50]
+"""
+import argparse, time
+
+from operator_csv_libs import references
+from operator_csv_libs.images import Image
+
+REGISTRIES = ('quay.io/org', 'docker.io/library', 'localhost:5000/ns', 'registry.example.com/team/sub', '')
+
+def make_references(n):
+    images = []
+    for i in range(n):
+        image = '{}/operand{}'.format(REGISTRIES[i % len(REGISTRIES)], i).lstrip('/')
+        if i % 7 == 0:
+            image += ':2.0@sha256:' + '{:064x}'.format(i)
+        elif i % 3 == 0:
+            image += ':1.{}'.format(i)
+        elif i % 3 == 1:
+            image += '@sha256:' + '{:064x}'.format(i)
+        images.append(image)
+    return images
+
+def split_strings(image):
+    # Image.__init__ before the shared parser
+    image_repo = '/'.join(image.split('/')[:-1])
+    remainder = image.split('/')[-1]
+    if '@' in remainder:
+        return image_repo, remainder.split('@')[0], None, remainder.split('@')[1]
+    elif ':' in remainder:
+        return image_repo, remainder.split(':')[0], remainder.split(':')[1], None
+    return image_repo, remainder, 'latest', None
+
+def timeit(fn, images, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for image in images:
+            fn(image)
+    return (time.perf_counter() - start) / (rounds * len(images))
+
+def uncached(image):
+    references.clear_cache()
+    return references.parse_reference(image)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--references', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    images = make_references(args.references)
+    results = [
+        ('string splitting', timeit(split_strings, images, args.rounds)),
+        ('parse (uncached)', timeit(uncached, images, max(1, args.rounds // 10))),
+        ('parse (memoized)', timeit(references.parse_reference, images, args.rounds)),
+        ('Image()', timeit(lambda image: Image(None, image), images, args.rounds)),
+    ]
+    for name, seconds in results:
+        print('{:18} {:8.3f} us per reference ({:,.0f}/s)'.format(name + ':', seconds * 1e6, 1 / seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+""" Compare connections opened by bare requests.get calls against the pooled keep-alive sessions used by the
+    registry backends, for a batch of quay tag lookups against a local stand-in registry.
+
+    Run from the repository root:
+
+        python -m benchmarks.session_handshakes [--lookups 200] [--workers 8]
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+import argparse, threading, time
+import requests
+
+from operator_csv_libs.imagerepo import QuayRepo, resolve_digests
+from operator_csv_libs.images import Image
+from operator_csv_libs.sessions import SessionPool
+
+BODY = b'{ "tags": [ { "is_manifest_list" : false, "manifest_digest" : "sha256:dummy_sha" } ] }'
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+def _bare_get(url, auth=None):
+    # What every lookup did before the shared session layer: a fresh connection per call
+    class _Bare:
+        def get(self, url, **kwargs):
+            return requests.get(url, **kwargs)
+    return _Bare()
+
+def run(server, get_session, images, workers):
+    server.connections = 0
+    start = time.monotonic()
+    with patch('operator_csv_libs.imagerepo.get_session', get_session):
+        results = list(resolve_digests(images, max_workers=workers))
+    elapsed = time.monotonic() - start
+    assert all(r.ok() for r in results), [r for r in results if not r.ok()]
+    return server.connections, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    images = [Image(None, 'quay.io/bench/image{}:tag'.format(i)) for i in range(args.lookups)]
+    base = 'http://127.0.0.1:{}/api/v1/repository'.format(server.server_address[1])
+    pool = SessionPool(pool_size=args.workers)
+    try:
+        with patch.object(QuayRepo, 'QUAY_BASE_URL', base):
+            bare = run(server, _bare_get, images, args.workers)
+            pooled = run(server, pool.get_session, images, args.workers)
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+    print('{} lookups, {} workers'.format(args.lookups, args.workers))
+    print('{:<10} {:>12} {:>10}'.format('mode', 'connections', 'seconds'))
+    print('{:<10} {:>12} {:>10.3f}'.format('bare', *bare))
+    print('{:<10} {:>12} {:>10.3f}'.format('pooled', *pooled))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+""" Find the bundle versions every skipRange of a catalog covers: a linear scan parsing versions and ranges each time,
+    a linear scan over memoized versions and compiled ranges, and binary search over a VersionIndex. Also times
+    building an UpgradeGraph over the whole catalog.
+
+    Run from the repository root:
+
+        python -m benchmarks.skipranges [--versions 2000] [--ranges 2000]
+"""
+import argparse, random, time
+
+from operator_csv_libs import semver
+from operator_csv_libs.semver import Version, VersionIndex, parse_version, parse_range
+from operator_csv_libs.upgradegraph import UpgradeGraph
+
+def make_versions(n):
+    versions = []
+    major, minor, patch = 1, 0, 0
+    for i in range(n):
+        versions.append('{}.{}.{}'.format(major, minor, patch) + ('-{}'.format(202000000000 + i) if i % 5 == 0 else ''))
+        patch += 1
+        if patch == 10:
+            patch, minor = 0, minor + 1
+        if minor == 20:
+            minor, major = 0, major + 1
+    return versions
+
+def make_ranges(versions, n, rng):
+    ranges = []
+    for _ in range(n):
+        a, b = sorted(rng.sample(range(len(versions)), 2))
+        ranges.append('>={} <{}'.format(versions[a].split('-')[0], versions[b].split('-')[0]))
+    return ranges
+
+def uncached_scan(versions, ranges):
+    # Parse everything again for every query, comparing comparator by comparator
+    semver._parse_version.cache_clear()
+    covered = 0
+    for expression in ranges:
+        comparators = [(c[:2] if c[1] == '=' else c[:1], Version(*semver._split_version(c.lstrip('<>='), True))) for c in expression.split()]
+        for v in versions:
+            version = Version(*semver._split_version(v, False))
+            if all(version >= b if op == '>=' else version < b for op, b in comparators):
+                covered += 1
+    return covered
+
+def cached_scan(versions, ranges):
+    parsed = [parse_version(v) for v in versions]
+    return sum(1 for expression in ranges for v in parsed if v in parse_range(expression))
+
+def indexed(versions, ranges):
+    index = VersionIndex((v, None) for v in versions)
+    return sum(len(index.covered(parse_range(expression))) for expression in ranges)
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--versions', type=int, default=2000)
+    parser.add_argument('--ranges', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    versions = make_versions(args.versions)
+    ranges = make_ranges(versions, args.ranges, rng)
+
+    results = []
+    for name, fn in (('uncached scan', uncached_scan), ('compiled scan', cached_scan), ('version index', indexed)):
+        seconds, covered = timeit(fn, versions, ranges)
+        results.append(covered)
+        print('{:14} {:9.1f} ms ({:.1f} us per range)'.format(name + ':', seconds * 1000, seconds / len(ranges) * 1e6))
+    assert len(set(results)) == 1, results
+
+    graph = UpgradeGraph()
+    start = time.perf_counter()
+    previous = None
+    for i, v in enumerate(versions):
+        name = 'bench.v' + v
+        graph.add_entry(name, version=v, replaces=previous, skiprange=ranges[i] if i % 10 == 0 else None)
+        previous = name
+    # skipRange edges are resolved on the first query
+    graph.build()
+    print('{:14} {:9.1f} ms for {} csvs'.format('upgrade graph:', (time.perf_counter() - start) * 1000, len(versions)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+from .imagerepo import ImageRepo, get_lookup_key, ArtifactoryRepo, QuayRepo, DockerRepo, MissingCredentials, RepoTypeNotImplemented, ManifestListNotFound, ManifestNotFound, RateLimited
+from .digestcache import DigestCache
+from .singleflight import SingleFlight
+from urllib.parse import urlsplit
+from . import tracing
+import base64, json, time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+class AsyncImageRepo:
+    """ Asyncio counterpart of ImageRepo. Registry lookups are awaitable and run on a non-blocking HTTP client,
+        so many lookups can overlap on a single event loop. Raises the same exceptions as the blocking ImageRepo.
+
+        Pass a shared aiohttp.ClientSession to reuse connections across lookups, otherwise a session is
+        opened and closed for every call.
+    """
+    # Concurrent lookups of the same image and kind on one event loop share one registry round trip
+    singleflight = ImageRepo.singleflight
+
+    def __init__(self, image, session=None, logger=None):
+        if aiohttp is None:
+            raise ImportError('AsyncImageRepo requires aiohttp. Install it with `pip install operator-csv-libs[async]`')
+
+        self.image = image
+
+        # Same routing as the blocking ImageRepo
+        if 'artifactory' in self.image.get_image_repo():
+            self.image_repo = AsyncArtifactoryRepo(self.image, session=session)
+        elif self.image.get_image_repo().startswith('quay.io/'):
+            self.image_repo = AsyncQuayRepo(self.image, session=session)
+        elif self.image.get_image_repo().startswith('docker.io'):
+            self.image_repo = AsyncDockerRepo(self.image, session=session)
+        else:
+            raise RepoTypeNotImplemented('Unknown repository type for image {}'.format(image.get_image()))
+
+    async def get_manifest_list_digest(self):
+        return await self._lookup(DigestCache.MANIFEST_LIST, self.image_repo.get_manifest_list_digest)
+
+    async def get_image_digest(self):
+        return await self._lookup(DigestCache.IMAGE, self.image_repo.get_image_digest)
+
+    async def get_raw_manifest_list(self):
+        """Return the docker manifest list in json format
+
+        :raises ManifestListNotFound: No manifest list exists for the specified image.
+
+        :return: manifest.list.json content
+        :rtype: dict
+        """
+        return await self.image_repo.get_raw_manifest_list()
+
+    async def _lookup(self, lookup, fetch):
+        if tracing.enabled():
+            with tracing.scope(self.image_repo, lookup):
+                return await self._coalesced_lookup(lookup, fetch)
+        return await self._coalesced_lookup(lookup, fetch)
+
+    async def _coalesced_lookup(self, lookup, fetch):
+        if self.singleflight is None:
+            return await fetch()
+        return await self.singleflight.do_async(get_lookup_key(self.image, lookup), fetch)
+
+class _AsyncRepo:
+    """ Shared plumbing for the async backends. Each backend wraps its blocking counterpart for url building
+        and response interpretation, and only replaces the HTTP calls.
+    """
+    def __init__(self, session=None):
+        self.session = session
+
+    async def _get(self, url, headers=None, method='GET'):
+        """ Perform a request and return (status, headers, body) with the body read as text
+        """
+        if self.session is not None:
+            return await self._fetch(self.session, method, url, headers)
+        async with aiohttp.ClientSession() as session:
+            return await self._fetch(session, method, url, headers)
+
+    async def _fetch(self, session, method, url, headers):
+        if not tracing.enabled():
+            async with session.request(method, url, headers=headers) as resp:
+                return resp.status, resp.headers, await resp.text()
+
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, headers=headers) as resp:
+                size = len(await resp.read())
+                text = await resp.text()
+        except Exception as e:
+            tracing.emit(tracing.TraceEvent.REQUEST, host=urlsplit(url).hostname, method=method, url=url,
+                         latency=time.perf_counter() - start, error=e)
+            raise
+        tracing.emit(tracing.TraceEvent.REQUEST, host=urlsplit(url).hostname, method=method, url=url, status=resp.status,
+                     latency=time.perf_counter() - start, bytes=size)
+        return resp.status, resp.headers, text
+
+class AsyncArtifactoryRepo(_AsyncRepo):
+    """ Async interface to docker images stored in artifactory. Digests are read through the artifactory storage api,
+        which is the same endpoint ArtifactoryPath.stat uses.
+    """
+    BACKEND = 'artifactory'
+
+    def __init__(self, image, artifactory_base=None, artifactory_user=None, artifactory_key=None, session=None, logger=None):
+        super().__init__(session)
+        self.image = image
+        # Credential resolution is shared with the blocking backend
+        self._repo = ArtifactoryRepo(image, artifactory_base, artifactory_user, artifactory_key)
+
+    @tracing.traced('get_image_digest')
+    async def get_image_digest(self):
+        return 'sha256:{}'.format(await self._get_raw_digest('manifest.json', ManifestNotFound))
+
+    @tracing.traced('get_manifest_list_digest')
+    async def get_manifest_list_digest(self):
+        return 'sha256:{}'.format(await self._get_raw_digest('list.manifest.json', ManifestListNotFound))
+
+    @tracing.traced('get_raw_manifest_list')
+    async def get_raw_manifest_list(self):
+        """Return the docker manifest list in json format
+
+        :raises ManifestListNotFound: No manifest list exists for the specified image.
+
+        :return: manifest.list.json content
+        :rtype: dict
+        """
+        status, _, body = await self._get(self._repo._get_artifactory_path('list.manifest.json'), headers=self._auth_headers())
+        self._check_status(status, body, ManifestListNotFound)
+        return json.loads(body)
+
+    async def _get_raw_digest(self, filename, not_found):
+        storage_path = '/'.join([self._repo.artifactory_base, 'api/storage', self._repo._get_artifactory_item(filename)])
+        status, _, body = await self._get(storage_path, headers=self._auth_headers())
+        self._check_status(status, body, not_found)
+        return json.loads(body)['checksums']['sha256']
+
+    def _check_status(self, status, body, not_found):
+        if status in (401, 403):
+            raise MissingCredentials(body)
+        elif status == 429:
+            raise RateLimited(body)
+        elif status == 404:
+            raise not_found(body)
+        elif not status == 200:
+            raise Exception(body)
+
+    def _auth_headers(self):
+        credentials = '{}:{}'.format(self._repo.artifactory_user, self._repo.artifactory_key)
+        return {'Authorization': 'Basic {}'.format(base64.b64encode(credentials.encode('utf-8')).decode('ascii'))}
+
+class AsyncQuayRepo(_AsyncRepo):
+    """ Async interface to quay.io images using the quay repository tag api
+    """
+    BACKEND = 'quay'
+
+    def __init__(self, image, session=None):
+        super().__init__(session)
+        self.image = image
+        self._repo = QuayRepo(image)
+
+    @tracing.traced('get_image_digest')
+    async def get_image_digest(self):
+        return await self._get_digest(manifest_list=False)
+
+    @tracing.traced('get_manifest_list_digest')
+    async def get_manifest_list_digest(self):
+        return await self._get_digest(manifest_list=True)
+
+    @tracing.traced('get_raw_manifest_list')
+    async def get_raw_manifest_list(self):
+        """ Return the docker manifest list in json format, read from the quay.io v2 registry api
+
+        :raises ManifestListNotFound: No manifest list exists for the specified image.
+
+        :returns: manifest.list.json content
+        :rtype: dict
+        """
+        headers = {'accept': DockerRepo.MANIFEST_LIST_MEDIA_TYPE}
+        status, headers, body = await self._get(self._repo._get_manifest_url(), headers=headers)
+        self._repo._check_response(status, body, manifest_list=True)
+        if 'manifest.list' in headers['Content-Type']:
+            return json.loads(body)
+        else:
+            raise ManifestListNotFound('No manifest for: ' + self.image.get_image())
+
+    async def _get_digest(self, manifest_list):
+        status, _, body = await self._get(self._repo._get_tag_url())
+        self._repo._check_response(status, body, manifest_list)
+        return self._repo._select_digest(json.loads(body)['tags'], manifest_list)
+
+class AsyncDockerRepo(_AsyncRepo):
+    """ Async interface to docker hub images allowing one to query image and manifest list digests
+        as well as get the raw manifest list in json format.
+    """
+    BACKEND = 'docker'
+    # Token requests in flight, per scope
+    _token_flight = SingleFlight()
+
+    def __init__(self, image, session=None):
+        super().__init__(session)
+        self.image = image
+        self._repo = DockerRepo(image)
+
+    @tracing.traced('get_image_digest')
+    async def get_image_digest(self):
+        return await self._get_digest(manifest_list=False)
+
+    @tracing.traced('get_manifest_list_digest')
+    async def get_manifest_list_digest(self):
+        return await self._get_digest(manifest_list=True)
+
+    @tracing.traced('get_raw_manifest_list')
+    async def get_raw_manifest_list(self):
+        """ Return the docker manifest list in json format
+
+        :raises ManifestListNotFound: No manifest list exists for the specified image.
+
+        :returns: manifest.list.json content
+        :rtype: dict
+        """
+        token = await self._get_token()
+        headers, body = await self._get_manifest(token, self._repo.MANIFEST_LIST_MEDIA_TYPE)
+        if 'manifest.list' in headers['Content-Type']:
+            return json.loads(body)
+        else:
+            raise ManifestListNotFound('No manifest for: ' + self.image.get_image())
+
+    async def resolve_manifest(self):
+        """ Resolve the manifest for the image tag with a single HEAD request, see DockerRepo.resolve_manifest
+
+        :rtype: ManifestDescriptor
+        """
+        token = await self._get_token()
+        status, headers, _ = await self._get(self._repo._get_manifest_url(), headers=self._repo._get_resolve_headers(token), method='HEAD')
+        return self._repo._to_manifest_descriptor(status, headers)
+
+    async def _get_digest(self, manifest_list):
+        return self._repo._select_digest(await self.resolve_manifest(), manifest_list)
+
+    async def _get_token(self):
+        # Shares the token cache with the blocking DockerRepo. Concurrent lookups missing the same scope wait for a
+        # single token request, like DockerTokenCache.get_token does for blocking callers
+        scope = self._repo._get_token_scope()
+        token = self._repo._token_cache.get(scope)
+        if token is not None:
+            return token
+        return await self._token_flight.do_async(('token', scope), lambda: self._fetch_token(scope))
+
+    async def _fetch_token(self, scope):
+        # A request that finished just before this one started may have stored the token already
+        token = self._repo._token_cache.get(scope)
+        if token is not None:
+            return token
+        status, _, body = await self._get(self._repo._get_token_url())
+        if status == 429:
+            raise RateLimited(body)
+        elif not status == 200:
+            raise MissingCredentials(body)
+        return self._repo._token_cache.put(scope, json.loads(body))
+
+    async def _get_manifest(self, token, media_type):
+        headers = {'accept': media_type, 'Authorization': 'Bearer {}'.format(token)}
+        status, headers, body = await self._get(self._repo._get_manifest_url(), headers=headers)
+        if status == 404:
+            raise ManifestNotFound(body)
+        elif status == 429:
+            raise RateLimited(body)
+        elif not status == 200:
+            raise Exception(body)
+        return headers, body
@@ -0,0 +1,189 @@
+from .csv import ClusterServiceVersion
+from .images import Image
+from .mirrors import MirrorReport
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os, time
+
+class TransformSpec:
+    """ Changes to apply to every bundle in a bulk run. Only plain data is kept so the spec can be sent to worker
+        processes.
+
+        Fields left as None are not changed. When a version is set without replaces, spec.replaces is removed, the same
+        as ClusterServiceVersion(csv, target_version=...).
+    """
+    def __init__(self, version=None, replaces=None, skiprange=None, pull_secrets=None, image_overrides=None, related_images=False, mirrors=None):
+        """
+        :param version: Target version in semver format X.Y.Z
+        :type version: string
+
+        :param replaces: Versioned name of the csv this csv replaces
+        :type replaces: string
+
+        :param skiprange: Value for the olm.skipRange annotation
+        :type skiprange: string
+
+        :param pull_secrets: Image pull secret(s) to set on all deployments, replacing existing ones
+        :type pull_secrets: string, list
+
+        :param image_overrides: Replacement images, keyed by the full image they replace, i.e.
+                                {'quay.io/org/operator:1.0': 'quay.io/org/operator@sha256:...'}. Applies to operator
+                                container images, olm.relatedImage annotations and RELATED_IMAGE_* env vars
+        :type image_overrides: dict
+
+        :param related_images: Regenerate spec.relatedImages from the olm.relatedImage annotations (default: {False})
+        :type related_images: bool
+
+        :param mirrors: Rewrite all images to their mirrors, after image_overrides
+        :type mirrors: MirrorMap
+        """
+        self.version = version
+        self.replaces = replaces
+        self.skiprange = skiprange
+        self.pull_secrets = pull_secrets
+        self.image_overrides = dict(image_overrides or {})
+        self.related_images = related_images
+        self.mirrors = mirrors
+
+    def apply(self, csv, mirror_report=None):
+        """Apply the spec to a ClusterServiceVersion
+
+        :param csv: The csv to modify
+        :type csv: ClusterServiceVersion
+
+        :param mirror_report: Collects the images rewritten by mirrors
+        :type mirror_report: MirrorReport
+
+        :return: Number of images replaced
+        :rtype: int
+        """
+        if self.skiprange is not None:
+            csv.set_skiprange(self.skiprange)
+        if self.replaces is not None:
+            csv.set_replaces(self.replaces)
+        if self.version is not None:
+            csv.set_version(self.version)
+        if self.pull_secrets:
+            csv.set_image_pullsecret(self.pull_secrets)
+
+        replaced = 0
+        if self.image_overrides:
+            for images in (csv.operator_images, csv.annotation_related_images, csv.env_related_images):
+                for i, image in enumerate(images):
+                    new = self.image_overrides.get(image.image)
+                    if new is not None and new != image.image:
+                        images[i] = Image(name=image.name, image=new, deployment=image.deployment, container=image.container)
+                        replaced += 1
+        if self.related_images:
+            csv.generate_spec_relatedImages()
+        if self.mirrors is not None:
+            if mirror_report is None:
+                mirror_report = MirrorReport()
+            # The report may already hold matches of other CSVs
+            before = len(mirror_report.matches)
+            replaced += len(csv.apply_mirrors(self.mirrors, mirror_report).matches) - before
+        return replaced
+
+class BundleResult:
+    """ Summary of processing one CSV file. Kept small since it is sent back from the worker process.
+        Failures are captured in `error` rather than raised so one bad bundle does not abort the run.
+    """
+    def __init__(self, path, output=None, name=None, version=None, images_replaced=0, error=None, elapsed=None, mirrored=None):
+        self.path = path
+        self.output = output
+        self.name = name
+        self.version = version
+        self.images_replaced = images_replaced
+        self.error = error
+        self.elapsed = elapsed
+        # Images rewritten per mirror rule source, {source: count}
+        self.mirrored = mirrored or {}
+
+    def __repr__(self):
+        if self.error is not None:
+            return '<BundleResult {} error={}>'.format(self.path, self.error)
+        return '<BundleResult {} name={}>'.format(self.path, self.name)
+
+    def ok(self):
+        """Returns True if the bundle was transformed and written
+
+        :rtype: bool
+        """
+        return self.error is None
+
+def process_bundle(path, spec, output=None):
+    """Load a CSV file, apply spec and write the result
+
+    :param path: CSV yaml file
+    :type path: string
+
+    :param spec: Changes to apply
+    :type spec: TransformSpec
+
+    :param output: Destination file, defaults to overwriting path
+    :type output: string
+
+    :rtype: BundleResult
+    """
+    start = time.monotonic()
+    output = output or path
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        csv = ClusterServiceVersion.from_path(path)
+        mirror_report = MirrorReport()
+        replaced = spec.apply(csv, mirror_report)
+        csv.write_to(output)
+        return BundleResult(path, output=output, name=csv.versioned_name or csv.original_csv['metadata']['name'],
+                            version=csv.version or None, images_replaced=replaced, elapsed=time.monotonic() - start,
+                            mirrored=mirror_report.get_rule_counts())
+    except Exception as e:
+        # Exceptions may not survive pickling, send back a description instead
+        return BundleResult(path, error='{}: {}'.format(type(e).__name__, e), elapsed=time.monotonic() - start)
+
+def process_bundles(paths, spec, max_workers=None, output_dir=None):
+    """Transform many CSV files in parallel worker processes, yielding results as they complete.
+
+    YAML parsing and dumping is CPU bound, so the files are spread over a process pool rather than threads.
+    Each worker reads, transforms and writes its file itself and only returns a BundleResult.
+
+    Usage::
+
+        spec = TransformSpec(version='2.1.2', replaces='my-operator.v2.1.1', pull_secrets='my-secret')
+        for result in process_bundles(glob.glob('bundles/*/manifests/*.clusterserviceversion.yaml'), spec):
+            if not result.ok():
+                print(result.path, result.error)
+
+    :param paths: CSV yaml files
+    :type paths: list
+
+    :param spec: Changes to apply to every file
+    :type spec: TransformSpec
+
+    :param max_workers: Number of worker processes (default: {os.cpu_count()})
+    :type max_workers: int
+
+    :param output_dir: Write results here instead of overwriting the inputs, keeping their paths relative to the
+                       directory the inputs have in common
+    :type output_dir: string
+
+    :return: Generator yielding one BundleResult per path
+    :rtype: generator
+    """
+    if max_workers is not None and max_workers < 1:
+        raise ValueError('max_workers must be at least 1')
+    paths = list(paths)
+    if not paths:
+        return
+    if output_dir is not None:
+        # Bundles are usually laid out as <operator>/<version>/manifests/*.clusterserviceversion.yaml with repeating
+        # file names, so keep the directory structure below the common parent
+        common = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+
+    with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, len(paths))) as executor:
+        futures = []
+        for path in paths:
+            output = None
+            if output_dir is not None:
+                output = os.path.join(output_dir, os.path.relpath(os.path.abspath(path), common))
+            futures.append(executor.submit(process_bundle, path, spec, output))
+        for future in as_completed(futures):
+            yield future.result()
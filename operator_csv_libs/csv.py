@@ -1,25 +1,59 @@
-import logging, sys, copy, yaml
-from .images import Image
+import logging, sys, copy, io, yaml
+from .images import Image, ImageSet
+from .imagerepo import PIN_IMAGE, pin_images
+from .mirrors import MirrorReport
+from . import yamlpatch
+
+# Use the LibYAML bindings when PyYAML was built with them
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _FastDumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _FastDumper
 
 class _literal(str):
     pass
 
 def _literal_presenter(dumper, data):
-    return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
+    # The LibYAML emitter only accepts plain str values
+    return dumper.represent_scalar('tag:yaml.org,2002:str', str(data), style='|')
+
+class _PyCSVDumper(yaml.SafeDumper):
+    """ Pure python dumper writing _literal strings as literal blocks """
+
+class _CSVDumper(_FastDumper):
+    """ LibYAML dumper, if available, writing _literal strings as literal blocks """
+
+_PyCSVDumper.add_representer(_literal, _literal_presenter)
+_CSVDumper.add_representer(_literal, _literal_presenter)
+
+# Used to check whether a string can be written as a literal block, see _get_dumper
+_scalar_analyzer = yaml.emitter.Emitter(io.StringIO())
 
 class ClusterServiceVersion:
     LATEST_IMAGE_INDICATOR   = '-latest'
     RELATED_IMAGE_IDENTIFIER = 'olm.relatedImage.'
     TAGGED_RELATED_IMAGE_IDENTIFIER = 'olm.tag.relatedImage.'
+    RELATED_IMAGE_ENV_PREFIX = 'RELATED_IMAGE_'
 
     def __init__(self, csv, name=None, target_version=None, replaces=None, skiprange=None, logger=None):
         self.original_csv = csv
-        self.csv = copy.deepcopy(self.original_csv)
+
+        # Copy on write: self._csv shares all subtrees with original_csv until they are modified. _mutable() copies
+        # the containers along the path being modified, and remembers them in _owned so they are only copied once.
+        # Subtrees in _deep_owned were deep copied and everything below them is owned as well.
+        self._csv = dict(csv)
+        self._owned = {id(self._csv): self._csv}
+        self._deep_owned = {}
+        self._detached = False
+
+        # (text, spans) of the file this CSV was loaded from, kept by from_path(patchable=True) for write_to(patch=True)
+        self._source = None
 
         self.original_operator_images    = []
         self.operator_images             = []
         self.annotation_related_images   = []
         self.spec_related_images         = []
+        self.env_related_images          = []
 
         # Holds the version information
         self.version = ''
@@ -33,7 +67,7 @@ class ClusterServiceVersion:
         if name:
             self.name = name
         else:
-            self.name = self.csv['metadata']['name'].split('.')[0]
+            self.name = self._csv['metadata']['name'].split('.')[0]
 
         if skiprange:
             self.skiprange = skiprange
@@ -47,9 +81,22 @@ class ClusterServiceVersion:
             self._setup_basic_logger()
 
         # Extract some other useful info
-        self._manipulate_tag_images()
-        self._get_operator_images()
-        self._get_related_images()
+        self._scan_deployments()
+
+    @property
+    def csv(self):
+        """ The CSV as a dict. Accessing it gives up copy on write sharing for the whole CSV, so that the returned
+            dict can be modified freely without affecting original_csv. Prefer get_updated_csv() for read access.
+        """
+        if not self._detached:
+            self._detach(self._csv)
+            self._detached = True
+        return self._csv
+
+    @csv.setter
+    def csv(self, csv):
+        self._csv = csv
+        self._detached = True
 
     def set_deployments_annotations(self, key=None, value=None):
         """Set key with value passed in for each deployment in the CSV
@@ -60,10 +107,10 @@ class ClusterServiceVersion:
         :param value: Value that will be assigned to the key passed in
         :type value: string
         """
-        for d in self.csv['spec']['install']['spec']['deployments']:
+        for i, d in enumerate(self._get_deployments()):
             if not 'annotations' in d['spec']['template']['metadata']:
                 continue
-            d['spec']['template']['metadata']['annotations'][key] = value
+            self._mutable_deployment(i, 'spec', 'template', 'metadata', 'annotations')[key] = value
 
     def set_container_image_annotation(self, image):
         """ Set metadata.annotations.containerImage with Image.image passed in
@@ -71,7 +118,7 @@ class ClusterServiceVersion:
         :param image: Image that will be assigned to metadata.annotations.containerImage
         :type image: Image
         """
-        self.csv['metadata']['annotations']['containerImage'] = image.image
+        self._mutable('metadata', 'annotations')['containerImage'] = image.image
 
     def set_version(self, version):
         """Set the target version for the CSV
@@ -90,7 +137,16 @@ class ClusterServiceVersion:
         :type replaces: string
         """
         self.replaces = replaces
-        self.csv['spec']['replaces'] = self.replaces
+        self._mutable('spec')['replaces'] = self.replaces
+
+    def set_skiprange(self, skiprange):
+        """ Set the olm.skipRange annotation
+
+        :param skiprange: Semver range of versions this csv can skip, i.e. '>=1.0.0 <1.2.0'
+        :type skiprange: string
+        """
+        self.skiprange = skiprange
+        self._mutable('metadata', 'annotations')['olm.skipRange'] = self.skiprange
 
     def set_image_pullsecret(self, name):
         """ Set the image pull secret for all operator deployment deployments. Overwrites any existing pull secret
@@ -103,8 +159,8 @@ class ClusterServiceVersion:
         else:
             p = [ {'name': x} for x in name ]
 
-        for d in self.csv['spec']['install']['spec']['deployments']:
-            d['spec']['template']['spec']['imagePullSecrets'] = p
+        for i in range(len(self._get_deployments())):
+            self._mutable_deployment(i, 'spec', 'template', 'spec')['imagePullSecrets'] = p
 
     def add_image_pullsecret(self, name):
         """ Add image pull secret for all operator deployment deployments. Existing pull secrets will be kept
@@ -117,15 +173,15 @@ class ClusterServiceVersion:
         else:
             p = [ {'name': x} for x in name ]
 
-        for d in self.csv['spec']['install']['spec']['deployments']:
+        for i, d in enumerate(self._get_deployments()):
             if not 'imagePullSecrets' in d['spec']['template']['spec']:
                 # If imagepullsecret is missing, set it
-                d['spec']['template']['spec']['imagePullSecrets'] = p
+                self._mutable_deployment(i, 'spec', 'template', 'spec')['imagePullSecrets'] = p
             else:
                 # If imagepullsecret exists, add to the list
                 if not(all(x in p for x in d['spec']['template']['spec']['imagePullSecrets'])):
                     try:
-                        d['spec']['template']['spec']['imagePullSecrets'].extend(p)
+                        self._mutable_deployment(i, 'spec', 'template', 'spec', 'imagePullSecrets').extend(p)
                     except TypeError:
                         print('imagePullSecrets is not of type list')
 
@@ -134,9 +190,9 @@ class ClusterServiceVersion:
         """ Generates spec.relatedImages based on information found in operator deployment annotations marked with 'olm.relatedImage.*'
         """
         self.spec_related_images=self.annotation_related_images
-        if 'relatedImages' in self.csv['spec']:
+        if 'relatedImages' in self._csv['spec']:
             self.log.debug('Resetting existing spec.relatedImages')
-        self.csv['spec']['relatedImages'] = []
+        related_images = self._mutable('spec')['relatedImages'] = []
 
         # Hold dict of all names and images so we can find conflicting information
         images_validation = {}
@@ -146,21 +202,80 @@ class ClusterServiceVersion:
                 if r.image != images_validation[r.name]:
                     self.log.warning('Validation error: Found different values for {}: {} and {}'.format(r.name, r.image, images_validation[r.name]))
                     self.log.debug('overwriting')
-                    self.csv['spec']['relatedImages'][r.name] = r.image
+                    related_images[r.name] = r.image
                     continue
 
-            self.csv['spec']['relatedImages'].append({
+            related_images.append({
                 'name':     r.name,
                 'image':    r.image
             })
 
+    def apply_mirrors(self, mirrors, report=None):
+        """ Rewrite all images to their mirrors in one pass: operator container images, olm.relatedImage annotations,
+            RELATED_IMAGE_* env vars and spec.relatedImages
+
+        :param mirrors: Source to mirror rules
+        :type mirrors: MirrorMap
+
+        :param report: Report to add the results to (default: {new report})
+        :type report: MirrorReport
+
+        :return: Which images were rewritten by which rule, and the images no rule matched
+        :rtype: MirrorReport
+        """
+        if report is None:
+            report = MirrorReport()
+        for images in (self.operator_images, self.annotation_related_images, self.env_related_images):
+            for i, image in enumerate(images):
+                rewrite = mirrors.get_rewrite(image.image)
+                if rewrite is None:
+                    report.add_unmatched(image.image)
+                    continue
+                images[i] = Image(name=image.name, image=rewrite[0], deployment=image.deployment, container=image.container)
+                report.add_match(rewrite[1], image.image, rewrite[0], image.name, image.deployment, image.container)
+
+        # spec.relatedImages has no Image objects to write back from, rewrite the entries directly
+        for i, entry in enumerate(self._csv['spec'].get('relatedImages') or ()):
+            rewrite = mirrors.get_rewrite(entry['image'])
+            if rewrite is None:
+                report.add_unmatched(entry['image'])
+                continue
+            self._mutable('spec', 'relatedImages', i)['image'] = rewrite[0]
+            report.add_match(rewrite[1], entry['image'], rewrite[0], entry.get('name'))
+        return report
+
+    def pin_digests(self, max_workers=8, policy=PIN_IMAGE, cache=None, quay_tag_index=None):
+        """ Pin every image of the csv to a digest and regenerate spec.relatedImages. Operator, olm.relatedImage and
+            RELATED_IMAGE_* images are deduplicated by reference so each is resolved once, concurrently
+
+        :param max_workers: Maximum number of concurrent registry lookups (default: {8})
+        :type max_workers: int
+
+        :param policy: PIN_IMAGE, PIN_MANIFEST_LIST or PIN_PREFER_MANIFEST_LIST from imagerepo (default: {PIN_IMAGE})
+        :type policy: string
+
+        :param cache: DigestCache to consult before querying the registry (default: {ImageRepo.cache})
+        :type cache: DigestCache
+
+        :param quay_tag_index: Answer quay lookups from repository tag listings (default: {None})
+        :type quay_tag_index: QuayTagIndex
+
+        :return: Digest, latency and failure per image
+        :rtype: PinReport
+        """
+        images = ImageSet(self.operator_images + self.annotation_related_images + self.env_related_images)
+        report = pin_images(images, policy, max_workers=max_workers, cache=cache, quay_tag_index=quay_tag_index)
+        self.generate_spec_relatedImages()
+        return report
+
     def get_owned_crds(self):
         """ Returns a list of owned CustomResourceDefinitions
 
         :return: List of owned custom resource definitions as dict object
         :rtype: list
         """
-        return self.csv['spec']['customresourcedefinitions']['owned']
+        # Callers may modify the returned list, so hand out a private copy that is part of this csv
+        return self._detach_subtree('spec', 'customresourcedefinitions', 'owned')
 
     def get_updated_csv(self):
         """ Returns the updated CSV object
@@ -168,20 +283,101 @@ class ClusterServiceVersion:
         :return: CSV with updated version and image information
         :rtype: dict
         """
-        # Merge in the updates that are done to Operatorimages and Operandimages
-        self._update_operator_container_images()
-        self._update_operand_images()
+        self._write_back_images()
+
+        # Unmodified subtrees are still shared with original_csv
+        return copy.deepcopy(self._csv)
+
+    @classmethod
+    def from_path(cls, path, patchable=False, **kwargs):
+        """ Load a ClusterServiceVersion from a yaml file, using the LibYAML parser when available
+
+        :param path: Path to the CSV yaml file
+        :type path: string
+
+        :param patchable: Keep the source text and the position of every scalar, so write_to(patch=True) can write
+                          back only the values that changed (default: {False})
+        :type patchable: bool
 
-        return self.csv
+        :param kwargs: Passed on to ClusterServiceVersion(), i.e. name, target_version, replaces, skiprange, logger
+
+        :rtype: ClusterServiceVersion
+        """
+        with open(path, 'r', encoding='utf-8') as stream:
+            if not patchable:
+                return cls(yaml.load(stream, Loader=_Loader), **kwargs)
+            text = stream.read()
+        data, spans = yamlpatch.load_with_spans(text, _Loader)
+        csv = cls(data, **kwargs)
+        csv._source = (text, spans)
+        return csv
+
+    def write_to(self, path, patch=False):
+        """ Write the updated CSV to a yaml file, using the LibYAML emitter when available
+
+            The data and the `alm-examples: |-` block are the same as with get_formatted_csv, but LibYAML may fold
+            long quoted strings at different points than the pure python emitter.
+
+            With patch=True and a CSV loaded with from_path(patchable=True), the original file is written back with
+            only the changed values replaced, leaving key order, comments and formatting alone. If anything but string
+            values changed, i.e. keys were added or removed, the whole CSV is dumped as usual.
+
+        :param path: Destination file
+        :type path: string
+
+        :param patch: Only replace changed values in the source text where possible (default: {False})
+        :type patch: bool
+
+        :return: True if the file was patched, False if the whole CSV was dumped
+        :rtype: bool
+        """
+        patched = self._get_patched_text() if patch else None
+        with open(path, 'w', encoding='utf-8') as stream:
+            if patched is not None:
+                stream.write(patched)
+                return True
+            formatted_csv = self._get_formatted_data()
+            yaml.dump(formatted_csv, stream, Dumper=self._get_dumper(formatted_csv), default_flow_style=False)
+            return False
+
+    def get_patched_csv(self):
+        """ Returns the source text of a CSV loaded with from_path(patchable=True) with only the changed values
+            replaced. Falls back to get_formatted_csv when that is not possible.
+
+        :rtype: string
+        """
+        patched = self._get_patched_text()
+        if patched is None:
+            return self.get_formatted_csv()
+        return patched
+
+    def _get_patched_text(self):
+        if self._source is None:
+            return None
+        self._write_back_images()
+        text, spans = self._source
+        return yamlpatch.patch(text, spans, self.original_csv, self._csv)
 
     def get_formatted_csv(self):
         """ Returns a stringified save ready formatted ClusterServiceVersion
             This allows maintaining the format of the `alm-examples: |-` block
         """
-        yaml.add_representer(_literal, _literal_presenter)
+        return yaml.dump(self._get_formatted_data(), Dumper=_PyCSVDumper, default_flow_style=False)
+
+    def _get_formatted_data(self):
         formatted_csv = self.get_updated_csv()
-        formatted_csv['metadata']['annotations']['alm-examples'] = _literal(formatted_csv['metadata']['annotations']['alm-examples'])
-        return yaml.dump(formatted_csv, default_flow_style=False)
+        annotations = formatted_csv['metadata'].get('annotations') or {}
+        if 'alm-examples' in annotations:
+            annotations['alm-examples'] = _literal(annotations['alm-examples'])
+        return formatted_csv
+
+    def _get_dumper(self, formatted_csv):
+        # When alm-examples can't be a literal block (i.e. trailing spaces) both emitters fall back to a quoted
+        # string but fold it differently. Use the pure python emitter then so the block is always written the same
+        alm_examples = (formatted_csv['metadata'].get('annotations') or {}).get('alm-examples')
+        if alm_examples is not None and not _scalar_analyzer.analyze_scalar(str(alm_examples)).allow_block:
+            return _PyCSVDumper
+        return _CSVDumper
 
     def get_replaces(self):
         """ Return String
@@ -189,7 +385,35 @@ class ClusterServiceVersion:
         :return: Returns the csv file name with previous version
         :rtype: string
         """
-        return self.csv['spec']['replaces']
+        return self._csv['spec']['replaces']
+
+    def get_versioned_name(self):
+        """ Returns metadata.name, i.e. my-operator.v1.2.3
+
+        :rtype: string
+        """
+        return self._csv['metadata']['name']
+
+    def get_version(self):
+        """ Returns spec.version, or None if the csv has no version
+
+        :rtype: string
+        """
+        return self._csv['spec'].get('version')
+
+    def get_skiprange(self):
+        """ Returns the olm.skipRange annotation, or None if there is none
+
+        :rtype: string
+        """
+        return (self._csv['metadata'].get('annotations') or {}).get('olm.skipRange')
+
+    def get_skips(self):
+        """ Returns spec.skips, the versioned names of csvs this csv can be upgraded to from directly
+
+        :rtype: list
+        """
+        return list(self._csv['spec'].get('skips') or ())
 
     def get_operator_images(self):
         """ Return a list of images used for operator deployment
@@ -207,6 +431,14 @@ class ClusterServiceVersion:
         """
         return self.annotation_related_images
 
+    def get_env_related_images(self):
+        """ Return a list of images found in 'RELATED_IMAGE_*' environment variables of the operator containers
+
+        :return: Returns a List of Images as defined in Images class, named after the environment variable
+        :rtype: list
+        """
+        return self.env_related_images
+
     def get_operator_deployments(self, api_version='apps/v1', kind='Deployment'):
         """ Return a list of kubernetes deployment objects constructed from the CSV deployments section
 
@@ -215,7 +447,7 @@ class ClusterServiceVersion:
         """
         # Extract the deployment(s)
         deployments = []
-        for d in self.csv['spec']['install']['spec']['deployments']:
+        for d in self._get_deployments():
             deployments.append(copy.deepcopy(d))
 
         # Adjust the dict to make it valid deployment object
@@ -231,76 +463,245 @@ class ClusterServiceVersion:
     def _update_version_references(self):
         """ Update the version specifc fields based on self.version
         """
-        self.csv['spec']['version'] = self.version
-        self.csv['metadata']['name'] = self.versioned_name
+        spec = self._mutable('spec')
+        spec['version'] = self.version
+        self._mutable('metadata')['name'] = self.versioned_name
         if len(self.versioned_name) > 63:
             if hasattr(self, 'log'):
                 # Fixing a weird issue where the logger is not available when we are constructing a csv object. I even tried switching the
                 # order of parameters when creating the csv object in create-release.py
                 self.log.warning('{} is longer than 63 characters, and may lead to problems'.format(self.name))
         if self.skiprange:
-            self.csv['metadata']['annotations']['olm.skipRange'] = self.skiprange
+            self._mutable('metadata', 'annotations')['olm.skipRange'] = self.skiprange
         if self.replaces:
-            self.csv['spec']['replaces'] = self.replaces
+            spec['replaces'] = self.replaces
         else:
-            if 'replaces' in self.csv['spec']:
-                del(self.csv['spec']['replaces'])
-
-    def _get_operator_images(self):
-        """[Populate a list of all images that are used for the operator deployment]
-        """
-        for d in self.csv['spec']['install']['spec']['deployments']:
-            for c in d['spec']['template']['spec']['containers']:
-                o = Image(
-                    deployment = d['name'],
-                    container  = c['name'],
-                    image      = c['image']
-                )
+            if 'replaces' in spec:
+                del(spec['replaces'])
+
+    def _scan_deployments(self):
+        """ Visit every deployment, container and annotation once to collect operator images, olm.relatedImage
+            annotations, olm.tag.relatedImage overrides and RELATED_IMAGE_* env vars, and to build the write-back index
+        """
+        related, related_len = self.RELATED_IMAGE_IDENTIFIER, len(self.RELATED_IMAGE_IDENTIFIER)
+        tagged, tagged_len = self.TAGGED_RELATED_IMAGE_IDENTIFIER, len(self.TAGGED_RELATED_IMAGE_IDENTIFIER)
+        env_prefix = self.RELATED_IMAGE_ENV_PREFIX
+
+        deployments = self._get_deployments()
+        self._deployment_index = {}
+        self._container_index = {}
+        self._env_index = {}
+        self._indexed_deployments = len(deployments)
+
+        tagged_images = {}
+        # (deployment index, {annotation: image}) for every deployment with annotations
+        annotated = []
+        for di, d in enumerate(deployments):
+            deployment = d['name']
+            self._deployment_index.setdefault(deployment, []).append(di)
+
+            for ci, c in enumerate(d['spec']['template']['spec']['containers']):
+                container = c['name']
+                self._container_index.setdefault((deployment, container), []).append((di, ci))
+                o = Image(deployment=deployment, container=container, image=c['image'])
                 self.original_operator_images.append(o)
                 self.operator_images.append(o)
 
-    def _get_related_images(self):
-        # Capture related images from annotations
-        for d in self.csv['spec']['install']['spec']['deployments']:
-            if not 'annotations' in d['spec']['template']['metadata']:
-                continue
-            for a in d['spec']['template']['metadata']['annotations']:
-                if a.startswith(self.RELATED_IMAGE_IDENTIFIER):
-                    o = Image(
-                        deployment  = d['name'],
-                        name        = a.replace(self.RELATED_IMAGE_IDENTIFIER, ''),
-                        image       = d['spec']['template']['metadata']['annotations'][a]
-                    )
-                    self.annotation_related_images.append(o)
-
-    def _manipulate_tag_images(self):
-        taggedImages = {}
-        for d in self.csv['spec']['install']['spec']['deployments']:
-            if not 'annotations' in d['spec']['template']['metadata']:
-                continue
-            for a in d['spec']['template']['metadata']['annotations']:
-                if a.startswith(self.TAGGED_RELATED_IMAGE_IDENTIFIER):
-                    taggedImages[a.replace(self.TAGGED_RELATED_IMAGE_IDENTIFIER, self.RELATED_IMAGE_IDENTIFIER)] = d['spec']['template']['metadata']['annotations'][a]
-        for d in self.csv['spec']['install']['spec']['deployments']:
+                for ei, e in enumerate(c.get('env') or ()):
+                    # Only literal values, valueFrom references and empty values can't be pinned
+                    if e['name'].startswith(env_prefix) and isinstance(e.get('value'), str) and e['value']:
+                        self._env_index.setdefault((deployment, container, e['name']), []).append((di, ci, ei))
+                        self.env_related_images.append(Image(name=e['name'], image=e['value'], deployment=deployment, container=container))
+
             if not 'annotations' in d['spec']['template']['metadata']:
                 continue
-            for i in taggedImages:
-                d['spec']['template']['metadata']['annotations'][i] = taggedImages[i]
+            images = {}
+            for a, value in d['spec']['template']['metadata']['annotations'].items():
+                if a.startswith(related):
+                    images[a] = value
+                elif a.startswith(tagged):
+                    tagged_images[related + a[tagged_len:]] = value
+            annotated.append((di, images))
+
+        # Tagged images from any deployment replace or add the matching olm.relatedImage annotation in all deployments
+        for di, images in annotated:
+            if tagged_images:
+                current = deployments[di]['spec']['template']['metadata']['annotations']
+                if any(current.get(a) != value for a, value in tagged_images.items()):
+                    self._mutable_deployment(di, 'spec', 'template', 'metadata', 'annotations').update(tagged_images)
+                images.update(tagged_images)
+            deployment = deployments[di]['name']
+            for a, value in images.items():
+                # An empty annotation has no image to pin, leave it as it is rather than failing the whole CSV
+                if isinstance(value, str) and value:
+                    self.annotation_related_images.append(Image(deployment=deployment, name=a[related_len:], image=value))
+
+    def _write_back_images(self):
+        # Merge in the updates that are done to Operatorimages and Operandimages
+        self._update_operator_container_images()
+        self._update_operand_images()
+        self._update_env_related_images()
 
     def _update_operator_container_images(self):
+        deployments = self._get_deployments()
+        rebuilt = False
         for image in self.operator_images:
-            for d in self.csv['spec']['install']['spec']['deployments']:
-                if d['name'] == image.deployment:
-                    for c in d['spec']['template']['spec']['containers']:
-                        if c['name'] == image.container:
-                            c['image'] = image.image
+            locations = self._find_containers(image.deployment, image.container)
+            if locations is None:
+                # Deployments changed since the index was built. Rebuild at most once per pass
+                if rebuilt:
+                    continue
+                self._build_index()
+                rebuilt = True
+                locations = self._container_index.get((image.deployment, image.container), ())
+            for di, ci in locations:
+                # Only copy the container when the image actually changed
+                if deployments[di]['spec']['template']['spec']['containers'][ci]['image'] != image.image:
+                    self._mutable_deployment(di, 'spec', 'template', 'spec', 'containers', ci)['image'] = image.image
 
     def _update_operand_images(self):
         # Update the annotations that has been updated
+        deployments = self._get_deployments()
+        rebuilt = False
         for image in self.annotation_related_images:
-            for d in self.csv['spec']['install']['spec']['deployments']:
-                if d['name'] == image.deployment:
-                    d['spec']['template']['metadata']['annotations'][self.RELATED_IMAGE_IDENTIFIER + image.name] = image.image
+            locations = self._find_deployments(image.deployment)
+            if locations is None:
+                if rebuilt:
+                    continue
+                self._build_index()
+                rebuilt = True
+                locations = self._deployment_index.get(image.deployment, ())
+            key = self.RELATED_IMAGE_IDENTIFIER + image.name
+            for di in locations:
+                if deployments[di]['spec']['template']['metadata'].get('annotations', {}).get(key) != image.image:
+                    self._mutable_deployment(di, 'spec', 'template', 'metadata', 'annotations')[key] = image.image
+
+    def _update_env_related_images(self):
+        deployments = self._get_deployments()
+        rebuilt = False
+        for image in self.env_related_images:
+            key = (image.deployment, image.container, image.name)
+            locations = self._find_env(key)
+            if locations is None:
+                if rebuilt:
+                    continue
+                self._build_index()
+                rebuilt = True
+                locations = self._env_index.get(key, ())
+            for di, ci, ei in locations:
+                if deployments[di]['spec']['template']['spec']['containers'][ci]['env'][ei]['value'] != image.image:
+                    self._mutable_deployment(di, 'spec', 'template', 'spec', 'containers', ci, 'env', ei)['value'] = image.image
+
+    def _build_index(self):
+        """ Index deployment name -> [deployment index], (deployment name, container name) -> [(deployment index,
+            container index)] and (deployment, container, env var) -> [(deployment, container, env index)], so images
+            can be written back without scanning every deployment and container
+        """
+        self._deployment_index = {}
+        self._container_index = {}
+        self._env_index = {}
+        self._indexed_deployments = len(self._get_deployments())
+        for di, d in enumerate(self._get_deployments()):
+            self._deployment_index.setdefault(d['name'], []).append(di)
+            for ci, c in enumerate(d['spec']['template']['spec']['containers']):
+                self._container_index.setdefault((d['name'], c['name']), []).append((di, ci))
+                for ei, e in enumerate(c.get('env') or ()):
+                    if e['name'].startswith(self.RELATED_IMAGE_ENV_PREFIX) and 'value' in e:
+                        self._env_index.setdefault((d['name'], c['name'], e['name']), []).append((di, ci, ei))
+
+    def _find_deployments(self, deployment):
+        """ Return the indexed locations of deployment, or None if the index is out of date
+        """
+        locations = self._deployment_index.get(deployment)
+        deployments = self._get_deployments()
+        if locations is None or len(deployments) != self._indexed_deployments:
+            return None
+        for di in locations:
+            if di >= len(deployments) or deployments[di]['name'] != deployment:
+                return None
+        return locations
+
+    def _find_env(self, key):
+        """ Return the indexed locations of a RELATED_IMAGE_* env var, or None if the index is out of date
+        """
+        locations = self._env_index.get(key)
+        deployments = self._get_deployments()
+        if locations is None or len(deployments) != self._indexed_deployments:
+            return None
+        for di, ci, ei in locations:
+            if di >= len(deployments) or deployments[di]['name'] != key[0]:
+                return None
+            containers = deployments[di]['spec']['template']['spec']['containers']
+            if ci >= len(containers) or containers[ci]['name'] != key[1]:
+                return None
+            env = containers[ci].get('env') or ()
+            if ei >= len(env) or env[ei]['name'] != key[2]:
+                return None
+        return locations
+
+    def _find_containers(self, deployment, container):
+        """ Return the indexed locations of the container in deployment, or None if the index is out of date
+        """
+        locations = self._container_index.get((deployment, container))
+        deployments = self._get_deployments()
+        if locations is None or len(deployments) != self._indexed_deployments:
+            return None
+        for di, ci in locations:
+            if di >= len(deployments) or deployments[di]['name'] != deployment:
+                return None
+            containers = deployments[di]['spec']['template']['spec']['containers']
+            if ci >= len(containers) or containers[ci]['name'] != container:
+                return None
+        return locations
+
+    def _get_deployments(self):
+        return self._csv['spec']['install']['spec']['deployments']
+
+    def _mutable_deployment(self, index, *path):
+        return self._mutable('spec', 'install', 'spec', 'deployments', index, *path)
+
+    def _mutable(self, *path):
+        """ Return the container at path in self._csv, copying it and each of its parents that is still shared with
+            original_csv first
+        """
+        node = self._csv
+        owned = self._detached
+        for key in path:
+            child = node[key]
+            if not owned:
+                if id(child) in self._deep_owned:
+                    owned = True
+                elif id(child) not in self._owned:
+                    child = copy.copy(child)
+                    self._owned[id(child)] = child
+                    node[key] = child
+            node = child
+        return node
+
+    def _detach_subtree(self, *path):
+        """ Replace the subtree at path with a deep copy, unless it is already owned entirely, and return it
+        """
+        parent = self._mutable(*path[:-1])
+        node = parent[path[-1]]
+        if self._detached or id(node) in self._deep_owned:
+            return node
+        if id(node) in self._owned:
+            self._detach(node)
+        else:
+            node = parent[path[-1]] = copy.deepcopy(node)
+        self._deep_owned[id(node)] = node
+        return node
+
+    def _detach(self, node):
+        # Deep copy every shared child of an owned container
+        children = node.items() if isinstance(node, dict) else enumerate(node)
+        for key, child in list(children):
+            if not isinstance(child, (dict, list)) or id(child) in self._deep_owned:
+                continue
+            if id(child) in self._owned:
+                self._detach(child)
+            else:
+                node[key] = copy.deepcopy(child)
 
     def _setup_basic_logger(self):
         # Setup logging to stdout if we're not provided a logger
@@ -0,0 +1,205 @@
+from . import tracing
+import os, sqlite3, threading, time
+
+class DigestCache:
+    """ Persistent on-disk cache of tag to digest lookups, backed by sqlite.
+
+        Entries are keyed by the image reference and the lookup type ('image' or 'manifest_list') and expire after
+        `ttl` seconds. The database runs in WAL mode with a busy timeout, so several processes on one host (i.e.
+        parallel CI jobs) can read and write the same cache file. When more than `max_entries` are stored the oldest
+        entries are evicted, down to 90% of `max_entries`. Hits and misses are counted per instance, see `stats()`.
+
+        Failed lookups are never cached.
+    """
+    IMAGE = 'image'
+    MANIFEST_LIST = 'manifest_list'
+
+    DEFAULT_TTL = 24 * 60 * 60
+    DEFAULT_MAX_ENTRIES = 50000
+    # Share of max_entries kept when evicting
+    EVICT_TO = 0.9
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, timeout=30):
+        """
+        :param path: Cache file. Defaults to $XDG_CACHE_HOME/operator-csv-libs/digests.sqlite
+        :type path: string
+
+        :param ttl: Seconds a cached digest stays valid (default: {one day})
+        :type ttl: int
+
+        :param max_entries: Maximum number of entries kept on disk (default: {50000})
+        :type max_entries: int
+
+        :param timeout: Seconds to wait for a lock held by another writer (default: {30})
+        :type timeout: int
+        """
+        if path is None:
+            cache_home = os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+            path = os.path.join(cache_home, 'operator-csv-libs', 'digests.sqlite')
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._stats_lock = threading.Lock()
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS digests (key TEXT PRIMARY KEY, digest TEXT NOT NULL, stored_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS digests_stored_at ON digests (stored_at)')
+            # Estimated number of entries, updated on every put and corrected from the database when evicting
+            self._entries = conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+            self._unchecked = 0
+
+    def get(self, image, lookup):
+        """Return the cached digest for image, or None on a miss or expired entry
+
+        :param image: Image to look up
+        :type image: Image
+
+        :param lookup: DigestCache.IMAGE or DigestCache.MANIFEST_LIST
+        :type lookup: string
+
+        :rtype: string
+        """
+        start = time.perf_counter()
+        row = self._connect().execute('SELECT digest, stored_at FROM digests WHERE key = ?', (self._key(image, lookup),)).fetchone()
+        digest = None
+        if row is None:
+            self._count('misses')
+        elif time.time() - row[1] > self.ttl:
+            self._count('misses')
+            self._count('expired')
+        else:
+            self._count('hits')
+            digest = row[0]
+        if tracing.enabled():
+            tracing.emit(tracing.TraceEvent.CACHE, host=image.get_image_repo().split('/')[0], latency=time.perf_counter() - start,
+                         cache='miss' if digest is None else 'hit')
+        return digest
+
+    def put(self, image, lookup, digest):
+        """Store a resolved digest
+
+        :param image: Image the digest was resolved for
+        :type image: Image
+
+        :param lookup: DigestCache.IMAGE or DigestCache.MANIFEST_LIST
+        :type lookup: string
+
+        :param digest: Digest in format <type>:<hash>
+        :type digest: string
+        """
+        key, stored_at = self._key(image, lookup), time.time()
+        conn = self._connect()
+        with conn:
+            added = conn.execute('UPDATE digests SET digest = ?, stored_at = ? WHERE key = ?', (digest, stored_at, key)).rowcount == 0
+            if added:
+                conn.execute('INSERT OR REPLACE INTO digests (key, digest, stored_at) VALUES (?, ?, ?)', (key, digest, stored_at))
+        if added:
+            with self._stats_lock:
+                self._entries += 1
+                self._unchecked += 1
+                # Recount every so often to notice entries added by other processes
+                check = self._entries > self.max_entries or self._unchecked >= max(1, self.max_entries // 10)
+            if check:
+                self._evict()
+
+    def get_or_fetch(self, image, lookup, fetch):
+        """Return the cached digest or call fetch() and cache its result
+
+        :param fetch: Callable performing the registry lookup
+        :type fetch: callable
+
+        :rtype: string
+        """
+        digest = self.get(image, lookup)
+        if digest is None:
+            digest = fetch()
+            if digest is not None:
+                self.put(image, lookup, digest)
+        return digest
+
+    def purge_expired(self):
+        """Delete all expired entries
+
+        :return: Number of entries removed
+        :rtype: int
+        """
+        conn = self._connect()
+        with conn:
+            purged = conn.execute('DELETE FROM digests WHERE stored_at < ?', (time.time() - self.ttl,)).rowcount
+        with self._stats_lock:
+            self._entries = max(0, self._entries - purged)
+        return purged
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM digests')
+        with self._stats_lock:
+            self._entries = 0
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+
+    def stats(self):
+        """Return hit and miss counters for this instance
+
+        :return: Dict with hits, misses, expired, evicted and hit_rate
+        :rtype: dict
+        """
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _evict(self):
+        # Only counted when this instance's estimate says the cache is full, or after max_entries / 10 new entries.
+        # Other processes add entries too, so the real count decides. Evict the oldest entries down to EVICT_TO of
+        # max_entries, so the next eviction is a while away instead of on every put
+        conn = self._connect()
+        with conn:
+            entries = conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+            evicted = 0
+            if entries > self.max_entries:
+                evicted = conn.execute(
+                    'DELETE FROM digests WHERE key IN (SELECT key FROM digests ORDER BY stored_at LIMIT ?)',
+                    (entries - int(self.max_entries * self.EVICT_TO),)
+                ).rowcount
+        with self._stats_lock:
+            self._entries = entries - evicted
+            self._unchecked = 0
+        if evicted > 0:
+            self._count('evicted', evicted)
+
+    def _key(self, image, lookup):
+        # Tag lookups are what we cache, so always key on the canonical registry/path/name:tag. Equivalent references
+        # (i.e. nginx and docker.io/library/nginx:latest) share one entry
+        return '{}|{}'.format(lookup, image.get_reference().get_tag_key())
+
+    def _count(self, counter, n=1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
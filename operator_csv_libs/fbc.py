@@ -0,0 +1,242 @@
+from .upgradegraph import UpgradeGraph
+import json, yaml
+
+# Use the LibYAML emitter when PyYAML was built with it
+try:
+    from yaml import CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeDumper as _Dumper
+
+# olm.csv.metadata fields and where they come from in the CSV, in the order they are written
+CSV_METADATA_FIELDS = (
+    ('annotations',           ('metadata', 'annotations')),
+    ('apiServiceDefinitions', ('spec', 'apiservicedefinitions')),
+    ('crdDescriptions',       ('spec', 'customresourcedefinitions')),
+    ('description',           ('spec', 'description')),
+    ('displayName',           ('spec', 'displayName')),
+    ('installModes',          ('spec', 'installModes')),
+    ('keywords',              ('spec', 'keywords')),
+    ('labels',                ('metadata', 'labels')),
+    ('links',                 ('spec', 'links')),
+    ('maintainers',           ('spec', 'maintainers')),
+    ('maturity',              ('spec', 'maturity')),
+    ('minKubeVersion',        ('spec', 'minKubeVersion')),
+    ('nativeAPIs',            ('spec', 'nativeAPIs')),
+    ('provider',              ('spec', 'provider')),
+)
+
+class FBCWriter:
+    """ Writes file-based catalog (FBC) documents to a stream as they are produced: olm.package, olm.bundle and
+        olm.channel.
+
+        Only one bundle is held in memory at a time. For channels the writer keeps the upgrade related fields of each
+        bundle written (name, version, replaces, skips, skipRange), which is all write_channels needs.
+
+        Output is deterministic: keys are written in a fixed order and lists the catalog doesn't give an order to are
+        sorted, so writing the same objects again produces identical bytes.
+
+        Usage::
+
+            with open('catalog/my-operator/catalog.json', 'w') as stream:
+                writer = FBCWriter(stream)
+                writer.write_package(package)
+                for path in bundle_paths:
+                    csv = ClusterServiceVersion.from_path(path)
+                    writer.write_bundle(csv, package.operator, images[csv.get_versioned_name()])
+                writer.write_channels(package)
+    """
+    JSON = 'json'
+    YAML = 'yaml'
+
+    def __init__(self, stream, format=JSON):
+        """
+        :param stream: Text stream to write to
+        :type stream: file
+
+        :param format: 'json' for one indented JSON object per document, 'yaml' for '---' separated documents (default: {'json'})
+        :type format: string
+        """
+        if format not in (self.JSON, self.YAML):
+            raise ValueError('Unknown format {}, expected {} or {}'.format(format, self.JSON, self.YAML))
+        self.stream = stream
+        self.format = format
+        self.graph = UpgradeGraph()
+        self.documents = 0
+        # Channel entry of every bundle written, by name
+        self._entries = {}
+
+    def write(self, document):
+        """Write one document
+
+        :param document: FBC document
+        :type document: dict
+        """
+        if self.format == self.JSON:
+            self.stream.write(json.dumps(document, indent=2))
+            self.stream.write('\n')
+        else:
+            self.stream.write('---\n')
+            yaml.dump(document, self.stream, Dumper=_Dumper, sort_keys=False, default_flow_style=False, allow_unicode=True)
+        self.documents += 1
+
+    def write_package(self, package, description=None, icon=None):
+        """Write the olm.package document
+
+        :param package: The package
+        :type package: Package
+
+        :param description: Package description, i.e. the README (default: {None})
+        :type description: string
+
+        :param icon: Icon as in spec.icon of a csv, {'base64data': ..., 'mediatype': ...} or a list with one (default: {None})
+        :type icon: dict, list
+        """
+        document = {'schema': 'olm.package', 'name': package.operator}
+        if package.default_channel:
+            document['defaultChannel'] = package.default_channel
+        if isinstance(icon, list):
+            icon = icon[0] if icon else None
+        if icon:
+            document['icon'] = {'base64data': icon.get('base64data'), 'mediatype': icon.get('mediatype')}
+        if description:
+            document['description'] = description
+        self.write(document)
+
+    def write_bundle(self, csv, package_name, image):
+        """Write the olm.bundle document of a csv and remember its upgrade fields for write_channels
+
+        :param csv: The csv, updated images and version are used
+        :type csv: ClusterServiceVersion
+
+        :param package_name: Name of the package the bundle belongs to
+        :type package_name: string
+
+        :param image: Bundle image
+        :type image: string
+        """
+        self.graph.add(csv)
+        self._entries[csv.get_versioned_name()] = get_channel_entry(csv)
+        self.write(get_bundle(csv.get_updated_csv(), package_name, image))
+
+    def write_channels(self, package):
+        """Write an olm.channel document for every channel of package, in name order. The entries are the bundles
+        written so far that can upgrade to the channel head, lowest version first
+
+        :param package: The package
+        :type package: Package
+        """
+        self.graph.package = package
+        for channel in sorted(package.get_channels(), key=lambda c: c.get_name()):
+            names = sorted(self.graph.get_channel_entries(channel.get_name()), key=self._version_key)
+            self.write({
+                'schema': 'olm.channel',
+                'name': channel.get_name(),
+                'package': package.operator,
+                'entries': [self._entries[name] for name in names]
+            })
+
+    def _version_key(self, name):
+        # Unversioned entries first, equal versions by name
+        version = self.graph.get_version(name)
+        return (version is not None, version._key if version is not None else (), name)
+
+def write_catalog(stream, package, csvs, images, format=FBCWriter.JSON, description=None):
+    """Write the complete catalog of a package: olm.package, one olm.bundle per csv and the olm.channel documents
+
+    :param stream: Text stream to write to
+    :type stream: file
+
+    :param package: The package
+    :type package: Package
+
+    :param csvs: ClusterServiceVersions of the bundles. Consumed one at a time, so pass a generator that loads them
+                 to keep memory bounded by a single bundle
+    :type csvs: iterable
+
+    :param images: Bundle image per csv name (metadata.name), or a function of the csv returning it
+    :type images: dict, callable
+
+    :param format: 'json' or 'yaml' (default: {'json'})
+    :type format: string
+
+    :return: Number of documents written
+    :rtype: int
+    """
+    writer = FBCWriter(stream, format)
+    writer.write_package(package, description=description)
+    for csv in csvs:
+        image = images(csv) if callable(images) else images[csv.get_versioned_name()]
+        writer.write_bundle(csv, package.operator, image)
+    writer.write_channels(package)
+    return writer.documents
+
+def get_bundle(csv, package_name, image):
+    """Build the olm.bundle document of a csv
+
+    :param csv: CSV as a dict
+    :type csv: dict
+
+    :rtype: dict
+    """
+    spec = csv.get('spec') or {}
+    metadata = csv.get('metadata') or {}
+    properties = []
+
+    crds = spec.get('customresourcedefinitions') or {}
+    gvks = sorted({(_get_group(c['name']), c['kind'], c['version']) for c in crds.get('owned') or ()})
+    properties.extend({'type': 'olm.gvk', 'value': {'group': g, 'kind': k, 'version': v}} for g, k, v in gvks)
+    required = sorted({(_get_group(c['name']), c['kind'], c['version']) for c in crds.get('required') or ()})
+    properties.extend({'type': 'olm.gvk.required', 'value': {'group': g, 'kind': k, 'version': v}} for g, k, v in required)
+
+    properties.append({'type': 'olm.package', 'value': {'packageName': package_name, 'version': spec.get('version')}})
+
+    csv_metadata = {}
+    for field, (section, key) in CSV_METADATA_FIELDS:
+        value = (metadata if section == 'metadata' else spec).get(key)
+        if value:
+            csv_metadata[field] = dict(sorted(value.items())) if section == 'metadata' else value
+    properties.append({'type': 'olm.csv.metadata', 'value': csv_metadata})
+
+    return {
+        'schema': 'olm.bundle',
+        'name': metadata.get('name'),
+        'package': package_name,
+        'image': image,
+        'properties': properties,
+        'relatedImages': _get_related_images(csv, image)
+    }
+
+def get_channel_entry(csv):
+    """Build the olm.channel entry of a csv, with replaces, skips and skipRange when it has them
+
+    :param csv: The csv
+    :type csv: ClusterServiceVersion
+
+    :rtype: dict
+    """
+    entry = {'name': csv.get_versioned_name()}
+    try:
+        if csv.get_replaces():
+            entry['replaces'] = csv.get_replaces()
+    except KeyError:
+        pass
+    if csv.get_skips():
+        entry['skips'] = sorted(csv.get_skips())
+    if csv.get_skiprange():
+        entry['skipRange'] = csv.get_skiprange()
+    return entry
+
+def _get_group(crd_name):
+    # <plural>.<group>
+    return crd_name.split('.', 1)[1] if '.' in crd_name else ''
+
+def _get_related_images(csv, image):
+    # spec.relatedImages, the operator container images and the bundle image itself, each once
+    related = {('', image)} if image else set()
+    for r in (csv.get('spec') or {}).get('relatedImages') or ():
+        related.add((r.get('name') or '', r['image']))
+    install = ((csv.get('spec') or {}).get('install') or {}).get('spec') or {}
+    for d in install.get('deployments') or ():
+        for c in d['spec']['template']['spec'].get('containers') or ():
+            related.add((c['name'], c['image']))
+    return [{'name': n, 'image': i} if n else {'image': i} for n, i in sorted(related)]
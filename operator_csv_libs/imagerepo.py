@@ -1,20 +1,35 @@
 from .images import Image
+from .sessions import get_session
+from .digestcache import DigestCache
+from .singleflight import SingleFlight
 from artifactory import ArtifactoryPath
-import os, sys, json
-import requests
+from .scheduler import get_scheduler
+from . import tracing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import os, sys, json, time, threading
 
 class ImageRepo:
     """ This is a class to provide a general interface to query container image registry servers.
         Hacked together in a hurry, will probably be refactored to be more pythonic - if there's a better way to do this
     """
-    def __init__(self, image, logger=None):
+    # Optional DigestCache used for digest lookups. Set on the class to enable it for every ImageRepo
+    cache = None
+    # Concurrent lookups of the same image and kind share one registry round trip. Set to None to disable
+    singleflight = SingleFlight()
+
+    def __init__(self, image, logger=None, cache=None, quay_tag_index=None):
         self.image = image
+        if cache is not None:
+            self.cache = cache
 
         # Check for some well known repos
         if 'artifactory' in self.image.get_image_repo():
             self.image_repo = ArtifactoryRepo(self.image)
         elif self.image.get_image_repo().startswith('quay.io/'):
-            self.image_repo = QuayRepo(self.image)
+            self.image_repo = QuayRepo(self.image, tag_index=quay_tag_index)
         elif self.image.get_image_repo().startswith('docker.io'):
             self.image_repo = DockerRepo(self.image)
 
@@ -22,10 +37,10 @@ class ImageRepo:
             raise RepoTypeNotImplemented('Unknown repository type for image {}'.format(image.get_image()))
 
     def get_manifest_list_digest(self):
-        return self.image_repo.get_manifest_list_digest()
+        return self._lookup(DigestCache.MANIFEST_LIST, self.image_repo.get_manifest_list_digest)
 
     def get_image_digest(self):
-        return self.image_repo.get_image_digest()
+        return self._lookup(DigestCache.IMAGE, self.image_repo.get_image_digest)
 
     def get_raw_manifest_list(self):
         """Return the docker manifest list in json format
@@ -37,12 +52,246 @@ class ImageRepo:
         """
         return self.image_repo.get_raw_manifest_list()
 
+    def _lookup(self, lookup, fetch):
+        if tracing.enabled():
+            with tracing.scope(self.image_repo, lookup):
+                return self._coalesced_lookup(lookup, fetch)
+        return self._coalesced_lookup(lookup, fetch)
+
+    def _coalesced_lookup(self, lookup, fetch):
+        if self.cache is not None:
+            cache, uncached = self.cache, fetch
+            fetch = lambda: cache.get_or_fetch(self.image, lookup, uncached)
+        if self.singleflight is None:
+            return fetch()
+        return self.singleflight.do(get_lookup_key(self.image, lookup), fetch)
+
+def get_lookup_key(image, lookup):
+    """Return the key identifying a digest lookup, shared by all images referring to the same canonical repo/name:tag
+
+    :param lookup: DigestCache.IMAGE or DigestCache.MANIFEST_LIST
+    :type lookup: string
+
+    :rtype: tuple
+    """
+    return (lookup, image.get_reference().get_tag_key())
+
+class DigestResult:
+    """ Outcome of resolving the digest of a single image as part of a batch.
+        Failures are captured in `error` rather than raised so one bad image does not abort the batch.
+    """
+    def __init__(self, image, digest=None, error=None, manifest_list=False, elapsed=None):
+        self.image = image
+        self.digest = digest
+        self.error = error
+        self.manifest_list = manifest_list
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        if self.error is not None:
+            return '<DigestResult {} error={!r}>'.format(self.image.get_image(), self.error)
+        return '<DigestResult {} digest={}>'.format(self.image.get_image(), self.digest)
+
+    def ok(self):
+        """Returns True if the digest was resolved
+
+        :rtype: bool
+        """
+        return self.error is None
+
+def _resolve_digest(image, manifest_list, cache, quay_tag_index):
+    start = time.monotonic()
+    try:
+        repo = ImageRepo(image, cache=cache, quay_tag_index=quay_tag_index)
+        if manifest_list:
+            digest = repo.get_manifest_list_digest()
+        else:
+            digest = repo.get_image_digest()
+        return DigestResult(image, digest=digest, manifest_list=manifest_list, elapsed=time.monotonic() - start)
+    except Exception as e:
+        return DigestResult(image, error=e, manifest_list=manifest_list, elapsed=time.monotonic() - start)
+
+def resolve_digests(images, manifest_list=False, max_workers=8, cache=None, quay_tag_index=None):
+    """Resolve the digests of many images concurrently, yielding results as they complete.
+
+    Each image is routed through ImageRepo, so the same ArtifactoryRepo, QuayRepo and DockerRepo backends are used as
+    for single lookups. Per image failures such as ManifestNotFound, ManifestListNotFound or RepoTypeNotImplemented
+    are returned as DigestResult.error and do not abort the batch. Workers are spread round robin across registries,
+    each limited to the concurrency the RequestScheduler allows for it.
+
+    :param images: Iterable of Image objects to resolve. Consumed lazily
+    :type images: iterable
+
+    :param manifest_list: Resolve manifest list digests instead of image digests (default: {False})
+    :type manifest_list: bool
+
+    :param max_workers: Maximum number of concurrent registry lookups (default: {8})
+    :type max_workers: int
+
+    :param cache: DigestCache to consult before querying the registry (default: {ImageRepo.cache})
+    :type cache: DigestCache
+
+    :param quay_tag_index: Answer quay lookups from repository tag listings instead of one api call per image (default: {None})
+    :type quay_tag_index: QuayTagIndex
+
+    :return: Generator of DigestResult in completion order
+    :rtype: generator
+    """
+    if max_workers < 1:
+        raise ValueError('max_workers must be at least 1, got {}'.format(max_workers))
+
+    images = iter(images)
+    scheduler = get_scheduler()
+    # Bounded read ahead so large inputs are not materialized up front
+    read_ahead = max_workers * 16
+    queued = OrderedDict()
+    in_flight = {}
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def dispatch():
+            # Hand free workers to registries round robin, never giving a registry more workers than the scheduler
+            # allows it concurrent requests, so a slow registry can't tie up the whole pool. Keep going round until
+            # every worker is busy or every registry with queued images is at its limit
+            dispatched = True
+            while dispatched:
+                dispatched = False
+                for host in list(queued):
+                    if len(pending) >= max_workers:
+                        return
+                    if in_flight.get(host, 0) >= scheduler.get_concurrency(host):
+                        continue
+                    image = queued[host].popleft()
+                    if queued[host]:
+                        queued.move_to_end(host)
+                    else:
+                        del queued[host]
+                    pending[executor.submit(_resolve_digest, image, manifest_list, cache, quay_tag_index)] = host
+                    in_flight[host] = in_flight.get(host, 0) + 1
+                    dispatched = True
+
+        exhausted = False
+        while True:
+            dispatch()
+            while not exhausted and len(pending) < max_workers and sum(len(q) for q in queued.values()) < read_ahead:
+                try:
+                    image = next(images)
+                except StopIteration:
+                    exhausted = True
+                    break
+                queued.setdefault(_get_request_host(image), deque()).append(image)
+                dispatch()
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                in_flight[pending.pop(f)] -= 1
+                yield f.result()
+
+# Which digest pin_images resolves: the image manifest, the manifest list, or the manifest list where there is one
+PIN_IMAGE = 'image'
+PIN_MANIFEST_LIST = 'manifest_list'
+PIN_PREFER_MANIFEST_LIST = 'prefer_manifest_list'
+
+class PinReport:
+    """ Outcome of pinning a set of images to digests, keyed by the image as it was written before pinning """
+    def __init__(self, policy):
+        self.policy = policy
+        # {image: digest} of the images pinned
+        self.digests = {}
+        # {image: exception} of the images that could not be resolved
+        self.failures = {}
+        # {image: seconds} spent resolving each image, including a manifest list attempt that fell back
+        self.latencies = {}
+        # Images left alone because they already had a digest
+        self.skipped = []
+        # Number of image usages updated, an image referenced from several places counts once per place
+        self.updated = 0
+
+    def __repr__(self):
+        return '<PinReport {} pinned, {} failed, {} skipped>'.format(len(self.digests), len(self.failures), len(self.skipped))
+
+    def ok(self):
+        """Returns True if every image was pinned or already had a digest
+
+        :rtype: bool
+        """
+        return not self.failures
+
+    def add_result(self, result):
+        image = result.image.get_image()
+        self.latencies[image] = result.elapsed
+        if result.ok():
+            self.digests[image] = result.digest
+        else:
+            self.failures[image] = result.error
+
+def pin_images(images, policy=PIN_IMAGE, max_workers=8, cache=None, quay_tag_index=None):
+    """Resolve the digest of every image in an ImageSet concurrently and set it on all usages of the image. Images
+    that already have a digest are skipped
+
+    With PIN_PREFER_MANIFEST_LIST the images without a manifest list are resolved again for their image digest once
+    the first batch is done.
+
+    :param images: Images to pin
+    :type images: ImageSet
+
+    :param policy: PIN_IMAGE, PIN_MANIFEST_LIST or PIN_PREFER_MANIFEST_LIST (default: {PIN_IMAGE})
+    :type policy: string
+
+    :param max_workers: Maximum number of concurrent registry lookups, see resolve_digests (default: {8})
+    :type max_workers: int
+
+    :rtype: PinReport
+    """
+    if policy not in (PIN_IMAGE, PIN_MANIFEST_LIST, PIN_PREFER_MANIFEST_LIST):
+        raise ValueError('Unknown pin policy {}'.format(policy))
+
+    report = PinReport(policy)
+    unpinned = []
+    for image in images:
+        if image.get_digest():
+            report.skipped.append(image.get_image())
+        else:
+            unpinned.append(image)
+
+    results = list(resolve_digests(unpinned, manifest_list=policy != PIN_IMAGE, max_workers=max_workers, cache=cache, quay_tag_index=quay_tag_index))
+    if policy == PIN_PREFER_MANIFEST_LIST:
+        fallback = {id(r.image): r for r in results if isinstance(r.error, ManifestListNotFound)}
+        for r in resolve_digests([r.image for r in fallback.values()], max_workers=max_workers, cache=cache, quay_tag_index=quay_tag_index):
+            r.elapsed += fallback[id(r.image)].elapsed
+            fallback[id(r.image)] = r
+        results = [fallback.get(id(r.image), r) for r in results]
+
+    # Record before applying, setting the digest changes the image strings
+    for result in results:
+        report.add_result(result)
+    report.updated = images.apply_digests(results)
+    return report
+
+def _get_request_host(image):
+    # Host the backend ImageRepo picks for image sends its requests to, which is what RequestScheduler keys its
+    # limits by. Docker hub images are served from registry-1.docker.io and artifactory images from ARTIFACTORY_BASE
+    image_repo = image.get_image_repo()
+    if 'artifactory' in image_repo:
+        base = ArtifactoryRepo._artifactory_base or os.getenv('ARTIFACTORY_BASE')
+        if base:
+            return urlsplit(base).hostname or base
+    elif image_repo.startswith('docker.io'):
+        return urlsplit(DockerRepo.DOCKER_REGISTRY_URL).hostname
+    return image_repo.split('/')[0]
+
 class ArtifactoryRepo:
+    BACKEND = 'artifactory'
+
     # Allow credentials to be shared between instances
     _artifactory_user = None
     _artifactory_key = None
     _artifactory_base = None
 
+    # Number of files looked up per AQL search in get_digests
+    AQL_CHUNK_SIZE = 100
+
     def __init__(self, image, artifactory_base=None, artifactory_user=None, artifactory_key=None, logger=None):
         self.image = image
 
@@ -81,6 +330,7 @@ class ArtifactoryRepo:
             # This is where we should panic and throw some orderly exception
             raise MissingCredentials("No artifactory base provided or found in ARTIFACTORY_BASE environment variable")
 
+    @tracing.traced('get_image_digest')
     def get_image_digest(self):
         # We know we're always querying for sha256
         return 'sha256:{}'.format(self._get_raw_image_digest())
@@ -93,40 +343,120 @@ class ArtifactoryRepo:
         r = self.image.get_image_repo().split('.')[0]
         return '{}/{}'.format(r, p)
 
-    def _get_raw_image_digest(self):
-        manifestpath = '/'.join([
-                        self.artifactory_base,
+    def _get_artifactory_item(self, filename):
+        # Path of a file stored alongside the image tag, i.e. manifest.json or list.manifest.json, relative to artifactory_base
+        return '/'.join([
                         self._get_artifactory_repo(), # We have to massage the repo for artifactory
                         self.image.get_image_name(),
                         self.image.get_tag(),
-                        "manifest.json"
+                        filename
                     ])
-        manifest_path = ArtifactoryPath(manifestpath, auth=(self.artifactory_user, self.artifactory_key))
+
+    def _get_artifactory_path(self, filename):
+        return '/'.join([self.artifactory_base, self._get_artifactory_item(filename)])
+
+    @classmethod
+    @tracing.traced('get_digests')
+    def get_digests(cls, images, manifest_list=False, chunk_size=None, artifactory_base=None, artifactory_user=None, artifactory_key=None):
+        """Resolve the digests of many images with as few AQL searches as possible.
+
+        The manifest.json (or list.manifest.json) paths of all images are gathered into AQL searches of up to
+        `chunk_size` files each. Only paths the searches did not return fall back to a per image storage stat.
+
+        :param images: Images stored in artifactory
+        :type images: list
+
+        :param manifest_list: Resolve manifest list digests instead of image digests (default: {False})
+        :type manifest_list: bool
+
+        :param chunk_size: Maximum number of files per AQL search (default: {AQL_CHUNK_SIZE})
+        :type chunk_size: int
+
+        :raises MissingCredentials: No artifactory credentials provided or found in the environment
+
+        :return: One DigestResult per image, in the order of images
+        :rtype: list
+        """
+        chunk_size = chunk_size or cls.AQL_CHUNK_SIZE
+        filename = 'list.manifest.json' if manifest_list else 'manifest.json'
+        repos = [cls(image, artifactory_base, artifactory_user, artifactory_key) for image in images]
+
+        # Images may in theory live on different artifactory servers or need different credentials
+        servers = {}
+        for r in repos:
+            servers.setdefault((r.artifactory_base, r.artifactory_user, r.artifactory_key), set()).add(r._get_artifactory_item(filename))
+
+        found = {}
+        for (base, user, key), items in servers.items():
+            items = sorted(items)
+            for i in range(0, len(items), chunk_size):
+                try:
+                    found.update(cls._search_sha256(base, (user, key), items[i:i + chunk_size]))
+                except Exception:
+                    # AQL may be disabled or restricted for this user, the stat fallback below still covers every path
+                    pass
+
+        results = []
+        for r in repos:
+            start = time.monotonic()
+            try:
+                sha256 = found.get(r._get_artifactory_item(filename))
+                if sha256 is None:
+                    sha256 = r._get_raw_manifest_list_digest() if manifest_list else r._get_raw_image_digest()
+                results.append(DigestResult(r.image, digest='sha256:{}'.format(sha256), manifest_list=manifest_list, elapsed=time.monotonic() - start))
+            except Exception as e:
+                results.append(DigestResult(r.image, error=e, manifest_list=manifest_list, elapsed=time.monotonic() - start))
+        return results
+
+    @staticmethod
+    def _search_sha256(artifactory_base, auth, items):
+        """ Run a single AQL search for items (repo/path/name strings) and return a dict of item to sha256
+        """
+        criteria = []
+        for item in items:
+            repo, _, rest = item.partition('/')
+            path, _, name = rest.rpartition('/')
+            criteria.append({'$and': [{'repo': repo}, {'path': path}, {'name': name}]})
+        query = 'items.find({}).include("repo","path","name","sha256")'.format(json.dumps({'$or': criteria}))
+
+        url = '/'.join([artifactory_base, 'api/search/aql'])
+        resp = get_session(url, auth=auth).post(url, data=query, headers={'Content-Type': 'text/plain'})
+        if resp.status_code in (401, 403):
+            raise MissingCredentials(resp.text)
+        elif not resp.status_code == 200:
+            raise Exception(resp.text)
+
+        return {'/'.join([r['repo'], r['path'], r['name']]): r['sha256'] for r in resp.json()['results'] if r.get('sha256')}
+
+    def _make_artifactory_path(self, path):
+        # Reuse a keep-alive session per artifactory host and credentials
+        auth = (self.artifactory_user, self.artifactory_key)
+        return ArtifactoryPath(path, auth=auth, session=get_session(path, auth=auth))
+
+    def _get_raw_image_digest(self):
+        manifestpath = self._get_artifactory_path("manifest.json")
+        manifest_path = self._make_artifactory_path(manifestpath)
 
         try:
             return ArtifactoryPath.stat(manifest_path).sha256
         except FileNotFoundError as e:
             raise ManifestNotFound(e)
 
+    @tracing.traced('get_manifest_list_digest')
     def get_manifest_list_digest(self):
         # We know we're always querying for sha256
         return 'sha256:{}'.format(self._get_raw_manifest_list_digest())
 
     def _get_raw_manifest_list_digest(self):
-        listpath = '/'.join([
-                        self.artifactory_base,
-                        self._get_artifactory_repo(), # We have to massage the repo for artifactory
-                        self.image.get_image_name(),
-                        self.image.get_tag(),
-                        "list.manifest.json"
-                    ])
-        list_path = ArtifactoryPath(listpath, auth=(self.artifactory_user, self.artifactory_key))
+        listpath = self._get_artifactory_path("list.manifest.json")
+        list_path = self._make_artifactory_path(listpath)
 
         try:
             return ArtifactoryPath.stat(list_path).sha256
         except FileNotFoundError as e:
             raise ManifestListNotFound(e)
 
+    @tracing.traced('get_raw_manifest_list')
     def get_raw_manifest_list(self):
         """Return the docker manifest list in json format
 
@@ -136,14 +466,8 @@ class ArtifactoryRepo:
         :rtype: dict
         """
 
-        listpath = '/'.join([
-                        self.artifactory_base,
-                        self._get_artifactory_repo(), # We have to massage the repo for artifactory
-                        self.image.get_image_name(),
-                        self.image.get_tag(),
-                        "list.manifest.json"
-                    ])
-        list_path = ArtifactoryPath(listpath, auth=(self.artifactory_user, self.artifactory_key))
+        listpath = self._get_artifactory_path("list.manifest.json")
+        list_path = self._make_artifactory_path(listpath)
 
         try:
             f = list_path.open()
@@ -154,39 +478,61 @@ class ArtifactoryRepo:
         return json.loads(f.read().decode('utf-8'))
 
 class QuayRepo:
+    BACKEND = 'quay'
     QUAY_BASE_URL = 'https://quay.io/api/v1/repository'
+    QUAY_REGISTRY_URL = 'https://quay.io/v2/{repo}/manifests/{tag}'
+
+    def __init__(self, image, tag_index=None):
+        """
+        :param image: Image to query
+        :type image: Image
 
-    def __init__(self, image):
+        :param tag_index: Resolve the tag from a QuayTagIndex instead of a specificTag api call (default: {None})
+        :type tag_index: QuayTagIndex
+        """
         self.image = image
+        self.tag_index = tag_index
 
+    @tracing.traced('get_image_digest')
     def get_image_digest(self):
         return self._get_digest(manifest_list=False)
 
+    @tracing.traced('get_manifest_list_digest')
     def get_manifest_list_digest(self):
         return self._get_digest(manifest_list=True)
 
     def _get_digest(self, manifest_list):
-        url = '/'.join([
+        if self.tag_index is not None:
+            return self._get_indexed_digest(manifest_list)
+
+        url = self._get_tag_url()
+        resp = get_session(url).get(url)
+        self._check_response(resp.status_code, resp.text, manifest_list)
+        return self._select_digest(resp.json()['tags'], manifest_list)
+
+    def _get_tag_url(self):
+        return '/'.join([
                         self.QUAY_BASE_URL,
                         self._get_quay_repo(),
                         'tag',
                         '?onlyActiveTags=true&specificTag='
-                ])
-
-        resp = requests.get(url + self.image.get_tag())
-
-        if resp.status_code == 403:
-            raise MissingCredentials(resp.text)
-        elif resp.status_code == 404:
+                ]) + self.image.get_tag()
+
+    def _check_response(self, status_code, text, manifest_list):
+        if status_code == 403:
+            raise MissingCredentials(text)
+        elif status_code == 429:
+            raise RateLimited(text)
+        elif status_code == 404:
             if manifest_list:
-                raise ManifestListNotFound(resp.text)
+                raise ManifestListNotFound(text)
             else:
-                raise ManifestNotFound(resp.text)
-        elif not resp.status_code == 200:
-            raise Exception(resp.text)
+                raise ManifestNotFound(text)
+        elif not status_code == 200:
+            raise Exception(text)
 
+    def _select_digest(self, tags, manifest_list):
         # Since we query for specific tag we expect single response
-        tags = resp.json()['tags']
         if len(tags) > 1:
             raise Exception('Expected 1 tag, found {}. {}'.format(len(tags), tags))
         for t in tags:
@@ -198,14 +544,209 @@ class QuayRepo:
                 else:
                     raise ManifestNotFound('Tag {} is a manifest list'.format(self.image.get_tag()))
 
+    def _get_indexed_digest(self, manifest_list):
+        tag = self.tag_index.lookup(self._get_quay_repo(), self.image.get_tag())
+        if tag is None:
+            self._check_response(404, 'Tag {} not found in {}'.format(self.image.get_tag(), self._get_quay_repo()), manifest_list)
+        return self._select_digest([tag], manifest_list)
+
+    def _get_manifest_url(self):
+        return self.QUAY_REGISTRY_URL.format(repo=self._get_quay_repo(), tag=self.image.get_tag())
+
     def _get_quay_repo(self):
         r = self.image.get_image_repo().replace('quay.io/','')
         return '/'.join([r, self.image.get_image_name()])
 
+class QuayTagIndex:
+    """ Answers quay tag lookups from paginated listings of each repository's active tags, so resolving many tags of
+        one repository costs one api call per page instead of one per tag.
+
+        Pages are fetched lazily and only until the requested tag has been seen. Every tag seen along the way is
+        remembered, so later lookups in the same repository are answered from memory. Safe to share across threads.
+        Intended to live for one batch of lookups, tags pushed after a repository was listed are not picked up.
+    """
+    PAGE_LIMIT = 100
+
+    def __init__(self, page_limit=PAGE_LIMIT):
+        self.page_limit = page_limit
+        self.pages_fetched = 0
+        self._repositories = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, repository, tag):
+        """Return the tag entry for repository:tag, listing further pages of the repository as needed
+
+        :param repository: Quay repository, i.e. org/image
+        :type repository: string
+
+        :param tag: Tag name
+        :type tag: string
+
+        :return: Quay tag entry with at least manifest_digest and is_manifest_list, or None if the tag does not exist
+        :rtype: dict
+        """
+        with self._lock:
+            entry = self._repositories.get(repository)
+            if entry is None:
+                entry = self._repositories[repository] = {'tags': {}, 'pages': self.iter_tags(repository), 'lock': threading.Lock()}
+
+        with entry['lock']:
+            if tag in entry['tags']:
+                return entry['tags'][tag]
+            try:
+                for t in entry['pages']:
+                    entry['tags'][t['name']] = t
+                    if t['name'] == tag:
+                        return t
+            except Exception:
+                # A failed page ends the generator, start over on the next lookup
+                entry['pages'] = self.iter_tags(repository)
+                raise
+        return None
+
+    def get_tags(self, repository):
+        """Return the tags of repository seen so far as a dict of name to (digest, is_manifest_list)
+
+        :rtype: dict
+        """
+        entry = self._repositories.get(repository, {'tags': {}})
+        return {name: (t['manifest_digest'], t['is_manifest_list']) for name, t in list(entry['tags'].items())}
+
+    def iter_tags(self, repository):
+        """Lazily iterate over all active tags of a quay repository, one api page at a time
+
+        :param repository: Quay repository, i.e. org/image
+        :type repository: string
+
+        :return: Generator of quay tag entries
+        :rtype: generator
+        """
+        page = 1
+        while True:
+            url = '{}/{}/tag/?onlyActiveTags=true&limit={}&page={}'.format(QuayRepo.QUAY_BASE_URL, repository, self.page_limit, page)
+            resp = get_session(url).get(url)
+            if resp.status_code == 403:
+                raise MissingCredentials(resp.text)
+            elif resp.status_code == 429:
+                raise RateLimited(resp.text)
+            elif resp.status_code == 404:
+                return
+            elif not resp.status_code == 200:
+                raise Exception(resp.text)
+
+            with self._lock:
+                self.pages_fetched += 1
+            body = resp.json()
+            for t in body['tags']:
+                yield t
+            if not body.get('has_additional'):
+                return
+            page += 1
+
+class DockerTokenCache:
+    """ Thread safe cache of registry bearer tokens keyed by scope, i.e. repository:org/repo:pull
+
+        Tokens are refreshed `refresh_margin` seconds before they expire, based on the `expires_in` and `issued_at`
+        fields of the token response. Concurrent callers missing the same scope wait for a single token request.
+    """
+    # Docker token spec: if expires_in is not returned the token is valid for 60 seconds
+    DEFAULT_EXPIRES_IN = 60
+
+    def __init__(self, refresh_margin=10):
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._scope_locks = {}
+
+    def get(self, scope):
+        """Return the cached token for scope, or None if missing or about to expire
+
+        :rtype: string
+        """
+        entry = self._tokens.get(scope)
+        if entry is None:
+            return None
+        token, expires = entry
+        if time.monotonic() >= expires - self.refresh_margin:
+            return None
+        return token
+
+    def put(self, scope, response):
+        """Store the token from a token endpoint response
+
+        :param scope: Token scope
+        :type scope: string
+
+        :param response: Parsed json response from the token endpoint
+        :type response: dict
+
+        :return: The token
+        :rtype: string
+        """
+        token = response.get('token') or response.get('access_token')
+        expires_in = response.get('expires_in') or self.DEFAULT_EXPIRES_IN
+        issued_at = self._parse_issued_at(response.get('issued_at'))
+        if issued_at is not None:
+            # A token may have been issued a while before we received it. Never trust it for longer than expires_in
+            remaining = issued_at + expires_in - time.time()
+            expires_in = max(0, min(expires_in, remaining))
+        with self._lock:
+            self._tokens[scope] = (token, time.monotonic() + expires_in)
+        return token
+
+    def get_token(self, scope, fetch):
+        """Return a valid token for scope, calling fetch() to request a new one if needed
+
+        :param fetch: Callable returning the parsed token endpoint response
+        :type fetch: callable
+
+        :rtype: string
+        """
+        token = self.get(scope)
+        if token is not None:
+            return token
+        with self._lock:
+            scope_lock = self._scope_locks.setdefault(scope, threading.Lock())
+        with scope_lock:
+            # Another thread may have refreshed the token while we waited
+            token = self.get(scope)
+            if token is not None:
+                return token
+            return self.put(scope, fetch())
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def _parse_issued_at(self, issued_at):
+        if not issued_at:
+            return None
+        try:
+            # RFC3339 with up to nanosecond precision, i.e. 2021-03-04T12:00:00.123456789Z
+            date, _, fraction = issued_at.rstrip('Z').partition('.')
+            ts = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+            if fraction:
+                ts += float('0.' + fraction)
+            return ts
+        except ValueError:
+            return None
+
 class DockerRepo:
     """ This class provides an interface for docker hub images allowing one to query image and manifest list digests
         as well as get the raw manifest list in json format.
     """
+    BACKEND = 'docker'
+    DOCKER_AUTH_URL = 'https://auth.docker.io/token?scope=repository%3A{org}%2F{repo}%3Apull&service=registry.docker.io'
+    DOCKER_REGISTRY_URL = 'https://registry-1.docker.io/v2/{org}/{repo}/manifests/{tag}'
+    MANIFEST_LIST_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.list.v2+json'
+    MANIFEST_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+    OCI_INDEX_MEDIA_TYPE = 'application/vnd.oci.image.index.v1+json'
+    OCI_MANIFEST_MEDIA_TYPE = 'application/vnd.oci.image.manifest.v1+json'
+    # Everything resolve_manifest accepts, so a single request answers both image and manifest list lookups
+    ACCEPTED_MEDIA_TYPES = (MANIFEST_LIST_MEDIA_TYPE, OCI_INDEX_MEDIA_TYPE, MANIFEST_MEDIA_TYPE, OCI_MANIFEST_MEDIA_TYPE)
+
+    # Shared between all instances so resolving many images in one repository costs a single token request
+    _token_cache = DockerTokenCache()
 
     def __init__(self,image):
         self.image = image
@@ -213,12 +754,37 @@ class DockerRepo:
         self.repo = image.get_image_name()
         self.tag = image.get_tag()
 
+    @tracing.traced('get_image_digest')
     def get_image_digest(self):
         return self._get_digest(manifest_list=False)
 
+    @tracing.traced('get_manifest_list_digest')
     def get_manifest_list_digest(self):
         return self._get_digest(manifest_list=True)
 
+    def _get_token(self):
+        # Tokens are cached per repository scope and shared between DockerRepo instances
+        return self._token_cache.get_token(self._get_token_scope(), self._fetch_token)
+
+    def _fetch_token(self):
+        url=self._get_token_url()
+        t=get_session(url).get(url)
+        if t.status_code == 429:
+            raise RateLimited(t.text)
+        elif not t.status_code == 200:
+            raise MissingCredentials(t.text)
+        return t.json()
+
+    def _get_token_scope(self):
+        return 'repository:{org}/{repo}:pull'.format(org=self.org, repo=self.repo)
+
+    def _get_token_url(self):
+        return self.DOCKER_AUTH_URL.format(org=self.org, repo=self.repo)
+
+    def _get_manifest_url(self):
+        return self.DOCKER_REGISTRY_URL.format(org=self.org, repo=self.repo, tag=self.tag)
+
+    @tracing.traced('get_raw_manifest_list')
     def get_raw_manifest_list(self):
         """ Return the docker manifest list in json format
         
@@ -228,45 +794,97 @@ class DockerRepo:
         :rtype: dict
         """
         ## Get token
-        t=requests.get('https://auth.docker.io/token?scope=repository%3A{org}%2F{repo}%3Apull&service=registry.docker.io'.format(org=self.org, repo=self.repo))
-        token=t.json()['token']
+        token=self._get_token()
 
         ## check media type
-        headers={'accept':'application/vnd.docker.distribution.manifest.list.v2+json', 'Authorization': 'Bearer {}'.format(token)}
-        m=requests.get('https://registry-1.docker.io/v2/{org}/{repo}/manifests/{tag}'.format(org=self.org,repo=self.repo,tag=self.tag), headers=headers)
+        headers={'accept':self.MANIFEST_LIST_MEDIA_TYPE, 'Authorization': 'Bearer {}'.format(token)}
+        url=self._get_manifest_url()
+        m=get_session(url).get(url, headers=headers)
         
         if 'manifest.list' in m.headers['Content-Type']:
             return m.json()
         else:
             raise ManifestListNotFound('No manifest for: ' + self.image.get_image())
 
+    def resolve_manifest(self):
+        """ Resolve the manifest for the image tag with a single HEAD request accepting both manifest lists
+            (including OCI indexes) and single image manifests
+
+        :raises ManifestNotFound: The tag does not exist
+        :raises MissingCredentials: The registry refused the request
+
+        :return: Digest, media type and size of whatever the tag points to
+        :rtype: ManifestDescriptor
+        """
+        token=self._get_token()
+
+        url=self._get_manifest_url()
+        m=get_session(url).head(url, headers=self._get_resolve_headers(token))
+        return self._to_manifest_descriptor(m.status_code, m.headers)
+
+    def _get_resolve_headers(self, token):
+        return {'accept': ', '.join(self.ACCEPTED_MEDIA_TYPES), 'Authorization': 'Bearer {}'.format(token)}
+
+    def _to_manifest_descriptor(self, status_code, headers):
+        if status_code in (401, 403):
+            raise MissingCredentials('Access denied to {}'.format(self.image.get_image()))
+        elif status_code == 429:
+            raise RateLimited('Rate limited resolving {}'.format(self.image.get_image()))
+        elif status_code == 404:
+            raise ManifestNotFound('No manifest for: ' + self.image.get_image())
+        elif not status_code == 200:
+            raise Exception('Unexpected status {} resolving {}'.format(status_code, self.image.get_image()))
+
+        size = headers.get('Content-Length')
+        return ManifestDescriptor(
+            digest=headers['Docker-Content-Digest'],
+            media_type=headers.get('Content-Type', '').split(';')[0].strip(),
+            size=int(size) if size is not None else None
+        )
+
     def _get_digest(self, manifest_list):
         """ Return the digest of the docker image or manifest list
 
         :raises ManifestListNotFound: if manifest list is requested but it does not exist
+        :raises ManifestNotFound: if image digest is requested but the tag is a manifest list
 
         :return: docker manifest/manifest list digest
         :rtype: string
         """
-        ## Get token
-        t=requests.get('https://auth.docker.io/token?scope=repository%3A{org}%2F{repo}%3Apull&service=registry.docker.io'.format(org=self.org, repo=self.repo))
-        token=t.json()['token']
-
-        ## check media type
-        headers={'accept':'application/vnd.docker.distribution.manifest.list.v2+json', 'Authorization': 'Bearer {}'.format(token)}
-        m=requests.get('https://registry-1.docker.io/v2/{org}/{repo}/manifests/{tag}'.format(org=self.org,repo=self.repo,tag=self.tag), headers=headers)
+        return self._select_digest(self.resolve_manifest(), manifest_list)
 
-        if 'manifest.list' in m.headers['Content-Type']:
+    def _select_digest(self, manifest, manifest_list):
+        if manifest.is_manifest_list():
             if manifest_list:
-                return m.headers['Docker-Content-Digest']
+                return manifest.digest
+            raise ManifestNotFound('Tag {} is a manifest list'.format(self.tag))
         else:
             if manifest_list:
                 raise ManifestListNotFound("Manifest List does not exist")
-            else:
-                ## Get the proper digest for single arch image - need the correct header
-                headers={'accept':'application/vnd.docker.distribution.manifest.v2+json', 'Authorization': 'Bearer {}'.format(token)}
-                m=requests.get('https://registry-1.docker.io/v2/{org}/{repo}/manifests/{tag}'.format(org=self.org,repo=self.repo,tag=self.tag), headers=headers)
-                return m.headers['Docker-Content-Digest']
+            return manifest.digest
+
+class ManifestDescriptor:
+    """ Describes the manifest a tag resolves to, as returned by a registry HEAD request
+    """
+    MANIFEST_LIST_MEDIA_TYPES = (
+        'application/vnd.docker.distribution.manifest.list.v2+json',
+        'application/vnd.oci.image.index.v1+json'
+    )
+
+    def __init__(self, digest, media_type, size=None):
+        self.digest = digest
+        self.media_type = media_type
+        self.size = size
+
+    def __repr__(self):
+        return '<ManifestDescriptor {} {} size={}>'.format(self.digest, self.media_type, self.size)
+
+    def is_manifest_list(self):
+        """Returns True if the manifest is a docker manifest list or OCI image index
+
+        :rtype: bool
+        """
+        return self.media_type in self.MANIFEST_LIST_MEDIA_TYPES or 'manifest.list' in self.media_type
 
 class MissingCredentials(Exception):
     pass
@@ -278,4 +896,7 @@ class ManifestListNotFound(Exception):
     pass
 
 class ManifestNotFound(Exception):
+    pass
+
+class RateLimited(Exception):
     pass
\ No newline at end of file
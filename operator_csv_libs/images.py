@@ -1,4 +1,9 @@
+from .references import split_reference, parse_reference
+
 class Image:
+    # Catalogs hold tens of thousands of these, keep them small
+    __slots__ = ('name', 'image', 'deployment', 'container', 'tag', 'digest', 'image_repo', 'image_name')
+
     def __init__(self, name=None, image=None, deployment=None, container=None):
         """Object to hold information about a container or related image
 
@@ -18,21 +23,25 @@ class Image:
         self.image      = image
         self.deployment = deployment
         self.container  = container
-        self.tag        = None
-        self.digest     = None
-
-        # Everything before the last '/' should make up repo
-        self.image_repo = '/'.join(image.split('/')[:-1])
-        remainder = image.split('/')[-1]
-        if '@' in remainder:
-            self.image_name = remainder.split('@')[0]
-            self.digest     = remainder.split('@')[1]
-        elif ':' in remainder:
-            self.image_name = remainder.split(':')[0]
-            self.tag        = remainder.split(':')[1]
-        else:
-            self.image_name = remainder
-            self.tag        = 'latest'
+
+        # Everything before the name makes up repo, including a registry port
+        self.image_repo, self.image_name, self.tag, self.digest = split_reference(image)
+        if self.tag is None and self.digest is None:
+            self.tag = 'latest'
+
+    def __repr__(self):
+        return '<Image {}>'.format(self.image)
+
+    def __eq__(self, other):
+        """Images are equal when their canonical references are, regardless of name, deployment and container.
+        Setting a tag or digest changes the hash, so don't modify images while they are in a set or dict key
+        """
+        if not isinstance(other, Image):
+            return NotImplemented
+        return self.get_reference() == other.get_reference()
+
+    def __hash__(self):
+        return hash(self.get_reference())
 
     def set_digest(self, digest):
         """Set image digest
@@ -41,13 +50,11 @@ class Image:
         :type digest: string
         """
         if self.digest:
-            # If already have a digest set we need to carefully replace
-            self.image = self.image.replace(self.digest, digest)
-            self.digest = digest
+            # Keep a tag written alongside the digest, only the digest changes
+            self.image = '{}@{}'.format(self.image.rpartition('@')[0], digest)
         else:
-            self.digest = digest
-            # We're assuming that when we're called the existing image doesn't have a digest
-            self.image = '{}@{}'.format(self.image.split(':')[0], digest)
+            self.image = '{}@{}'.format(self._get_repository(), digest)
+        self.digest = digest
         return True
 
     def set_tag(self, tag):
@@ -59,12 +66,21 @@ class Image:
         self.tag = tag
         if not self.digest:
             # We won't overwrite image info if we have digest
-            self.image = '{}:{}'.format(self.image.split(':')[0], tag)
+            self.image = '{}:{}'.format(self._get_repository(), tag)
 
     def set_image_repo(self, repo):
-        self.image      = self.image.replace(self.image_repo, repo)
+        if self.image_repo:
+            self.image = repo + self.image[len(self.image_repo):]
+        else:
+            self.image = '{}/{}'.format(repo, self.image)
         self.image_repo = repo
         return True
+
+    def _get_repository(self):
+        # repo/name as written, without tag or digest
+        if self.image_repo:
+            return '{}/{}'.format(self.image_repo, self.image_name)
+        return self.image_name
     
     def get_image_repo(self):
         """Returns the image_repo section of the overall image
@@ -112,10 +128,116 @@ class Image:
         else:
             return None
 
+    def get_reference(self):
+        """Returns the canonical parsed reference of the image, i.e. for cache keys. Equivalent references such as
+        `nginx` and `docker.io/library/nginx:latest` return the same Reference
+
+        :rtype: Reference
+        """
+        return parse_reference(self.image)
+
     def get_image(self):
         """Return the full image 
 
         :return: Full image in format <repo>/<name>[@digest][:tag]
         :rtype: string
         """
-        return self.image
\ No newline at end of file
+        return self.image
+
+class ImageSet:
+    """ Images deduplicated by canonical reference, keeping every usage (olm name, deployment, container) of each.
+
+        Iterating yields one Image per unique reference, the first one added, so a batch resolves every image once.
+        apply_digests() then fans the results back out to all usages::
+
+            images = ImageSet(csv.operator_images + csv.annotation_related_images + csv.env_related_images)
+            images.apply_digests(resolve_digests(images))
+    """
+    def __init__(self, images=()):
+        """
+        :param images: Images to add
+        :type images: iterable
+        """
+        self._usages = {}
+        self.update(images)
+
+    def __len__(self):
+        return len(self._usages)
+
+    def __iter__(self):
+        return (usages[0] for usages in list(self._usages.values()))
+
+    def __contains__(self, image):
+        if isinstance(image, str):
+            return parse_reference(image) in self._usages
+        return isinstance(image, Image) and image.get_reference() in self._usages
+
+    def __repr__(self):
+        return '<ImageSet {} images, {} usages>'.format(len(self), self.get_usage_count())
+
+    def add(self, image):
+        """Add an image
+
+        :param image: Image to add
+        :type image: Image
+
+        :return: True if no image with the same reference was in the set
+        :rtype: bool
+        """
+        usages = self._usages.get(image.get_reference())
+        if usages is None:
+            self._usages[image.get_reference()] = [image]
+            return True
+        usages.append(image)
+        return False
+
+    def update(self, images):
+        """Add images
+
+        :param images: Images to add
+        :type images: iterable
+        """
+        for image in images:
+            self.add(image)
+
+    def get_usages(self, image):
+        """Returns every image added with the same canonical reference as image
+
+        :param image: Image or image reference
+        :type image: Image, string
+
+        :rtype: list
+        """
+        reference = parse_reference(image) if isinstance(image, str) else image.get_reference()
+        return list(self._usages.get(reference, ()))
+
+    def get_usage_count(self):
+        """Returns the number of images added, counting duplicates
+
+        :rtype: int
+        """
+        return sum(len(usages) for usages in self._usages.values())
+
+    def apply_digests(self, results):
+        """Set the digest of every usage of each resolved image
+
+        :param results: Objects with image, digest and ok() such as the DigestResults of resolve_digests. Failed
+                        results are skipped
+        :type results: iterable
+
+        :return: Number of images updated
+        :rtype: int
+        """
+        updated = 0
+        for result in results:
+            if not result.ok():
+                continue
+            usages = self._usages.pop(result.image.get_reference(), None)
+            if usages is None:
+                continue
+            for image in usages:
+                image.set_digest(result.digest)
+            updated += len(usages)
+            # Keyed by the pinned reference from now on, merging with images that already had it
+            self._usages.setdefault(usages[0].get_reference(), []).extend(usages)
+        return updated
@@ -0,0 +1,206 @@
+from .references import split_reference, parse_reference
+
+class MirrorMap:
+    """ Source to mirror repository prefixes, in the style of an ImageContentSourcePolicy, compiled into a prefix trie.
+
+        Sources match whole path components of the canonical repository, so `quay.io/org` matches
+        `quay.io/org/image:1.0` and `quay.io/org/sub/image` but not `quay.io/organisation/image`. When several sources
+        match the longest one wins. The matched prefix is replaced by the mirror, the rest of the repository and the
+        tag or digest are kept as written::
+
+            mirrors = MirrorMap({'quay.io/org': 'mirror.example.com:5000/org', 'docker.io/library': 'mirror.example.com:5000/hub'})
+            mirrors.rewrite('quay.io/org/operator@sha256:...')  # 'mirror.example.com:5000/org/operator@sha256:...'
+            mirrors.rewrite('nginx:1.25')                       # 'mirror.example.com:5000/hub/nginx:1.25'
+
+        Images are matched by their canonical reference, so docker hub sources are written as docker.io/library/<name>
+        or docker.io/<namespace>.
+    """
+    def __init__(self, rules=None):
+        """
+        :param rules: Mirror per source prefix, as a dict or list of (source, mirror)
+        :type rules: dict, list
+        """
+        self._root = _Node()
+        self._rules = {}
+        self._rewrites = {}
+        if rules:
+            for source, mirror in (rules.items() if isinstance(rules, dict) else rules):
+                self.add(source, mirror)
+
+    @classmethod
+    def from_icsp(cls, documents):
+        """ Build a MirrorMap from ImageContentSourcePolicy or ImageDigestMirrorSet documents, using the first mirror
+            of every source. When a source is listed more than once the first entry is used.
+
+        :param documents: Parsed ImageContentSourcePolicy/ImageDigestMirrorSet yaml, or a list of them
+        :type documents: dict, list
+
+        :rtype: MirrorMap
+        """
+        if isinstance(documents, dict):
+            documents = [documents]
+        mirrors = cls()
+        for document in documents:
+            spec = document.get('spec') or {}
+            for entry in spec.get('repositoryDigestMirrors') or spec.get('imageDigestMirrors') or ():
+                if entry.get('mirrors') and entry['source'] not in mirrors._rules:
+                    mirrors.add(entry['source'], entry['mirrors'][0])
+        return mirrors
+
+    def __len__(self):
+        return len(self._rules)
+
+    def add(self, source, mirror):
+        """Add a rule, replacing any existing rule for the same source
+
+        :param source: Repository prefix to replace, i.e. quay.io/org
+        :type source: string
+
+        :param mirror: Replacement prefix, i.e. mirror.example.com/org
+        :type mirror: string
+        """
+        source, mirror = source.rstrip('/'), mirror.rstrip('/')
+        if not source or not mirror:
+            raise ValueError('Mirror rules need a source and a mirror, got {!r}: {!r}'.format(source, mirror))
+        node = self._root
+        for component in source.split('/'):
+            node = node.children.setdefault(component, _Node())
+        node.rule = (source, mirror)
+        self._rules[source] = mirror
+        self._rewrites.clear()
+
+    def get_rules(self):
+        """Returns the rules as a dict of source to mirror
+
+        :rtype: dict
+        """
+        return dict(self._rules)
+
+    def match(self, image):
+        """Returns the rule with the longest source matching image
+
+        :param image: Image reference
+        :type image: string
+
+        :return: (source, mirror), or None if no rule matches
+        :rtype: tuple
+        """
+        node, rule = self._root, None
+        for component in parse_reference(image).get_repository().split('/'):
+            node = node.children.get(component)
+            if node is None:
+                break
+            if node.rule is not None:
+                rule = node.rule
+        return rule
+
+    def rewrite(self, image):
+        """Returns image with its source prefix replaced by the mirror
+
+        :param image: Image reference
+        :type image: string
+
+        :return: Mirrored image reference, or None if no rule matches
+        :rtype: string
+        """
+        rewrite = self.get_rewrite(image)
+        return rewrite[0] if rewrite is not None else None
+
+    def get_rewrite(self, image):
+        """Returns the mirrored image and the rule that matched. Memoized per image string, since a catalog refers
+        to the same images many times
+
+        :param image: Image reference
+        :type image: string
+
+        :return: (mirrored image, (source, mirror)), or None if no rule matches
+        :rtype: tuple
+        """
+        try:
+            return self._rewrites[image]
+        except KeyError:
+            pass
+        rewrite = None
+        rule = self.match(image)
+        if rule is not None:
+            source, mirror = rule
+            repo, name, _, _ = split_reference(image)
+            written = '{}/{}'.format(repo, name) if repo else name
+            # Replace the matched prefix of the canonical repository, keep tag and digest as written
+            rewrite = (mirror + parse_reference(image).get_repository()[len(source):] + image[len(written):], rule)
+        self._rewrites[image] = rewrite
+        return rewrite
+
+    def apply(self, csv, report=None):
+        """Rewrite every image of a ClusterServiceVersion in one pass: operator container images, olm.relatedImage
+        annotations, RELATED_IMAGE_* env vars and spec.relatedImages
+
+        :param csv: The csv to modify
+        :type csv: ClusterServiceVersion
+
+        :param report: Report to add the results to, i.e. to collect the results of many CSVs (default: {new report})
+        :type report: MirrorReport
+
+        :rtype: MirrorReport
+        """
+        if report is None:
+            report = MirrorReport()
+        csv.apply_mirrors(self, report)
+        return report
+
+class MirrorMatch:
+    """ One image rewritten by a mirror rule """
+    __slots__ = ('source', 'mirror', 'original', 'image', 'name', 'deployment', 'container')
+
+    def __init__(self, source, mirror, original, image, name=None, deployment=None, container=None):
+        self.source     = source
+        self.mirror     = mirror
+        self.original   = original
+        self.image      = image
+        self.name       = name
+        self.deployment = deployment
+        self.container  = container
+
+    def __repr__(self):
+        return '<MirrorMatch {} -> {} ({})>'.format(self.original, self.image, self.source)
+
+class MirrorReport:
+    """ Images rewritten by MirrorMap.apply and the images no rule matched """
+    def __init__(self):
+        self.matches = []
+        self.unmatched = []
+
+    def __repr__(self):
+        return '<MirrorReport {} matched, {} unmatched>'.format(len(self.matches), len(self.unmatched))
+
+    def add_match(self, rule, original, image, name=None, deployment=None, container=None):
+        self.matches.append(MirrorMatch(rule[0], rule[1], original, image, name, deployment, container))
+
+    def add_unmatched(self, image):
+        self.unmatched.append(image)
+
+    def get_by_rule(self):
+        """Returns the matches grouped by rule source
+
+        :return: {source: [MirrorMatch]}
+        :rtype: dict
+        """
+        by_rule = {}
+        for match in self.matches:
+            by_rule.setdefault(match.source, []).append(match)
+        return by_rule
+
+    def get_rule_counts(self):
+        """Returns the number of images rewritten per rule source
+
+        :return: {source: count}
+        :rtype: dict
+        """
+        return {source: len(matches) for source, matches in self.get_by_rule().items()}
+
+class _Node:
+    __slots__ = ('children', 'rule')
+
+    def __init__(self):
+        self.children = {}
+        self.rule = None
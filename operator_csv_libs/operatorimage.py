@@ -1,28 +1,32 @@
+from .references import split_reference, parse_reference
+
 # Defines what an operator image definition looks like
 class Operatorimage:
-    deployment = None
-    container  = None
-    image      = None
-    digest     = None
-    tag        = None
-    image_name = None
-    image_repo = None
+    __slots__ = ('deployment', 'container', 'image', 'digest', 'tag', 'image_name', 'image_repo')
 
     def __init__(self, deployment=None, container=None, image=None):
         self.deployment = deployment
         self.container = container
         self.image = image
-        # Everything before the last '/' should make up repo
-        self.image_repo = '/'.join(image.split('/')[:-1])
-        remainder = image.split('/')[-1]
-        if '@' in remainder:
-            self.image_name = remainder.split('@')[0]
-            self.digest     = remainder.split('@')[1]
-        else:
-            self.image_name = remainder.split(':')[0]
-            self.tag        = remainder.split(':')[1]
-    
+        # Everything before the name makes up repo, including a registry port
+        self.image_repo, self.image_name, self.tag, self.digest = split_reference(image)
+
+    def __eq__(self, other):
+        # Same as Image, equal when the canonical references are
+        if not isinstance(other, Operatorimage):
+            return NotImplemented
+        return self.get_reference() == other.get_reference()
+
+    def __hash__(self):
+        return hash(self.get_reference())
+
+    def get_reference(self):
+        return parse_reference(self.image)
+
     def set_digest(self, digest):
         self.digest = digest
-        # We're assuming that when we're called the existing image doesn't have a digest
-        self.image = '{}@{}'.format(self.image.split(':')[0], digest)
\ No newline at end of file
+        # Replaces tag and digest
+        if self.image_repo:
+            self.image = '{}/{}@{}'.format(self.image_repo, self.image_name, digest)
+        else:
+            self.image = '{}@{}'.format(self.image_name, digest)
\ No newline at end of file
@@ -1,4 +1,5 @@
-import os, yaml
+from concurrent.futures import ThreadPoolExecutor
+import os, re, threading, yaml
 
 # Channels are expected to be named <major>.<minor>-{candidate,fast,release}
 PACKAGE_FILE_FORMAT = {
@@ -15,6 +16,9 @@ PACKAGE_FILE_FORMAT = {
 }
 
 class Package:
+    """ An operator package with its channels. Channels are indexed by name, and all methods can be called from
+        several threads at once.
+    """
     PACKAGE_FILE_FORMAT = {
         'channels': [],
         'defaultChannel': '{}-{}',
@@ -22,13 +26,15 @@ class Package:
     }
 
     def __init__(self, package=None, operator=None, default_channel=None):
+        self._lock = threading.RLock()
+        self._channel_index = {}
+        self._indexed_channels = 0
         if package is not None:
             self.operator = package['packageName']
             self.channels = []
             self.default_channel = package['defaultChannel']
             for c in package['channels']:
-                ch = Channel(c['name'], c['currentCSV'])
-                self.channels.append(ch)
+                self._add_channel(Channel(c['name'], c['currentCSV']))
         else:
             self.channels = []
             self.operator = operator if operator is not None else ''
@@ -37,31 +43,42 @@ class Package:
     def __str__(self):
         return 'Package class for {} operator'.format(self.operator)
 
+    def __getstate__(self):
+        # Locks can't be copied or pickled
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
     def get_channel(self, name):
-        for c in self.channels:
-            if c.get_name() == name:
-                return c
+        with self._lock:
+            channels = self._get_index().get(name)
+            return channels[0] if channels else None
 
     def get_channels(self):
-        channels = []
-        for c in self.channels:
-            channels.append(c)
-        return channels
+        with self._lock:
+            return list(self.channels)
 
     def create_channel(self, name, current_csv, default=False):
-        ch = Channel(name, current_csv)
-        self.channels.append(ch)
-        if default:
-            self.default_channel = name
+        with self._lock:
+            self._add_channel(Channel(name, current_csv))
+            if default:
+                self.default_channel = name
 
     def get_formatted(self):
-        f = self.PACKAGE_FILE_FORMAT
-        f['packageName'] = self.operator
-        f['defaultChannel'] = self.default_channel
-        f['channels'] = []
-        for c in self.channels:
-            f['channels'].append({'name': c.get_name(), 'currentCSV': c.get_current_csv()})
-        return f
+        """ Returns the package as a new dict in package.yaml format
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'channels': [{'name': c.get_name(), 'currentCSV': c.get_current_csv()} for c in self.channels],
+                'defaultChannel': self.default_channel,
+                'packageName': self.operator
+            }
 
     def set_default_channel(self, default_channel):
         self.default_channel = default_channel
@@ -70,17 +87,75 @@ class Package:
         self.operator = operator
 
     def update_channel(self, channel, new_csv):
-        for c in self.channels:
-            if c.get_name() == channel:
+        with self._lock:
+            for c in self._get_index().get(channel, ()):
                 c.set_current_csv(new_csv)
 
     def promote_channel(self, promote_from, promote_to):
-        self.update_channel(promote_to, self.get_channel(promote_from).get_current_csv())
+        with self._lock:
+            self.update_channel(promote_to, self.get_channel(promote_from).get_current_csv())
+
+    def promote_channels(self, promote_from, promote_to, create=False):
+        """ Promote every channel matching a name pattern, i.e. promote_channels('{}-candidate', '{}-fast') sets 2.1-fast
+            to the currentCSV of 2.1-candidate, 2.2-fast to that of 2.2-candidate and so on. Names without '{}' promote
+            a single channel.
+
+        :param promote_from: Pattern of the channels to promote from, '{}' matches any part of the name
+        :type promote_from: string
+
+        :param promote_to: Pattern of the channels to promote to, '{}' is replaced by the part matched in promote_from
+        :type promote_to: string
+
+        :param create: Create target channels that don't exist yet, otherwise they are skipped (default: {False})
+        :type create: bool
+
+        :return: (from channel, to channel, currentCSV) of every promotion done
+        :rtype: list
+        """
+        source = _compile_pattern(promote_from)
+        promoted = []
+        with self._lock:
+            for c in list(self.channels):
+                match = source.fullmatch(c.get_name())
+                if match is None:
+                    continue
+                target = promote_to.replace('{}', match.group(1)) if match.groups() else promote_to
+                current_csv = c.get_current_csv()
+                if target in self._get_index():
+                    self.update_channel(target, current_csv)
+                elif create:
+                    self.create_channel(target, current_csv)
+                else:
+                    continue
+                promoted.append((c.get_name(), target, current_csv))
+        return promoted
+
+    def _add_channel(self, channel):
+        self._get_index()
+        self.channels.append(channel)
+        self._channel_index.setdefault(channel.get_name(), []).append(channel)
+        self._indexed_channels = len(self.channels)
+        channel._packages.append(self)
+
+    def _get_index(self):
+        # Rebuild when channels were added to or removed from the list directly
+        if self._indexed_channels != len(self.channels):
+            self._reindex()
+        return self._channel_index
+
+    def _reindex(self):
+        with self._lock:
+            self._channel_index = {}
+            for c in self.channels:
+                self._channel_index.setdefault(c.get_name(), []).append(c)
+            self._indexed_channels = len(self.channels)
 
 class Channel:
     def __init__(self, name, currentCSV):
         self.name = name
         self.currentCSV = currentCSV
+        # Packages indexing this channel by name, told when it is renamed
+        self._packages = []
 
     def get_current_csv(self):
         return self.currentCSV
@@ -92,4 +167,36 @@ class Channel:
         return self.name
 
     def set_name(self, name):
-        self.name = name
\ No newline at end of file
+        self.name = name
+        for p in self._packages:
+            p._reindex()
+
+def promote_channels(packages, promote_from, promote_to, create=False, max_workers=None):
+    """ Promote channels across many packages, i.e. every X.Y-candidate to X.Y-fast. See Package.promote_channels
+
+    Usage::
+
+        for package, promoted in promote_channels(packages, '{}-candidate', '{}-fast', max_workers=8):
+            for source, target, csv in promoted:
+                print('{}: {} -> {} ({})'.format(package.operator, source, target, csv))
+
+    :param packages: Packages to promote channels in
+    :type packages: list
+
+    :param max_workers: Promote packages on this many threads, None to promote them one by one (default: {None})
+    :type max_workers: int
+
+    :return: (package, promotions) for every package, in the order given
+    :rtype: list
+    """
+    packages = list(packages)
+    promote = lambda p: (p, p.promote_channels(promote_from, promote_to, create=create))
+    if max_workers is None:
+        return [promote(p) for p in packages]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(promote, packages))
+
+def _compile_pattern(pattern):
+    if pattern.count('{}') > 1:
+        raise ValueError('Channel patterns can contain at most one {{}}, got {}'.format(pattern))
+    return re.compile('(.+)'.join(re.escape(part) for part in pattern.split('{}')))
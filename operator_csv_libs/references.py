@@ -0,0 +1,140 @@
+from functools import lru_cache
+
+DEFAULT_REGISTRY = 'docker.io'
+DEFAULT_TAG = 'latest'
+# Other names docker hub goes by, all normalised to DEFAULT_REGISTRY
+_DOCKER_HUB_ALIASES = ('index.docker.io', 'registry-1.docker.io', 'registry.hub.docker.com')
+_OFFICIAL_NAMESPACE = 'library'
+
+# Number of distinct reference strings remembered. A CSV refers to tens of images, a catalog to a few thousand
+CACHE_SIZE = 8192
+
+class Reference:
+    """ A parsed, canonical image reference.
+
+        The registry is always set (docker.io by default), docker hub images without a namespace get `library/` and
+        references without tag or digest get the `latest` tag, so `nginx`, `docker.io/nginx:latest` and
+        `index.docker.io/library/nginx` all parse to the same Reference. References are interned by parse_reference,
+        equal references are the same object as long as they are cached.
+
+        References compare and hash by value, so they can be used as dict keys even after they were evicted from the
+        cache. Don't create instances directly, use parse_reference().
+    """
+    __slots__ = ('registry', 'path', 'name', 'tag', 'digest')
+
+    def __init__(self, registry, path, name, tag, digest):
+        self.registry = registry
+        self.path     = path
+        self.name     = name
+        self.tag      = tag
+        self.digest   = digest
+
+    def __repr__(self):
+        return '<Reference {}>'.format(self)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Reference):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __hash__(self):
+        return hash(self._astuple())
+
+    def _astuple(self):
+        return (self.registry, self.path, self.name, self.tag, self.digest)
+
+    def __str__(self):
+        image = self.get_repository()
+        if self.tag is not None:
+            image = '{}:{}'.format(image, self.tag)
+        if self.digest is not None:
+            image = '{}@{}'.format(image, self.digest)
+        return image
+
+    def get_repository(self):
+        """Returns registry, path and name without tag or digest
+
+        :return: Repository i.e. quay.io/myorg/myimage
+        :rtype: string
+        """
+        return '/'.join(p for p in (self.registry, self.path, self.name) if p)
+
+    def get_tag_key(self):
+        """Returns the repository and tag, the part of the reference a tag to digest lookup depends on
+
+        :return: i.e. docker.io/library/nginx:latest
+        :rtype: string
+        """
+        return '{}:{}'.format(self.get_repository(), self.tag)
+
+def split_reference(image):
+    """Split an image reference into its parts as written, without applying any defaults
+
+    Handles registries with ports (localhost:5000/ns/img:1.0) and references with both tag and digest
+    (quay.io/ns/img:1.0@sha256:...). Results are memoized.
+
+    :param image: Image reference
+    :type image: string
+
+    :raises InvalidReference: image has no name
+
+    :return: (repo, name, tag, digest) where repo is everything before the name, i.e. localhost:5000/ns. Parts that
+             are not present are None, repo is '' when there is none
+    :rtype: tuple
+    """
+    return _split_reference(image)
+
+def parse_reference(image):
+    """Parse an image reference into its canonical Reference. Results are memoized and interned
+
+    :param image: Image reference
+    :type image: string
+
+    :raises InvalidReference: image has no name
+
+    :rtype: Reference
+    """
+    return _parse_reference(image)
+
+def clear_cache():
+    """Forget all memoized references"""
+    _split_reference.cache_clear()
+    _parse_reference.cache_clear()
+    _intern.cache_clear()
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _split_reference(image):
+    if not isinstance(image, str):
+        raise InvalidReference('Image reference must be a string, got {!r}'.format(image))
+    remainder, at, digest = image.partition('@')
+    slash = remainder.rfind('/')
+    repo, name = remainder[:slash + 1], remainder[slash + 1:]
+    # A ':' after the last '/' separates the tag, any before belongs to the registry port
+    name, colon, tag = name.partition(':')
+    if not name or (colon and not tag) or (at and not digest) or '@' in digest:
+        raise InvalidReference('Invalid image reference {!r}'.format(image))
+    return repo[:-1], name, tag or None, digest or None
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_reference(image):
+    repo, name, tag, digest = _split_reference(image)
+    registry, _, path = repo.partition('/')
+    # The first component is only a registry if it looks like a host, otherwise it's part of a docker hub path
+    if registry and not ('.' in registry or ':' in registry or registry == 'localhost'):
+        registry, path = DEFAULT_REGISTRY, repo
+    elif not registry or registry in _DOCKER_HUB_ALIASES:
+        registry = DEFAULT_REGISTRY
+    if registry == DEFAULT_REGISTRY and not path:
+        path = _OFFICIAL_NAMESPACE
+    if tag is None and digest is None:
+        tag = DEFAULT_TAG
+    return _intern(registry, path, name, tag, digest)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _intern(registry, path, name, tag, digest):
+    return Reference(registry, path, name, tag, digest)
+
+class InvalidReference(ValueError):
+    pass
@@ -0,0 +1,232 @@
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from . import tracing
+import random, threading, time
+
+class TokenBucket:
+    """ Thread safe token bucket allowing `rate` acquisitions per second with bursts of up to `burst`
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available
+
+        :return: Seconds spent waiting
+        :rtype: float
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class _HostState:
+    def __init__(self, concurrency, rate, burst):
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait(self):
+        # Honour Retry-After / exhausted RateLimit-Remaining from an earlier response
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+class RequestScheduler:
+    """ Schedules registry requests per host: limits concurrent requests, throttles with a token bucket and
+        retries throttled or unavailable responses with jittered exponential backoff.
+
+        `Retry-After` on a 429/503 response and an exhausted `RateLimit-Remaining` (with `RateLimit-Reset`) pause
+        all requests to that host, not just the one that was throttled. Limits are tracked per host, so a slow or
+        throttled registry only holds up its own requests.
+    """
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    DEFAULT_CONCURRENCY = 8
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=None, burst=None, max_retries=5, backoff_base=0.5, backoff_max=30.0, host_limits=None):
+        """
+        :param concurrency: Maximum in flight requests per host (default: {8})
+        :type concurrency: int
+
+        :param rate: Maximum requests per second per host, None for unlimited (default: {None})
+        :type rate: float
+
+        :param burst: Token bucket size, defaults to concurrency
+        :type burst: int
+
+        :param max_retries: Retries for throttled or unavailable responses before giving up (default: {5})
+        :type max_retries: int
+
+        :param backoff_base: Base delay in seconds for exponential backoff (default: {0.5})
+        :type backoff_base: float
+
+        :param backoff_max: Maximum backoff delay in seconds (default: {30})
+        :type backoff_max: float
+
+        :param host_limits: Per host overrides, i.e. {'registry-1.docker.io': {'concurrency': 4, 'rate': 2}}
+        :type host_limits: dict
+        """
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self._host_limits = dict(host_limits or {})
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def set_host_limits(self, host, concurrency=None, rate=None, burst=None):
+        """Override limits for a host. Only affects hosts that have not been requested yet
+
+        :param host: Host name, i.e. quay.io
+        :type host: string
+        """
+        with self._lock:
+            self._host_limits[host] = {'concurrency': concurrency, 'rate': rate, 'burst': burst}
+
+    def get_concurrency(self, host):
+        """Return the maximum number of concurrent requests for host
+
+        :rtype: int
+        """
+        return self._host_limits.get(host, {}).get('concurrency') or self.concurrency
+
+    def request(self, send, method, url, **kwargs):
+        """Send a request through the scheduler
+
+        :param send: Callable performing the request, i.e. requests.Session.request
+        :type send: callable
+
+        :return: The final response. Throttled responses are returned once retries are exhausted
+        :rtype: requests.Response
+        """
+        hostname = urlsplit(url).hostname or ''
+        host = self._get_host(hostname)
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            with host.semaphore:
+                host.wait()
+                if host.bucket is not None:
+                    host.bucket.acquire()
+                try:
+                    resp = send(method, url, **kwargs)
+                except Exception as e:
+                    if tracing.enabled():
+                        tracing.emit(tracing.TraceEvent.REQUEST, host=hostname, method=method, url=url,
+                                     latency=time.perf_counter() - start, retries=attempt, error=e)
+                    raise
+            self._check_rate_limit(host, resp)
+
+            if resp.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                if tracing.enabled():
+                    tracing.emit(tracing.TraceEvent.REQUEST, host=hostname, method=method, url=url, status=resp.status_code,
+                                 latency=time.perf_counter() - start, bytes=self._get_size(resp, kwargs.get('stream')), retries=attempt)
+                return resp
+
+            retry_after = self._get_retry_after(resp)
+            if retry_after is None:
+                delay = self._get_backoff(attempt)
+            else:
+                delay = min(retry_after, self.backoff_max) + random.uniform(0, self.backoff_base)
+            if resp.status_code == 429 or retry_after is not None:
+                host.pause(delay)
+            with self._lock:
+                self.retries += 1
+            attempt += 1
+            # Sleep outside the semaphore so other requests to the host can make progress
+            time.sleep(delay)
+
+    def _get_host(self, hostname):
+        state = self._hosts.get(hostname)
+        if state is not None:
+            return state
+        with self._lock:
+            state = self._hosts.get(hostname)
+            if state is None:
+                limits = self._host_limits.get(hostname, {})
+                concurrency = limits.get('concurrency') or self.concurrency
+                rate = limits.get('rate') or self.rate
+                burst = limits.get('burst') or self.burst or concurrency
+                state = self._hosts[hostname] = _HostState(concurrency, rate, burst)
+            return state
+
+    def _get_backoff(self, attempt):
+        # Full jitter: uniformly spread retries between 0 and the exponential backoff ceiling
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _get_retry_after(self, resp):
+        value = resp.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _check_rate_limit(self, host, resp):
+        # Docker hub sends i.e. 'RateLimit-Remaining: 76;w=21600'
+        remaining = self._get_header_int(resp, 'RateLimit-Remaining')
+        if remaining is not None and remaining <= 0:
+            reset = self._get_header_int(resp, 'RateLimit-Reset')
+            if reset is not None:
+                host.pause(min(reset, self.backoff_max))
+
+    def _get_size(self, resp, stream):
+        # Don't consume streamed bodies just to measure them
+        if not stream:
+            return len(resp.content)
+        return self._get_header_int(resp, 'Content-Length')
+
+    def _get_header_int(self, resp, name):
+        value = resp.headers.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value.split(';')[0].strip())
+        except ValueError:
+            return None
+
+# Default scheduler used by the registry backends in imagerepo
+_scheduler = RequestScheduler()
+
+def get_scheduler():
+    """Return the process wide RequestScheduler used by the registry backends
+
+    :rtype: RequestScheduler
+    """
+    return _scheduler
+
+def set_scheduler(scheduler):
+    """Replace the process wide RequestScheduler used by pooled sessions without a scheduler of their own
+
+    :param scheduler: The scheduler to use
+    :type scheduler: RequestScheduler
+    """
+    global _scheduler
+    _scheduler = scheduler
@@ -0,0 +1,268 @@
+""" Just enough semantic versioning to read CSV versions and olm.skipRange annotations.
+
+    Versions follow semver 2.0 precedence, including pre-release ordering, so 2.1.1-202009111050 < 2.1.1. Ranges use
+    the syntax OLM accepts for skipRange: comparators separated by spaces must all match, alternatives are separated
+    by '||', i.e. '>=1.0.0 <1.2.0 || 2.0.0'.
+
+    Parsed versions and ranges are memoized, and ranges are compiled to intervals so a VersionIndex can find the
+    versions a range covers with binary search.
+"""
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+import re
+
+_VERSION = re.compile(r'^v?(0|[1-9]\d*)(?:\.(0|[1-9]\d*))?(?:\.(0|[1-9]\d*))?(?:-([0-9A-Za-z.-]+))?(?:\+([0-9A-Za-z.-]+))?$')
+_COMPARATOR = re.compile(r'^(>=|<=|!=|==|>|<|=)?\s*(\S+)$')
+
+# Distinct version and range strings remembered. A catalog has a few thousand bundles
+CACHE_SIZE = 8192
+
+def parse_version(version):
+    """Parse a version string, memoized. See Version.parse
+
+    :rtype: Version
+    """
+    return Version.parse(version)
+
+def parse_range(expression):
+    """Parse and compile a range expression, memoized
+
+    :rtype: Range
+    """
+    return _parse_range(expression)
+
+class Version:
+    """ A semantic version. Compares by precedence, build metadata is ignored. Treat instances as immutable, parsed
+        versions are shared
+    """
+    __slots__ = ('major', 'minor', 'patch', 'prerelease', 'build', '_key')
+
+    def __init__(self, major, minor=0, patch=0, prerelease=None, build=None):
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+        self.prerelease = prerelease
+        self.build = build
+        self._key = (major, minor, patch, _prerelease_key(prerelease))
+
+    @classmethod
+    def parse(cls, version, partial=False):
+        """Parse a version string. Results are memoized
+
+        :param version: Version in format X.Y.Z[-prerelease][+build], a leading 'v' is allowed
+        :type version: string
+
+        :param partial: Allow X and X.Y, missing parts are 0 (default: {False})
+        :type partial: bool
+
+        :raises InvalidVersion: version is not a valid semantic version
+
+        :rtype: Version
+        """
+        if not isinstance(version, str):
+            raise InvalidVersion('Invalid semantic version {!r}'.format(version))
+        if cls is not Version:
+            return cls(*_split_version(version, partial))
+        return _parse_version(version, partial)
+
+    def __str__(self):
+        version = '{}.{}.{}'.format(self.major, self.minor, self.patch)
+        if self.prerelease:
+            version += '-' + self.prerelease
+        if self.build:
+            version += '+' + self.build
+        return version
+
+    def __repr__(self):
+        return '<Version {}>'.format(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key < other._key
+
+    def __le__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key <= other._key
+
+    def __gt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key > other._key
+
+    def __ge__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key >= other._key
+
+class Range:
+    """ A version range such as an olm.skipRange, i.e. '>=1.0.0 <1.2.0'. Use parse_range() to share compiled ranges """
+    _OPERATORS = ('=', '==', '!=', '>', '>=', '<', '<=')
+
+    def __init__(self, expression):
+        """
+        :param expression: Range expression
+        :type expression: string
+
+        :raises InvalidVersion: expression is not a valid range
+        """
+        self.expression = expression
+        # Alternatives of comparators that all have to match, as (operator, Version)
+        self.alternatives = []
+        for alternative in expression.split('||'):
+            comparators = []
+            for comparator in _split_comparators(alternative):
+                match = _COMPARATOR.match(comparator)
+                if match is None:
+                    raise InvalidVersion('Invalid range {!r}'.format(expression))
+                comparators.append((match.group(1) or '=', Version.parse(match.group(2), partial=True)))
+            if not comparators:
+                raise InvalidVersion('Invalid range {!r}'.format(expression))
+            self.alternatives.append(comparators)
+        # Each alternative as an interval of version keys, see _compile
+        self.intervals = [i for i in (_compile(comparators) for comparators in self.alternatives) if i is not None]
+
+    def __str__(self):
+        return self.expression
+
+    def __repr__(self):
+        return '<Range {}>'.format(self.expression)
+
+    def __contains__(self, version):
+        if not isinstance(version, Version):
+            version = Version.parse(version)
+        key = version._key
+        for lower, lower_inclusive, upper, upper_inclusive, excluded in self.intervals:
+            if lower is not None and (key < lower or (key == lower and not lower_inclusive)):
+                continue
+            if upper is not None and (key > upper or (key == upper and not upper_inclusive)):
+                continue
+            if key not in excluded:
+                return True
+        return False
+
+class VersionIndex:
+    """ Versions kept sorted, answering which of them a range covers with binary search instead of a scan.
+
+        Usage::
+
+            index = VersionIndex((csv.get_version(), csv) for csv in csvs)
+            skipped = index.covered(parse_range('>=2.0.0 <2.3.0'))
+    """
+    def __init__(self, items=()):
+        """
+        :param items: (version, value) pairs, the version as a Version or string
+        :type items: iterable
+        """
+        self._keys = []
+        self._items = []
+        for version, value in items:
+            self.add(version, value)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, version, value=None):
+        """Add a version. Versions that compare equal are kept in the order they were added
+
+        :param version: Version or version string
+        :type version: Version, string
+
+        :param value: Returned by covered() for this version (default: {the Version})
+        """
+        if not isinstance(version, Version):
+            version = Version.parse(version)
+        i = bisect_right(self._keys, version._key)
+        self._keys.insert(i, version._key)
+        self._items.insert(i, (version, version if value is None else value))
+
+    def get_versions(self):
+        """Returns all versions, lowest first
+
+        :rtype: list
+        """
+        return [version for version, _ in self._items]
+
+    def covered(self, version_range):
+        """Returns the values of the versions in a range, lowest version first
+
+        :param version_range: Range or range expression
+        :type version_range: Range, string
+
+        :rtype: list
+        """
+        if not isinstance(version_range, Range):
+            version_range = parse_range(version_range)
+        # Alternatives may overlap, collect positions so nothing is returned twice
+        positions = set()
+        for lower, lower_inclusive, upper, upper_inclusive, excluded in version_range.intervals:
+            start = 0 if lower is None else (bisect_left if lower_inclusive else bisect_right)(self._keys, lower)
+            end = len(self._keys) if upper is None else (bisect_right if upper_inclusive else bisect_left)(self._keys, upper)
+            positions.update(i for i in range(start, end) if self._keys[i] not in excluded)
+        return [self._items[i][1] for i in sorted(positions)]
+
+def _split_version(version, partial):
+    match = _VERSION.match(version.strip())
+    if match is None or (not partial and match.group(3) is None):
+        raise InvalidVersion('Invalid semantic version {!r}'.format(version))
+    major, minor, patch, prerelease, build = match.groups()
+    return int(major), int(minor or 0), int(patch or 0), prerelease, build
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_version(version, partial):
+    return Version(*_split_version(version, partial))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_range(expression):
+    return Range(expression)
+
+def _compile(comparators):
+    # Intersect the comparators of one alternative into (lower, lower inclusive, upper, upper inclusive, excluded keys),
+    # None bounds are open. Returns None when nothing can match
+    lower, lower_inclusive, upper, upper_inclusive, excluded = None, True, None, True, set()
+    for op, version in comparators:
+        key = version._key
+        if op in ('>', '>=', '=', '=='):
+            inclusive = op != '>'
+            if lower is None or key > lower or (key == lower and not inclusive):
+                lower, lower_inclusive = key, inclusive
+        if op in ('<', '<=', '=', '=='):
+            inclusive = op != '<'
+            if upper is None or key < upper or (key == upper and not inclusive):
+                upper, upper_inclusive = key, inclusive
+        if op == '!=':
+            excluded.add(key)
+    if lower is not None and upper is not None and (lower > upper or (lower == upper and not (lower_inclusive and upper_inclusive))):
+        return None
+    return (lower, lower_inclusive, upper, upper_inclusive, frozenset(excluded))
+
+def _prerelease_key(prerelease):
+    # A release sorts after all of its pre-releases. Numeric identifiers sort numerically and before alphanumeric ones
+    if not prerelease:
+        return (1,)
+    return (0, tuple((0, int(p), '') if p.isdigit() else (1, 0, p) for p in prerelease.split('.')))
+
+def _split_comparators(expression):
+    # '>= 1.0.0 <1.2.0' -> ['>=1.0.0', '<1.2.0'], an operator may be separated from its version by spaces
+    parts, operator = [], ''
+    for token in expression.split():
+        if token in Range._OPERATORS:
+            operator = token
+            continue
+        parts.append(operator + token)
+        operator = ''
+    if operator:
+        raise InvalidVersion('Invalid range {!r}'.format(expression))
+    return parts
+
+class InvalidVersion(ValueError):
+    pass
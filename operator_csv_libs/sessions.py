@@ -0,0 +1,117 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from .scheduler import get_scheduler
+import threading
+import requests
+
+class _ScheduledSession(requests.Session):
+    """ requests.Session that sends every request through a RequestScheduler
+    """
+    def __init__(self, scheduler=None):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, method, url, **kwargs):
+        scheduler = self.scheduler or get_scheduler()
+        return scheduler.request(super().request, method, url, **kwargs)
+
+class SessionPool:
+    """ Hands out keep-alive requests sessions shared by all registry backends, one per registry host (and credentials).
+
+        Each session mounts an HTTPAdapter whose connection pool holds up to `pool_size` connections to its host, so
+        consecutive lookups against quay.io, registry-1.docker.io or artifactory reuse open TCP+TLS connections
+        instead of opening a new one per request. Sessions are fully configured before they are handed out and are
+        never modified afterwards, which makes them safe to share across threads.
+
+        Every request goes through a RequestScheduler enforcing per host limits and retrying throttled responses.
+    """
+    DEFAULT_POOL_SIZE = 10
+
+    def __init__(self, pool_size=None, pool_sizes=None, scheduler=None):
+        """
+        :param pool_size: Connections kept open per host unless overridden (default: {DEFAULT_POOL_SIZE})
+        :type pool_size: int
+
+        :param pool_sizes: Per host pool size overrides, i.e. {'quay.io': 32}
+        :type pool_sizes: dict
+
+        :param scheduler: Scheduler for requests made through the sessions (default: {scheduler.get_scheduler()})
+        :type scheduler: RequestScheduler
+        """
+        self.pool_size = pool_size if pool_size is not None else self.DEFAULT_POOL_SIZE
+        self.scheduler = scheduler
+        self._pool_sizes = dict(pool_sizes or {})
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def set_pool_size(self, host, pool_size):
+        """Set the connection pool size for a host. Only affects sessions created after the call
+
+        :param host: Host name, i.e. quay.io
+        :type host: string
+
+        :param pool_size: Number of connections to keep open to the host
+        :type pool_size: int
+        """
+        with self._lock:
+            self._pool_sizes[host] = pool_size
+
+    def get_pool_size(self, host):
+        return self._pool_sizes.get(host, self.pool_size)
+
+    def get_session(self, url, auth=None):
+        """Return the shared session for the host of url
+
+        :param url: Any url on the registry host
+        :type url: string
+
+        :param auth: Credentials to attach to the session, i.e. (user, key) for artifactory (default: {None})
+        :type auth: tuple
+
+        :rtype: requests.Session
+        """
+        key = (urlsplit(url).netloc, auth)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session(key[0], auth)
+                self._sessions[key] = session
+            return session
+
+    def close(self):
+        """Close all pooled connections. New sessions are created on the next request
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for s in sessions:
+            s.close()
+
+    def _new_session(self, host, auth):
+        pool_size = self.get_pool_size(host.split(':')[0])
+        session = _ScheduledSession(self.scheduler)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.auth = auth
+        return session
+
+# Default pool used by the registry backends in imagerepo
+_session_pool = SessionPool()
+
+def get_session_pool():
+    """Return the process wide SessionPool used by the registry backends
+
+    :rtype: SessionPool
+    """
+    return _session_pool
+
+def get_session(url, auth=None):
+    """Return the shared keep-alive session for the host of url from the default SessionPool
+
+    :rtype: requests.Session
+    """
+    return _session_pool.get_session(url, auth)
@@ -0,0 +1,125 @@
+import asyncio, threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _AsyncCall:
+    def __init__(self, task, result):
+        # Task running fn(), and the future callers that joined the call wait on
+        self.task = task
+        self.result = result
+
+class SingleFlight:
+    """ Coalesces concurrent calls for the same key into a single in-progress call.
+
+        The first caller for a key runs the function, callers arriving while it is in flight wait for it and get
+        the same result, or the same exception raised. Once the call completes the key is forgotten, so results
+        are never cached beyond the lifetime of the call. `coalesced` counts the calls that did not run the function
+        themselves.
+
+        Blocking callers use `do()`, coroutines use `do_async()`. The two do not share in-flight calls.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Call fn() unless a call for key is already in flight, in which case wait for and return its result
+
+        :param key: Hashable key identifying the call
+        :type key: hashable
+
+        :param fn: Function to call
+        :type fn: callable
+
+        :raises Exception: Whatever fn() raised, in every caller waiting on it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, fn):
+        """Await fn() unless a call for key is already in flight on this event loop, in which case await its result
+
+        Cancelling the caller that started the call cancels fn() as well, callers waiting on it then get
+        FlightCancelled. The key stays in flight until fn() has finished unwinding, so a new call for it is not
+        started alongside the one being torn down.
+
+        :param key: Hashable key identifying the call
+        :type key: hashable
+
+        :param fn: Coroutine function to call
+        :type fn: callable
+
+        :raises FlightCancelled: The caller that started the call was cancelled
+        """
+        # Futures are bound to their loop, so in-flight calls are tracked per loop
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)
+        call = self._async_calls.get(key)
+        if call is not None:
+            with self._lock:
+                self.coalesced += 1
+            # shield() so a cancelled waiter does not cancel the call for everyone else
+            return await asyncio.shield(call.result)
+
+        call = self._async_calls[key] = _AsyncCall(asyncio.ensure_future(fn()), loop.create_future())
+        call.task.add_done_callback(lambda task: self._finish_async(key, call))
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            call.task.cancel()
+            raise
+
+    def _finish_async(self, key, call):
+        # Runs once the task is done, whoever started it. Only the call that registered the key removes it
+        if self._async_calls.get(key) is call:
+            del self._async_calls[key]
+        if call.task.cancelled():
+            error = FlightCancelled('The call for {!r} was cancelled'.format(key[1]))
+        else:
+            error = call.task.exception()
+        if error is None:
+            call.result.set_result(call.task.result())
+        else:
+            call.result.set_exception(error)
+            # There may be no one waiting, don't log the exception as never retrieved
+            call.result.exception()
+
+    def in_flight(self):
+        """Return the number of calls currently in flight
+
+        :rtype: int
+        """
+        with self._lock:
+            return len(self._calls) + len(self._async_calls)
+
+class FlightCancelled(Exception):
+    pass
@@ -0,0 +1,198 @@
+import unittest
+import asyncio
+import os
+import json
+from unittest.mock import patch
+from aiohttp import web, ClientSession
+from aiohttp.test_utils import TestServer
+from ..asyncimagerepo import AsyncImageRepo, AsyncArtifactoryRepo, AsyncQuayRepo, AsyncDockerRepo
+from ..imagerepo import QuayRepo, DockerRepo, ManifestNotFound, ManifestListNotFound, MissingCredentials, RepoTypeNotImplemented
+from ..images import Image
+from .. import tracing
+
+IMG_NAME = 'dummyImageName'
+DEPLOYMENT = 'dummyDeploymentName'
+CONTAINER = 'dummyContainerName'
+
+QUAY_IMAGE_WITH_MANIFEST_LIST = 'quay.io/hybridappio/ham-application-assembler:with_manifest_list'
+QUAY_IMAGE_WITH_MANIFEST = 'quay.io/hybridappio/ham-application-assembler:with_manifest'
+QUAY_IMAGE_MISSING = 'quay.io/hybridappio/ham-application-assembler:missing'
+QUAY_IMAGE_PRIVATE = 'quay.io/private/ham-application-assembler:with_manifest'
+DOCKER_IMAGE_WITH_MANIFEST = 'docker.io/ibmcom/ibm-operator-catalog:with_manifest'
+DOCKER_IMAGE_WITH_MANIFEST_LIST = 'docker.io/ibmcom/ibm-operator-catalog:with_manifest_list'
+ARTIFACTORY_IMAGE = 'hyc-cp4mcm-team-docker-local.artifactory.swg-devops.com/cicd/cp4mcm/cp4mcm-orchestrator-catalog:release-2.0'
+ARTIFACTORY_IMAGE_MISSING = 'hyc-cp4mcm-team-docker-local.artifactory.swg-devops.com/cicd/cp4mcm/cp4mcm-orchestrator-catalog:missing'
+
+MANIFEST_LIST = {'schemaVersion': 2, 'mediaType': DockerRepo.MANIFEST_LIST_MEDIA_TYPE, 'manifests': []}
+
+
+class FakeRegistry:
+    """ Local stand in for the quay api, docker hub auth and registry endpoints, and artifactory storage api
+    """
+    def __init__(self):
+        self.requests = []
+        self.methods = []
+        self.app = web.Application()
+        self.app.router.add_get('/api/v1/repository/{org}/{repo}/tag/', self.quay_tags)
+        self.app.router.add_get('/v2/{org}/{repo}/manifests/{tag}', self.manifests)
+        self.app.router.add_get('/token', self.token)
+        self.app.router.add_get('/artifactory/api/storage/{path:.*}', self.artifactory_storage)
+        self.app.router.add_get('/artifactory/{path:.*}', self.artifactory_file)
+
+    async def quay_tags(self, request):
+        self.requests.append(request.path)
+        if request.match_info['org'] == 'private':
+            return web.Response(status=403, text='forbidden')
+        tag = request.query['specificTag']
+        if tag == 'missing':
+            return web.Response(status=404, text='not found')
+        return web.json_response({'tags': [{
+            'is_manifest_list': tag == 'with_manifest_list',
+            'manifest_digest': 'sha256:quay_{}'.format(tag)
+        }]})
+
+    async def token(self, request):
+        self.requests.append(request.path)
+        return web.json_response({'token': 'dummy_token'})
+
+    async def manifests(self, request):
+        self.requests.append(request.path)
+        self.methods.append(request.method)
+        tag = request.match_info['tag']
+        if tag == 'missing':
+            return web.Response(status=404, text='not found')
+        if tag == 'with_manifest_list' and 'manifest.list' in request.headers.get('accept', ''):
+            return web.Response(body=json.dumps(MANIFEST_LIST), headers={
+                'Content-Type': DockerRepo.MANIFEST_LIST_MEDIA_TYPE,
+                'Docker-Content-Digest': 'sha256:list_{}'.format(tag)
+            })
+        return web.Response(body='{}', headers={
+            'Content-Type': DockerRepo.MANIFEST_MEDIA_TYPE,
+            'Docker-Content-Digest': 'sha256:image_{}'.format(tag)
+        })
+
+    async def artifactory_storage(self, request):
+        self.requests.append(request.path)
+        path = request.match_info['path']
+        if request.headers.get('Authorization') is None:
+            return web.Response(status=401, text='unauthorized')
+        if '/missing/' in path:
+            return web.Response(status=404, text='not found')
+        return web.json_response({'path': path, 'checksums': {'sha256': 'art_{}'.format(path.split('/')[-1])}})
+
+    async def artifactory_file(self, request):
+        self.requests.append(request.path)
+        if '/missing/' in request.match_info['path']:
+            return web.Response(status=404, text='not found')
+        return web.json_response(MANIFEST_LIST)
+
+
+class TestAsyncImageRepo(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.registry = FakeRegistry()
+        self.server = TestServer(self.registry.app)
+        await self.server.start_server()
+        base = str(self.server.make_url('')).rstrip('/')
+
+        self.patches = [
+            patch.object(QuayRepo, 'QUAY_BASE_URL', base + '/api/v1/repository'),
+            patch.object(QuayRepo, 'QUAY_REGISTRY_URL', base + '/v2/{repo}/manifests/{tag}'),
+            patch.object(DockerRepo, 'DOCKER_AUTH_URL', base + '/token?scope=repository%3A{org}%2F{repo}%3Apull&service=registry.docker.io'),
+            patch.object(DockerRepo, 'DOCKER_REGISTRY_URL', base + '/v2/{org}/{repo}/manifests/{tag}'),
+            patch.dict(os.environ, {
+                'ARTIFACTORY_USER': 'dummyUser',
+                'ARTIFACTORY_KEY': 'dummyKey',
+                'ARTIFACTORY_BASE': base + '/artifactory'
+            })
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        for p in self.patches:
+            p.stop()
+        await self.server.close()
+
+    def _repo(self, image, session=None):
+        return AsyncImageRepo(Image(IMG_NAME, image, DEPLOYMENT, CONTAINER), session=session)
+
+    async def test_init(self):
+        self.assertIsInstance(self._repo(QUAY_IMAGE_WITH_MANIFEST).image_repo, AsyncQuayRepo)
+        self.assertIsInstance(self._repo(DOCKER_IMAGE_WITH_MANIFEST).image_repo, AsyncDockerRepo)
+        self.assertIsInstance(self._repo(ARTIFACTORY_IMAGE).image_repo, AsyncArtifactoryRepo)
+        with self.assertRaises(RepoTypeNotImplemented):
+            self._repo('registry.example.com/org/image:tag')
+
+    async def test_quay(self):
+        self.assertEqual(await self._repo(QUAY_IMAGE_WITH_MANIFEST_LIST).get_manifest_list_digest(), 'sha256:quay_with_manifest_list')
+        self.assertEqual(await self._repo(QUAY_IMAGE_WITH_MANIFEST).get_image_digest(), 'sha256:quay_with_manifest')
+        self.assertEqual(await self._repo(QUAY_IMAGE_WITH_MANIFEST_LIST).get_raw_manifest_list(), MANIFEST_LIST)
+
+        # Same exceptions as the blocking api
+        with self.assertRaises(ManifestNotFound):
+            await self._repo(QUAY_IMAGE_WITH_MANIFEST_LIST).get_image_digest()
+        with self.assertRaises(ManifestListNotFound):
+            await self._repo(QUAY_IMAGE_WITH_MANIFEST).get_manifest_list_digest()
+        with self.assertRaises(ManifestNotFound):
+            await self._repo(QUAY_IMAGE_MISSING).get_image_digest()
+        with self.assertRaises(MissingCredentials):
+            await self._repo(QUAY_IMAGE_PRIVATE).get_image_digest()
+        with self.assertRaises(ManifestListNotFound):
+            await self._repo(QUAY_IMAGE_WITH_MANIFEST).get_raw_manifest_list()
+
+    async def test_docker(self):
+        self.assertEqual(await self._repo(DOCKER_IMAGE_WITH_MANIFEST_LIST).get_manifest_list_digest(), 'sha256:list_with_manifest_list')
+        self.assertEqual(await self._repo(DOCKER_IMAGE_WITH_MANIFEST).get_image_digest(), 'sha256:image_with_manifest')
+        # Digests are resolved with one HEAD request each
+        self.assertEqual(self.registry.methods, ['HEAD', 'HEAD'])
+        self.assertEqual(await self._repo(DOCKER_IMAGE_WITH_MANIFEST_LIST).get_raw_manifest_list(), MANIFEST_LIST)
+
+        with self.assertRaises(ManifestListNotFound):
+            await self._repo(DOCKER_IMAGE_WITH_MANIFEST).get_manifest_list_digest()
+        with self.assertRaises(ManifestNotFound):
+            await self._repo(DOCKER_IMAGE_WITH_MANIFEST_LIST).get_image_digest()
+        with self.assertRaises(ManifestListNotFound):
+            await self._repo(DOCKER_IMAGE_WITH_MANIFEST).get_raw_manifest_list()
+
+    async def test_docker_token_coalesced(self):
+        # Lookups of different tags in one repository all need the same token, only one of them fetches it
+        DockerRepo._token_cache.clear()
+        async with ClientSession() as session:
+            digests = await asyncio.gather(*[
+                self._repo('docker.io/ibmcom/ibm-operator-catalog:tag{}'.format(i), session=session).get_image_digest() for i in range(10)
+            ])
+        self.assertEqual(digests, ['sha256:image_tag{}'.format(i) for i in range(10)])
+        self.assertEqual(self.registry.requests.count('/token'), 1)
+
+    async def test_artifactory(self):
+        self.assertEqual(await self._repo(ARTIFACTORY_IMAGE).get_image_digest(), 'sha256:art_manifest.json')
+        self.assertEqual(await self._repo(ARTIFACTORY_IMAGE).get_manifest_list_digest(), 'sha256:art_list.manifest.json')
+        self.assertEqual(await self._repo(ARTIFACTORY_IMAGE).get_raw_manifest_list(), MANIFEST_LIST)
+        self.assertIn('/artifactory/api/storage/hyc-cp4mcm-team-docker-local/cicd/cp4mcm/cp4mcm-orchestrator-catalog/release-2.0/manifest.json', self.registry.requests)
+
+        with self.assertRaises(ManifestNotFound):
+            await self._repo(ARTIFACTORY_IMAGE_MISSING).get_image_digest()
+        with self.assertRaises(ManifestListNotFound):
+            await self._repo(ARTIFACTORY_IMAGE_MISSING).get_manifest_list_digest()
+        with self.assertRaises(ManifestListNotFound):
+            await self._repo(ARTIFACTORY_IMAGE_MISSING).get_raw_manifest_list()
+
+    async def test_concurrent_lookups_shared_session(self):
+        # Many lookups overlap on one event loop and share a single client session
+        async with ClientSession() as session:
+            digests = await asyncio.gather(*[
+                self._repo(QUAY_IMAGE_WITH_MANIFEST_LIST, session=session).get_manifest_list_digest() for _ in range(50)
+            ])
+        self.assertEqual(digests, ['sha256:quay_with_manifest_list'] * 50)
+
+    async def test_tracing(self):
+        events = []
+        tracing.subscribe(events.append)
+        try:
+            await self._repo(QUAY_IMAGE_WITH_MANIFEST).get_image_digest()
+        finally:
+            tracing.unsubscribe(events.append)
+        request, lookup = events
+        self.assertEqual((request.kind, request.backend, request.operation, request.status), ('request', 'quay', 'get_image_digest', 200))
+        self.assertGreater(request.bytes, 0)
+        self.assertEqual((lookup.kind, lookup.host), ('lookup', 'quay.io'))
@@ -0,0 +1,106 @@
+import unittest
+import os
+import shutil
+import tempfile
+import pickle
+import yaml
+from ..bulk import TransformSpec, BundleResult, process_bundle, process_bundles
+from ..csv import ClusterServiceVersion
+from ..mirrors import MirrorMap
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+VALID_CSV = THIS_DIR + '/test_files/valid_csv.yaml'
+OPERATOR_IMAGE = 'quay.io/cp4mcm/ibm-management-orchestrator@sha256:9c1840496d49b95a1d02a44cc0269f6a4a0bcec2711eda9812da9dd8b0fa6990'
+RELATED_IMAGE = 'cp.icr.io/cp/cp4mcm/cp4mcm-operator-catalog@sha256:b2aeba0e620b4325bda303af3024e7dafc809dd637ca99c50788a3d6a0e6234f'
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.paths = []
+        for version in ('2.1.0', '2.1.1', '2.2.0'):
+            path = os.path.join(self.tmp, 'bundles', version, 'manifests', 'orchestrator.clusterserviceversion.yaml')
+            os.makedirs(os.path.dirname(path))
+            shutil.copy(VALID_CSV, path)
+            self.paths.append(path)
+        self.spec = TransformSpec(
+            version='9.9.9',
+            replaces='ibm-management-orchestrator.v9.9.8',
+            skiprange='>=9.0.0 <9.9.9',
+            pull_secrets=['dummySecret'],
+            image_overrides={
+                OPERATOR_IMAGE: 'quay.io/cp4mcm/ibm-management-orchestrator:9.9.9',
+                RELATED_IMAGE: 'cp.icr.io/cp/cp4mcm/cp4mcm-operator-catalog:9.9.9'
+            },
+            related_images=True
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _check_output(self, path):
+        with open(path, 'r') as stream:
+            csv = yaml.safe_load(stream)
+        self.assertEqual(csv['metadata']['name'], 'ibm-management-orchestrator.v9.9.9')
+        self.assertEqual(csv['spec']['version'], '9.9.9')
+        self.assertEqual(csv['spec']['replaces'], 'ibm-management-orchestrator.v9.9.8')
+        self.assertEqual(csv['metadata']['annotations']['olm.skipRange'], '>=9.0.0 <9.9.9')
+        deployment = csv['spec']['install']['spec']['deployments'][0]
+        self.assertEqual(deployment['spec']['template']['spec']['imagePullSecrets'], [{'name': 'dummySecret'}])
+        self.assertEqual(deployment['spec']['template']['spec']['containers'][0]['image'], 'quay.io/cp4mcm/ibm-management-orchestrator:9.9.9')
+        self.assertEqual(deployment['spec']['template']['metadata']['annotations']['olm.relatedImage.cp4mcm-catalog'], 'cp.icr.io/cp/cp4mcm/cp4mcm-operator-catalog:9.9.9')
+        self.assertEqual(csv['spec']['relatedImages'], [{'name': 'cp4mcm-catalog', 'image': 'cp.icr.io/cp/cp4mcm/cp4mcm-operator-catalog:9.9.9'}])
+
+    def test_spec_is_picklable(self):
+        self.assertEqual(pickle.loads(pickle.dumps(self.spec)).image_overrides, self.spec.image_overrides)
+
+    def test_process_bundle(self):
+        result = process_bundle(self.paths[0], self.spec)
+        self.assertIsInstance(result, BundleResult)
+        self.assertTrue(result.ok())
+        self.assertEqual(result.output, self.paths[0])
+        self.assertEqual(result.name, 'ibm-management-orchestrator.v9.9.9')
+        self.assertEqual(result.images_replaced, 2)
+        self._check_output(self.paths[0])
+
+    def test_process_bundles_in_place(self):
+        broken = os.path.join(self.tmp, 'broken.clusterserviceversion.yaml')
+        with open(broken, 'w') as stream:
+            stream.write('metadata: [unbalanced')
+        missing = os.path.join(self.tmp, 'missing.yaml')
+
+        results = {r.path: r for r in process_bundles(self.paths + [broken, missing], self.spec, max_workers=2)}
+        self.assertEqual(len(results), 5)
+        for path in self.paths:
+            self.assertTrue(results[path].ok(), results[path])
+            self._check_output(path)
+        # Bad bundles only fail themselves
+        self.assertTrue(results[broken].error.startswith('ParserError') or results[broken].error.startswith('MarkedYAMLError'), results[broken].error)
+        self.assertTrue(results[missing].error.startswith('FileNotFoundError'))
+
+    def test_process_bundles_output_dir(self):
+        out = os.path.join(self.tmp, 'out')
+        results = list(process_bundles(self.paths, TransformSpec(version='9.9.9'), max_workers=2, output_dir=out))
+        self.assertTrue(all(r.ok() for r in results))
+        for version in ('2.1.0', '2.1.1', '2.2.0'):
+            output = os.path.join(out, version, 'manifests', 'orchestrator.clusterserviceversion.yaml')
+            self.assertEqual(ClusterServiceVersion.from_path(output).original_csv['spec']['version'], '9.9.9')
+        # Inputs are left untouched
+        with open(VALID_CSV, 'r') as a, open(self.paths[0], 'r') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_mirrors(self):
+        spec = TransformSpec(mirrors=MirrorMap({'quay.io/cp4mcm': 'mirror.example.com/cp4mcm', 'cp.icr.io/cp': 'mirror.example.com/cp'}))
+        results = list(process_bundles(self.paths, spec, max_workers=2))
+        for result in results:
+            self.assertTrue(result.ok(), result)
+            self.assertEqual(result.images_replaced, 3)
+            self.assertEqual(result.mirrored, {'quay.io/cp4mcm': 1, 'cp.icr.io/cp': 2})
+        with open(self.paths[0], 'r') as stream:
+            csv = yaml.safe_load(stream)
+        self.assertEqual(csv['spec']['relatedImages'][0]['image'], RELATED_IMAGE.replace('cp.icr.io', 'mirror.example.com'))
+
+    def test_max_workers(self):
+        with self.assertRaises(ValueError):
+            list(process_bundles(self.paths, self.spec, max_workers=0))
+        self.assertEqual(list(process_bundles([], self.spec)), [])
@@ -1,9 +1,12 @@
 import unittest
 import pytest
 import copy
-import os, yaml
-from ..csv import ClusterServiceVersion, _literal, _literal_presenter
+import os, yaml, tempfile
+from ..csv import ClusterServiceVersion, _literal, _literal_presenter, _CSVDumper, _PyCSVDumper
 from ..images import Image
+from .. import imagerepo
+from ..imagerepo import DigestResult, ManifestNotFound, ManifestListNotFound, PIN_PREFER_MANIFEST_LIST
+from unittest.mock import patch
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -402,7 +405,7 @@ class TestCSV(unittest.TestCase):
         self.assertEqual(testcsvWithParams.csv['spec']['replaces'], testcsvWithParams.replaces)
         self.assertEqual(testcsvWithParams.csv['spec']['replaces'], 'newReplaces')
 
-    def test__get_operator_images(self):
+    def test__scan_deployments_operator_images(self):
         testcsvWithoutParams = ClusterServiceVersion(DUMMY_CSV)
         # remove any values in original operator images and operator images
         testcsvWithoutParams.original_operator_images = []
@@ -411,7 +414,7 @@ class TestCSV(unittest.TestCase):
         self.assertEqual(testcsvWithoutParams.operator_images, [])
 
         # call function to populate all images
-        testcsvWithoutParams._get_operator_images()
+        testcsvWithoutParams._scan_deployments()
 
         # should only be one image
         self.assertEqual(len(testcsvWithoutParams.original_operator_images), 1)
@@ -423,7 +426,7 @@ class TestCSV(unittest.TestCase):
         # check to see that both images are the same for operator images list and orignal operator images list
         self.assertEqual(testcsvWithoutParams.operator_images[0], testcsvWithoutParams.original_operator_images[0])
 
-    def test__get_related_images(self):
+    def test__scan_deployments_related_images(self):
         testcsvWithoutParams = ClusterServiceVersion(DUMMY_CSV)
         testAnnotationRelatedImages = [self.Image1, self.Image2, self.Image3]
         # remove any values in annotation related images list
@@ -431,7 +434,7 @@ class TestCSV(unittest.TestCase):
         self.assertEqual(testcsvWithoutParams.annotation_related_images, [])
 
         # call function to populate all images
-        testcsvWithoutParams._get_related_images()
+        testcsvWithoutParams._scan_deployments()
 
         # should be three images
         self.assertEqual(len(testcsvWithoutParams.annotation_related_images), 3)
@@ -446,7 +449,7 @@ class TestCSV(unittest.TestCase):
         testcsvWithoutParams.csv['spec']['install']['spec']['deployments'][0]['spec']['template']['metadata'].pop('annotations')
 
         # Call function to populate all images
-        testcsvWithoutParams._get_related_images()
+        testcsvWithoutParams._scan_deployments()
 
         self.assertEqual(len(testcsvWithoutParams.annotation_related_images), 0)
         
@@ -535,6 +538,268 @@ class TestCSV(unittest.TestCase):
         csv_sample_formatted['metadata']['annotations']['alm-examples'] = _literal(csv_sample_formatted['metadata']['annotations']['alm-examples'])
         self.assertEqual(c.get_formatted_csv(), yaml.dump(csv_sample_formatted, default_flow_style=False))
 
+    def test_copy_on_write(self):
+        with open(THIS_DIR + '/test_files/valid_csv.yaml', 'r') as stream:
+            csv_sample = yaml.safe_load(stream)
+        ORIGINAL = copy.deepcopy(csv_sample)
+
+        c = ClusterServiceVersion(csv_sample, target_version='9.9.9', replaces='dummy.v9.9.8')
+        c.set_image_pullsecret('dummyPullSecret')
+        c.set_deployments_annotations('dummyKey', 'dummyValue')
+        c.operator_images[0].set_digest('sha256:{}'.format(newContainerImageSHA1))
+        c.generate_spec_relatedImages()
+        updated = c.get_updated_csv()
+
+        # Setters never touch the dict passed in
+        self.assertEqual(c.original_csv, ORIGINAL)
+        self.assertEqual(updated['spec']['version'], '9.9.9')
+        self.assertEqual(updated['spec']['replaces'], 'dummy.v9.9.8')
+        deployment = updated['spec']['install']['spec']['deployments'][0]
+        self.assertEqual(deployment['spec']['template']['spec']['imagePullSecrets'], [{'name': 'dummyPullSecret'}])
+        self.assertEqual(deployment['spec']['template']['metadata']['annotations']['dummyKey'], 'dummyValue')
+        self.assertTrue(deployment['spec']['template']['spec']['containers'][0]['image'].endswith(newContainerImageSHA1))
+
+        # Subtrees that were not modified are shared with the original rather than copied
+        self.assertIs(c._csv['spec']['customresourcedefinitions'], csv_sample['spec']['customresourcedefinitions'])
+        self.assertIs(c._csv['spec']['install']['spec']['clusterPermissions'], csv_sample['spec']['install']['spec']['clusterPermissions'])
+        self.assertIs(c._csv['spec']['icon'], csv_sample['spec']['icon'])
+
+        # get_updated_csv returns an independent dict
+        updated['spec']['customresourcedefinitions']['owned'].clear()
+        updated['metadata']['annotations']['alm-examples'] = ''
+        self.assertEqual(c.get_updated_csv(), c.get_updated_csv())
+        self.assertNotEqual(c.get_updated_csv()['spec']['customresourcedefinitions']['owned'], [])
+        self.assertEqual(c.original_csv, ORIGINAL)
+
+    def test_copy_on_write_direct_access(self):
+        with open(THIS_DIR + '/test_files/valid_csv.yaml', 'r') as stream:
+            csv_sample = yaml.safe_load(stream)
+        ORIGINAL = copy.deepcopy(csv_sample)
+
+        c = ClusterServiceVersion(csv_sample)
+        # Modifying the owned crds or the csv attribute directly never leaks into the original
+        c.get_owned_crds().append({'name': 'dummyCRD'})
+        self.assertEqual(c.get_updated_csv()['spec']['customresourcedefinitions']['owned'][-1], {'name': 'dummyCRD'})
+        c.csv['spec']['install']['spec']['deployments'][0]['spec']['template']['spec']['containers'][0]['image'] = 'dummyImage'
+        c.csv['spec']['customresourcedefinitions']['owned'].pop()
+        self.assertEqual(c.csv['spec']['install']['spec']['deployments'][0]['spec']['template']['spec']['containers'][0]['image'], 'dummyImage')
+        self.assertEqual(c.original_csv, ORIGINAL)
+
+    def test_write_back_index(self):
+        c = ClusterServiceVersion(DUMMY_CSV)
+        deployments = c.csv['spec']['install']['spec']['deployments']
+        self.assertEqual(c._container_index[('deploymentsDummyName', 'containerImageDummyName1')], [(0, 0)])
+
+        # Add a deployment in front of the indexed one, the index heals itself on the next write back
+        extra = copy.deepcopy(deployments[0])
+        extra['name'] = 'extraDeployment'
+        deployments.insert(0, extra)
+        c.operator_images = [self.newOperatorImage1, Image(deployment='extraDeployment', container='containerImageDummyName1', image='extraImage')]
+        c.annotation_related_images = [self.Image4]
+        updated = c.get_updated_csv()
+        updated_deployments = updated['spec']['install']['spec']['deployments']
+        self.assertEqual(updated_deployments[0]['spec']['template']['spec']['containers'][0]['image'], 'extraImage')
+        self.assertEqual(updated_deployments[1]['spec']['template']['spec']['containers'][0]['image'], self.newOperatorImage1.image)
+        self.assertEqual(updated_deployments[1]['spec']['template']['metadata']['annotations']['olm.relatedImage.dummyRelatedImages4'], self.Image4.image)
+        self.assertNotIn('olm.relatedImage.dummyRelatedImages4', updated_deployments[0]['spec']['template']['metadata']['annotations'])
+
+        # Removed deployments are no longer written to
+        deployments.pop(1)
+        c.operator_images = [self.operatorImage1]
+        updated = c.get_updated_csv()
+        self.assertEqual(len(updated['spec']['install']['spec']['deployments']), 1)
+        self.assertEqual(c._deployment_index, {'extraDeployment': [0]})
+
+    def _scanner_csv(self):
+        csv = copy.deepcopy(DUMMY_CSV)
+        deployments = csv['spec']['install']['spec']['deployments']
+        second = copy.deepcopy(deployments[0])
+        second['name'] = 'secondDeployment'
+        second['spec']['template']['metadata']['annotations'] = {
+            'olm.relatedImage.dummyRelatedImages9': 'quay.io/org/nine:1.0',
+            'olm.tag.relatedImage.dummyRelatedImages1': 'quay.io/org/one:tagged',
+            'olm.tag.relatedImage.dummyRelatedImages8': 'quay.io/org/eight:tagged',
+        }
+        second['spec']['template']['spec']['containers'][0]['env'] = [
+            {'name': 'RELATED_IMAGE_FOO', 'value': 'quay.io/org/foo:1.0'},
+            {'name': 'WATCH_NAMESPACE', 'value': ''},
+            {'name': 'RELATED_IMAGE_BAR', 'valueFrom': {'configMapKeyRef': {'name': 'images', 'key': 'bar'}}},
+        ]
+        deployments.append(second)
+        return csv
+
+    def test_scan_deployments(self):
+        csv = self._scanner_csv()
+        c = ClusterServiceVersion(csv)
+
+        as_tuples = lambda images: [(i.name, i.image, i.deployment, i.container) for i in images]
+        self.assertEqual(as_tuples(c.get_operator_images()), [
+            (None, self.operatorImage1.image, 'deploymentsDummyName', self.operatorImage1.container),
+            (None, self.operatorImage1.image, 'secondDeployment', self.operatorImage1.container),
+        ])
+        self.assertEqual([i.name for i in c.get_annotation_related_images()], [
+            'dummyRelatedImages1', 'dummyRelatedImages2', 'dummyRelatedImages3', 'dummyRelatedImages8',
+            'dummyRelatedImages9', 'dummyRelatedImages1', 'dummyRelatedImages8'
+        ])
+        # Tagged images replace or add the olm.relatedImage annotation in every deployment
+        for d in c.get_updated_csv()['spec']['install']['spec']['deployments']:
+            annotations = d['spec']['template']['metadata']['annotations']
+            self.assertEqual(annotations['olm.relatedImage.dummyRelatedImages1'], 'quay.io/org/one:tagged')
+            self.assertEqual(annotations['olm.relatedImage.dummyRelatedImages8'], 'quay.io/org/eight:tagged')
+        self.assertIn(('dummyRelatedImages1', 'quay.io/org/one:tagged', 'deploymentsDummyName', None), as_tuples(c.get_annotation_related_images()))
+        self.assertIn(('dummyRelatedImages8', 'quay.io/org/eight:tagged', 'deploymentsDummyName', None), as_tuples(c.get_annotation_related_images()))
+
+        # Literal RELATED_IMAGE_* env vars are collected
+        self.assertEqual(as_tuples(c.get_env_related_images()), [('RELATED_IMAGE_FOO', 'quay.io/org/foo:1.0', 'secondDeployment', 'containerImageDummyName1')])
+
+    def test_empty_env_related_images(self):
+        # Empty RELATED_IMAGE_* values are not images and must not stop the CSV from loading
+        csv = self._scanner_csv()
+        env = csv['spec']['install']['spec']['deployments'][1]['spec']['template']['spec']['containers'][0]['env']
+        env.append({'name': 'RELATED_IMAGE_EMPTY', 'value': ''})
+        env.append({'name': 'RELATED_IMAGE_NULL', 'value': None})
+        c = ClusterServiceVersion(csv)
+        self.assertEqual([i.name for i in c.get_env_related_images()], ['RELATED_IMAGE_FOO'])
+        self.assertEqual(c.get_updated_csv()['spec']['install']['spec']['deployments'][1]['spec']['template']['spec']['containers'][0]['env'], env)
+
+    def test_empty_annotation_related_image(self):
+        csv = self._scanner_csv()
+        csv['spec']['install']['spec']['deployments'][1]['spec']['template']['metadata']['annotations']['olm.relatedImage.empty'] = ''
+        c = ClusterServiceVersion(csv)
+        self.assertNotIn('empty', [i.name for i in c.get_annotation_related_images()])
+        self.assertIn('dummyRelatedImages9', [i.name for i in c.get_annotation_related_images()])
+        annotations = c.get_updated_csv()['spec']['install']['spec']['deployments'][1]['spec']['template']['metadata']['annotations']
+        self.assertEqual(annotations['olm.relatedImage.empty'], '')
+
+    def test_env_related_images_write_back(self):
+        csv = self._scanner_csv()
+        ORIGINAL = copy.deepcopy(csv)
+        c = ClusterServiceVersion(csv)
+        c.get_env_related_images()[0].set_digest('sha256:{}'.format(relatedImageSHA4))
+        env = c.get_updated_csv()['spec']['install']['spec']['deployments'][1]['spec']['template']['spec']['containers'][0]['env']
+        self.assertEqual(env[0], {'name': 'RELATED_IMAGE_FOO', 'value': 'quay.io/org/foo@sha256:{}'.format(relatedImageSHA4)})
+        self.assertEqual(env[1:], ORIGINAL['spec']['install']['spec']['deployments'][1]['spec']['template']['spec']['containers'][0]['env'][1:])
+        self.assertEqual(c.original_csv, ORIGINAL)
+
+    def _fake_resolve_digest(self, calls):
+        def fake(image, manifest_list, cache, quay_tag_index):
+            calls.append((image.get_image(), manifest_list))
+            name = image.get_image_name()
+            if name == 'eight':
+                return DigestResult(image, error=ManifestNotFound(name), manifest_list=manifest_list, elapsed=0.5)
+            if name == 'foo' and manifest_list:
+                return DigestResult(image, error=ManifestListNotFound(name), manifest_list=manifest_list, elapsed=0.25)
+            return DigestResult(image, digest='sha256:{}-{}'.format(name, 'list' if manifest_list else 'image'), manifest_list=manifest_list, elapsed=0.5)
+        return fake
+
+    def test_pin_digests(self):
+        c = ClusterServiceVersion(self._scanner_csv())
+        calls = []
+        with patch.object(imagerepo, '_resolve_digest', side_effect=self._fake_resolve_digest(calls)):
+            report = c.pin_digests(max_workers=2, policy=PIN_PREFER_MANIFEST_LIST)
+
+        # Each tagged image is resolved once however often it is used, images with a digest are left alone
+        self.assertEqual(sorted(i for i, manifest_list in calls if manifest_list), ['quay.io/org/eight:tagged', 'quay.io/org/foo:1.0', 'quay.io/org/nine:1.0', 'quay.io/org/one:tagged'])
+        self.assertEqual(sorted(i for i, manifest_list in calls if not manifest_list), ['quay.io/org/foo:1.0'])
+        self.assertEqual(len(report.skipped), 3)
+        self.assertEqual(report.digests, {
+            'quay.io/org/one:tagged': 'sha256:one-list',
+            'quay.io/org/nine:1.0': 'sha256:nine-list',
+            'quay.io/org/foo:1.0': 'sha256:foo-image',
+        })
+        self.assertEqual(list(report.failures), ['quay.io/org/eight:tagged'])
+        self.assertFalse(report.ok())
+        self.assertEqual(report.latencies['quay.io/org/foo:1.0'], 0.75)
+        self.assertEqual(report.updated, 4)
+
+        # Applied to every usage, and spec.relatedImages follows the annotations
+        related = [(i.name, i.image) for i in c.get_annotation_related_images()]
+        self.assertEqual(related.count(('dummyRelatedImages1', 'quay.io/org/one@sha256:one-list')), 2)
+        self.assertIn(('dummyRelatedImages8', 'quay.io/org/eight:tagged'), related)
+        self.assertEqual(c.get_env_related_images()[0].image, 'quay.io/org/foo@sha256:foo-image')
+        self.assertIn({'name': 'dummyRelatedImages9', 'image': 'quay.io/org/nine@sha256:nine-list'}, c.get_updated_csv()['spec']['relatedImages'])
+
+    def test_pin_digests_unknown_policy(self):
+        c = ClusterServiceVersion(self._scanner_csv())
+        with self.assertRaises(ValueError):
+            c.pin_digests(policy='tag')
+
+    def _alm_examples_block(self, formatted):
+        lines = formatted.splitlines()
+        start = next(i for i, l in enumerate(lines) if l.strip().startswith('alm-examples:'))
+        indent = len(lines[start]) - len(lines[start].lstrip())
+        end = next(i for i in range(start + 1, len(lines)) if lines[i].strip() and len(lines[i]) - len(lines[i].lstrip()) <= indent)
+        return lines[start:end]
+
+    def test_from_path_write_to(self):
+        path = THIS_DIR + '/test_files/valid_csv.yaml'
+        with open(path, 'r') as stream:
+            csv_sample = yaml.safe_load(stream)
+        with open(THIS_DIR + '/test_files/valid_csv_formatted.yaml', 'r') as stream:
+            csv_sample_formatted = yaml.safe_load(stream)
+
+        c = ClusterServiceVersion.from_path(path, target_version='9.9.9')
+        self.assertEqual(c.original_csv, csv_sample)
+        self.assertEqual(c.version, '9.9.9')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'csv.yaml')
+            ClusterServiceVersion.from_path(path).write_to(out)
+            with open(out, 'r') as stream:
+                written = stream.read()
+        self.assertEqual(yaml.safe_load(written), csv_sample_formatted)
+        formatted = ClusterServiceVersion(csv_sample).get_formatted_csv()
+        self.assertEqual(self._alm_examples_block(written), self._alm_examples_block(formatted))
+        self.assertTrue(self._alm_examples_block(written)[0].endswith('alm-examples: |-'))
+
+    def test_write_to_patch(self):
+        path = THIS_DIR + '/test_files/valid_csv.yaml'
+        with open(path, 'r') as stream:
+            source = stream.read()
+
+        c = ClusterServiceVersion.from_path(path, patchable=True, target_version='2.1.2', skiprange='<2.1.2')
+        c.operator_images[0].set_digest('sha256:' + newContainerImageSHA1)
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'csv.yaml')
+            self.assertTrue(c.write_to(out, patch=True))
+            with open(out, 'r') as stream:
+                written = stream.read()
+        self.assertEqual(yaml.safe_load(written), c.get_updated_csv())
+        changed = [(a, b) for a, b in zip(source.splitlines(), written.splitlines()) if a != b]
+        self.assertEqual(len(source.splitlines()), len(written.splitlines()))
+        self.assertEqual(len(changed), 4)
+        self.assertIn(newContainerImageSHA1, changed[2][1])
+        self.assertEqual(c.get_patched_csv(), written)
+
+        # Adding list items falls back to a full dump
+        c.add_image_pullsecret('my-secret')
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'csv.yaml')
+            self.assertFalse(c.write_to(out, patch=True))
+            with open(out, 'r') as stream:
+                self.assertEqual(yaml.safe_load(stream), yaml.safe_load(c.get_formatted_csv()))
+
+        # Not loaded with patchable=True
+        self.assertEqual(ClusterServiceVersion.from_path(path).get_patched_csv(), ClusterServiceVersion.from_path(path).get_formatted_csv())
+
+    def test_literal_block_dumpers(self):
+        with open(THIS_DIR + '/test_files/valid_csv.yaml', 'r') as stream:
+            csv_sample = yaml.safe_load(stream)
+        c = ClusterServiceVersion(csv_sample)
+        data = c._get_formatted_data()
+        self.assertIs(c._get_dumper(data), _CSVDumper)
+        self.assertEqual(
+            self._alm_examples_block(yaml.dump(data, Dumper=_CSVDumper, default_flow_style=False)),
+            self._alm_examples_block(yaml.dump(data, Dumper=_PyCSVDumper, default_flow_style=False)))
+
+        # Trailing spaces rule out a literal block, fall back to the pure python emitter
+        csv_sample['metadata']['annotations']['alm-examples'] = '[ \n  {}\n]'
+        c = ClusterServiceVersion(csv_sample)
+        self.assertIs(c._get_dumper(c._get_formatted_data()), _PyCSVDumper)
+
+        # The representer is registered on the private dumpers only
+        self.assertNotIn(_literal, yaml.SafeDumper.yaml_representers)
+
     def test__setup_basic_logger(self):
         # should not be tested because it only sets up logger
         self.assertEqual(True, True)
@@ -0,0 +1,118 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+from ..digestcache import DigestCache
+from ..imagerepo import ImageRepo, QuayRepo, ManifestNotFound, resolve_digests
+from ..images import Image
+
+QUAY_IMAGE_WITH_TAG = 'quay.io/hybridappio/ham-application-assembler:dummy_tag'
+QUAY_IMAGE_WITH_OTHER_TAG = 'quay.io/hybridappio/ham-application-assembler:other_tag'
+
+
+class TestDigestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache', 'digests.sqlite')
+        self.cache = DigestCache(self.path, ttl=60, max_entries=5)
+        self.image = Image(None, QUAY_IMAGE_WITH_TAG)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(self.image, DigestCache.IMAGE))
+        self.cache.put(self.image, DigestCache.IMAGE, 'sha256:image')
+        self.cache.put(self.image, DigestCache.MANIFEST_LIST, 'sha256:list')
+
+        # Lookup type is part of the key
+        self.assertEqual(self.cache.get(self.image, DigestCache.IMAGE), 'sha256:image')
+        self.assertEqual(self.cache.get(self.image, DigestCache.MANIFEST_LIST), 'sha256:list')
+        self.assertIsNone(self.cache.get(Image(None, QUAY_IMAGE_WITH_OTHER_TAG), DigestCache.IMAGE))
+
+        # Persisted for other instances using the same file
+        self.assertEqual(DigestCache(self.path).get(Image(None, QUAY_IMAGE_WITH_TAG), DigestCache.IMAGE), 'sha256:image')
+
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 2, 'expired': 0, 'evicted': 0, 'hit_rate': 0.5})
+
+    def test_canonical_key(self):
+        self.cache.put(Image(None, 'nginx'), DigestCache.IMAGE, 'sha256:nginx')
+        self.assertEqual(self.cache.get(Image(None, 'docker.io/library/nginx:latest'), DigestCache.IMAGE), 'sha256:nginx')
+        # The digest of a pinned reference doesn't change the tag lookup it came from
+        self.cache.put(self.image, DigestCache.IMAGE, 'sha256:image')
+        self.assertEqual(self.cache.get(Image(None, QUAY_IMAGE_WITH_TAG + '@sha256:image'), DigestCache.IMAGE), 'sha256:image')
+
+    def test_ttl(self):
+        self.cache.put(self.image, DigestCache.IMAGE, 'sha256:image')
+        with patch('operator_csv_libs.digestcache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(self.cache.get(self.image, DigestCache.IMAGE))
+            self.assertEqual(self.cache.purge_expired(), 1)
+        self.assertEqual(self.cache.stats()['expired'], 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_eviction(self):
+        for i in range(8):
+            self.cache.put(Image(None, 'quay.io/org/image:{}'.format(i)), DigestCache.IMAGE, 'sha256:{}'.format(i))
+        # Evicted in batches, down to 90% of max_entries whenever it is exceeded
+        self.assertEqual(len(self.cache), 4)
+        self.assertEqual(self.cache.stats()['evicted'], 4)
+        # Oldest entries are evicted first
+        self.assertIsNone(self.cache.get(Image(None, 'quay.io/org/image:0'), DigestCache.IMAGE))
+        self.assertEqual(self.cache.get(Image(None, 'quay.io/org/image:7'), DigestCache.IMAGE), 'sha256:7')
+
+    def test_eviction_counts_shared_file(self):
+        # Entries written through another instance count towards max_entries, and replacing an entry doesn't add one
+        other = DigestCache(self.path, ttl=60, max_entries=5)
+        for i in range(4):
+            other.put(Image(None, 'quay.io/org/other:{}'.format(i)), DigestCache.IMAGE, 'sha256:{}'.format(i))
+        for _ in range(3):
+            self.cache.put(self.image, DigestCache.IMAGE, 'sha256:image')
+        self.assertEqual(len(self.cache), 5)
+        self.assertEqual(self.cache.stats()['evicted'], 0)
+
+        self.cache.put(Image(None, QUAY_IMAGE_WITH_OTHER_TAG), DigestCache.IMAGE, 'sha256:other')
+        self.cache.put(Image(None, 'quay.io/org/image:1'), DigestCache.IMAGE, 'sha256:1')
+        self.assertLessEqual(len(self.cache), 5)
+        self.assertEqual(self.cache.get(Image(None, 'quay.io/org/image:1'), DigestCache.IMAGE), 'sha256:1')
+
+    def test_concurrent_writers(self):
+        # Separate instances stand in for separate processes sharing the cache file
+        errors = []
+        def writer(n):
+            try:
+                cache = DigestCache(self.path, max_entries=1000)
+                for i in range(25):
+                    cache.put(Image(None, 'quay.io/org/image{}:{}'.format(n, i)), DigestCache.IMAGE, 'sha256:{}'.format(i))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(DigestCache(self.path, max_entries=1000)), 200)
+
+    def test_image_repo(self):
+        with patch.object(QuayRepo, 'get_image_digest', return_value='sha256:image') as mock_lookup:
+            for _ in range(3):
+                self.assertEqual(ImageRepo(Image(None, QUAY_IMAGE_WITH_TAG), cache=self.cache).get_image_digest(), 'sha256:image')
+            self.assertEqual(mock_lookup.call_count, 1)
+
+        # Failures are not cached
+        with patch.object(QuayRepo, 'get_manifest_list_digest', side_effect=ManifestNotFound('missing')) as mock_lookup:
+            for _ in range(2):
+                with self.assertRaises(ManifestNotFound):
+                    ImageRepo(Image(None, QUAY_IMAGE_WITH_TAG), cache=self.cache).get_manifest_list_digest()
+            self.assertEqual(mock_lookup.call_count, 2)
+
+    def test_resolve_digests(self):
+        images = [Image(None, QUAY_IMAGE_WITH_TAG), Image(None, QUAY_IMAGE_WITH_OTHER_TAG)]
+        with patch.object(QuayRepo, 'get_image_digest', return_value='sha256:image') as mock_lookup:
+            list(resolve_digests(images, cache=self.cache))
+            results = list(resolve_digests(images, cache=self.cache))
+            self.assertEqual(mock_lookup.call_count, 2)
+        self.assertTrue(all(r.digest == 'sha256:image' for r in results))
+        self.assertEqual(self.cache.stats()['hits'], 2)
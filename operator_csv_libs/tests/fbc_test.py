@@ -0,0 +1,80 @@
+import unittest
+import io
+import os
+import json
+import yaml
+from ..fbc import FBCWriter, write_catalog
+from ..csv import ClusterServiceVersion
+from ..package import Package
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PACKAGE = 'ibm-management-orchestrator'
+NAME = PACKAGE + '.v{}'
+
+
+def read_json_documents(text):
+    decoder, documents, position = json.JSONDecoder(), [], 0
+    while position < len(text):
+        document, position = decoder.raw_decode(text, position)
+        documents.append(document)
+        position += 1
+    return documents
+
+
+class TestFBCWriter(unittest.TestCase):
+    def setUp(self):
+        with open(THIS_DIR + '/test_files/valid_csv.yaml', 'r') as stream:
+            self.csv_sample = yaml.safe_load(stream)
+        self.package = Package(operator=PACKAGE, default_channel='stable')
+        self.package.create_channel('stable', NAME.format('2.1.2'))
+        self.package.create_channel('fast', NAME.format('2.1.1'))
+
+    def get_csvs(self):
+        # A generator, the way a large catalog would be streamed
+        yield ClusterServiceVersion(self.csv_sample)
+        yield ClusterServiceVersion(self.csv_sample, target_version='2.1.2', replaces=NAME.format('2.1.1'), skiprange='<2.1.2')
+
+    def write(self, format=FBCWriter.JSON):
+        stream = io.StringIO()
+        count = write_catalog(stream, self.package, self.get_csvs(), lambda csv: 'quay.io/org/bundle:' + csv.get_version(), format=format)
+        self.assertEqual(count, 5)
+        return stream.getvalue()
+
+    def test_catalog(self):
+        documents = read_json_documents(self.write())
+        self.assertEqual([d['schema'] for d in documents], ['olm.package', 'olm.bundle', 'olm.bundle', 'olm.channel', 'olm.channel'])
+        self.assertEqual(documents[0], {'schema': 'olm.package', 'name': PACKAGE, 'defaultChannel': 'stable'})
+
+        bundle = documents[2]
+        self.assertEqual(bundle['name'], NAME.format('2.1.2'))
+        self.assertEqual(bundle['image'], 'quay.io/org/bundle:2.1.2')
+        properties = {p['type']: p['value'] for p in bundle['properties']}
+        self.assertEqual(properties['olm.package'], {'packageName': PACKAGE, 'version': '2.1.2'})
+        self.assertEqual(properties['olm.gvk'], {'group': 'orchestrator.management.ibm.com', 'kind': 'Installation', 'version': 'v1alpha1'})
+        self.assertEqual(properties['olm.csv.metadata']['annotations']['olm.skipRange'], '<2.1.2')
+        self.assertIn({'image': 'quay.io/org/bundle:2.1.2'}, bundle['relatedImages'])
+
+        fast, stable = documents[3], documents[4]
+        first = {'name': NAME.format('2.1.1'), 'skipRange': '<2.1.1-202009111050'}
+        self.assertEqual(fast['entries'], [first])
+        self.assertEqual(stable['entries'], [
+            first,
+            {'name': NAME.format('2.1.2'), 'replaces': NAME.format('2.1.1'), 'skipRange': '<2.1.2'}
+        ])
+
+    def test_deterministic(self):
+        self.assertEqual(self.write(), self.write())
+        self.assertEqual(self.write(FBCWriter.YAML), self.write(FBCWriter.YAML))
+
+    def test_yaml(self):
+        documents = list(yaml.safe_load_all(self.write(FBCWriter.YAML)))
+        self.assertEqual(documents, read_json_documents(self.write()))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            FBCWriter(io.StringIO(), format='xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
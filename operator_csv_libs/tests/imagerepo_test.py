@@ -1,9 +1,15 @@
 import unittest
 import os
+import json
+import time
+from datetime import datetime, timezone, timedelta
 import httpretty
 from unittest.mock import patch
-from ..imagerepo import ImageRepo, ArtifactoryRepo, QuayRepo, DockerRepo, ManifestNotFound
+from ..imagerepo import ImageRepo, ArtifactoryRepo, QuayRepo, DockerRepo, ManifestNotFound, ManifestListNotFound, MissingCredentials, RepoTypeNotImplemented, DigestResult, resolve_digests, DockerTokenCache, ManifestDescriptor, QuayTagIndex
 from ..images import Image
+from .. import imagerepo
+from ..scheduler import RequestScheduler, get_scheduler, set_scheduler
+import threading
 
 IMG_NAME = 'dummyImageName'
 IMAGE_WITH_DIGEST = 'hyc-cp4mcm-team-docker-local.artifactory.swg-devops.com/cicd/cp4mcm/cp4mcm-orchestrator-catalog@sha256:dummy_sha'
@@ -220,6 +226,16 @@ class TestDockerRepo(unittest.TestCase):
             adding_headers={"Docker-Content-Digest": "sha256:dummy_sha"}
         )
 
+        # Digests are resolved with a single HEAD request
+        for tag, content_type in [('with_manifest_list', 'manifest.list'), ('with_manifest', 'manifest')]:
+            httpretty.register_uri(
+                method=httpretty.HEAD,
+                uri=digest_media_type_path.format(org='ibmcom', repo='ibm-operator-catalog', tag=tag),
+                body='"sha256:dummy_raw_sha"',
+                content_type=content_type,
+                adding_headers={"Docker-Content-Digest": "sha256:dummy_sha"}
+            )
+
         # Set up docker images
         self.dockerImgWithManifestList = Image(IMG_NAME, DOCKER_IMAGE_WITH_MANIFEST_LIST, DEPLOYMENT, CONTAINER)
         self.dockerImgWithManifest = Image(IMG_NAME, DOCKER_IMAGE_WITH_MANIFEST, DEPLOYMENT, CONTAINER)
@@ -244,3 +260,385 @@ class TestDockerRepo(unittest.TestCase):
 
     def tearDown(self):
         httpretty.disable()
+
+
+class TestResolveDigests(unittest.TestCase):
+    def setUp(self):
+        self.images = [
+            Image(IMG_NAME, 'quay.io/hybridappio/image{}:dummy_tag'.format(i), DEPLOYMENT, CONTAINER) for i in range(20)
+        ]
+
+    def _fake_digest(self, manifest_list):
+        def fake(repo):
+            name = repo.image.get_image_name()
+            if name == 'image3':
+                raise ManifestNotFound('missing {}'.format(name))
+            if name == 'image7':
+                raise ManifestListNotFound('missing {}'.format(name))
+            return 'sha256:{}-{}'.format(name, 'list' if manifest_list else 'image')
+        return fake
+
+    def test_resolve_image_digests(self):
+        with patch.object(QuayRepo, 'get_image_digest', autospec=True, side_effect=self._fake_digest(False)):
+            results = list(resolve_digests(self.images, max_workers=4))
+
+        # Every image yields exactly one result
+        self.assertEqual(len(results), 20)
+        self.assertEqual(set(r.image for r in results), set(self.images))
+        for r in results:
+            self.assertIsInstance(r, DigestResult)
+            self.assertFalse(r.manifest_list)
+            self.assertIsNotNone(r.elapsed)
+
+        failed = {r.image.get_image_name(): r for r in results if not r.ok()}
+        self.assertEqual(sorted(failed), ['image3', 'image7'])
+        self.assertIsInstance(failed['image3'].error, ManifestNotFound)
+        self.assertIsInstance(failed['image7'].error, ManifestListNotFound)
+        for r in results:
+            if r.ok():
+                self.assertEqual(r.digest, 'sha256:{}-image'.format(r.image.get_image_name()))
+
+    def test_resolve_manifest_list_digests(self):
+        with patch.object(QuayRepo, 'get_manifest_list_digest', autospec=True, side_effect=self._fake_digest(True)):
+            results = list(resolve_digests(iter(self.images), manifest_list=True, max_workers=2))
+
+        self.assertEqual(len(results), 20)
+        for r in results:
+            self.assertTrue(r.manifest_list)
+            if r.ok():
+                self.assertEqual(r.digest, 'sha256:{}-list'.format(r.image.get_image_name()))
+
+    def test_unknown_repo_type(self):
+        # Routing failures are reported per image as well
+        unknown = Image(IMG_NAME, 'registry.example.com/org/image:tag', DEPLOYMENT, CONTAINER)
+        results = list(resolve_digests([unknown]))
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0].error, RepoTypeNotImplemented)
+
+    def test_invalid_max_workers(self):
+        with self.assertRaises(ValueError):
+            list(resolve_digests(self.images, max_workers=0))
+
+    def _run_slow_registry(self, images, host_limits, max_workers, barrier):
+        # Every lookup waits until `barrier` lookups are in flight together, then takes a little longer
+        lock = threading.Lock()
+        active, peak = [0], [0]
+        def slow(image, manifest_list, cache, quay_tag_index):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            try:
+                barrier.wait()
+                time.sleep(0.01)
+                return DigestResult(image, digest='sha256:' + image.get_image_name(), elapsed=0.01)
+            except threading.BrokenBarrierError as e:
+                return DigestResult(image, error=e, elapsed=0.01)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        previous = get_scheduler()
+        set_scheduler(RequestScheduler(concurrency=8, host_limits=host_limits))
+        try:
+            with patch.object(imagerepo, '_resolve_digest', side_effect=slow):
+                results = list(resolve_digests(images, max_workers=max_workers))
+        finally:
+            set_scheduler(previous)
+        return results, peak[0]
+
+    def test_dispatch_keeps_workers_busy(self):
+        # The barrier only opens with 4 lookups in flight, so it breaks if fewer are handed out after completions
+        images = [Image(IMG_NAME, 'quay.io/org/image{}:1.0'.format(i)) for i in range(40)]
+        results, peak = self._run_slow_registry(images, {'quay.io': {'concurrency': 4}}, 16, threading.Barrier(4, timeout=5))
+        self.assertEqual(len(results), 40)
+        self.assertTrue(all(r.ok() for r in results), [r.error for r in results if not r.ok()][:1])
+        self.assertEqual(peak, 4)
+
+    def test_dispatch_docker_hub_limit(self):
+        # Limits are configured by the host DockerRepo calls, not the docker.io image registry
+        images = [Image(IMG_NAME, 'docker.io/org/image{}:1.0'.format(i)) for i in range(12)]
+        results, peak = self._run_slow_registry(images, {'registry-1.docker.io': {'concurrency': 2}}, 8, threading.Barrier(2, timeout=5))
+        self.assertTrue(all(r.ok() for r in results))
+        self.assertEqual(peak, 2)
+
+
+class TestDockerTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = DockerTokenCache(refresh_margin=10)
+        self.scope = 'repository:ibmcom/ibm-operator-catalog:pull'
+
+    def _issued_at(self, delta):
+        return (datetime.now(timezone.utc) + delta).strftime('%Y-%m-%dT%H:%M:%S.123456789Z')
+
+    def test_get_token_fetches_once(self):
+        calls = []
+        def fetch():
+            calls.append(1)
+            return {'token': 'dummy_token', 'expires_in': 300, 'issued_at': self._issued_at(timedelta(0))}
+
+        for _ in range(5):
+            self.assertEqual(self.cache.get_token(self.scope, fetch), 'dummy_token')
+        self.assertEqual(len(calls), 1)
+
+        # Different scopes get their own token
+        self.cache.get_token('repository:ibmcom/other:pull', fetch)
+        self.assertEqual(len(calls), 2)
+
+    def test_refresh_before_expiry(self):
+        # Token expiring within the refresh margin is not served from the cache
+        self.cache.put(self.scope, {'token': 'short_token', 'expires_in': 5})
+        self.assertIsNone(self.cache.get(self.scope))
+
+        # Token issued long ago is expired even though expires_in alone would say otherwise
+        self.cache.put(self.scope, {'token': 'old_token', 'expires_in': 300, 'issued_at': self._issued_at(timedelta(hours=-1))})
+        self.assertIsNone(self.cache.get(self.scope))
+
+        self.cache.put(self.scope, {'token': 'fresh_token', 'expires_in': 300, 'issued_at': self._issued_at(timedelta(0))})
+        self.assertEqual(self.cache.get(self.scope), 'fresh_token')
+
+    def test_default_expiry(self):
+        # access_token is accepted and tokens without expires_in are valid for 60 seconds
+        self.cache.put(self.scope, {'access_token': 'dummy_token'})
+        self.assertEqual(self.cache.get(self.scope), 'dummy_token')
+        with patch('operator_csv_libs.imagerepo.time.monotonic', return_value=time.monotonic() + 55):
+            self.assertIsNone(self.cache.get(self.scope))
+
+    def test_clear(self):
+        self.cache.put(self.scope, {'token': 'dummy_token', 'expires_in': 300})
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(self.scope))
+
+    def test_docker_repo_shares_tokens(self):
+        httpretty.enable()
+        httpretty.reset()
+        try:
+            httpretty.register_uri(
+                method=httpretty.GET,
+                uri=token_path.format(org='ibmcom', repo='ibm-operator-catalog'),
+                body='{ "token": "dummy_token", "expires_in": 300 }'
+            )
+            httpretty.register_uri(
+                method=httpretty.HEAD,
+                uri=digest_media_type_path.format(org='ibmcom', repo='ibm-operator-catalog', tag='with_manifest_list'),
+                body='{}',
+                content_type='manifest.list',
+                adding_headers={"Docker-Content-Digest": "sha256:dummy_sha"}
+            )
+            with patch.object(DockerRepo, '_token_cache', DockerTokenCache()):
+                for _ in range(10):
+                    repo = DockerRepo(Image(IMG_NAME, DOCKER_IMAGE_WITH_MANIFEST_LIST, DEPLOYMENT, CONTAINER))
+                    self.assertEqual(repo.get_manifest_list_digest(), 'sha256:dummy_sha')
+            token_requests = [r for r in httpretty.latest_requests() if r.headers.get('Host') == 'auth.docker.io']
+            self.assertEqual(len(token_requests), 1)
+        finally:
+            httpretty.disable()
+
+
+class TestDockerRepoResolveManifest(unittest.TestCase):
+    def setUp(self):
+        httpretty.enable()
+        httpretty.reset()
+        httpretty.register_uri(
+            method=httpretty.GET,
+            uri=token_path.format(org='ibmcom', repo='ibm-operator-catalog'),
+            body='{ "token": "dummy_token" }'
+        )
+        media_types = {
+            'oci_index': 'application/vnd.oci.image.index.v1+json',
+            'manifest_list': 'application/vnd.docker.distribution.manifest.list.v2+json',
+            'manifest': 'application/vnd.docker.distribution.manifest.v2+json'
+        }
+        for tag, media_type in media_types.items():
+            httpretty.register_uri(
+                method=httpretty.HEAD,
+                uri=digest_media_type_path.format(org='ibmcom', repo='ibm-operator-catalog', tag=tag),
+                body='x' * 1234,
+                content_type=media_type,
+                adding_headers={"Docker-Content-Digest": "sha256:{}".format(tag)}
+            )
+        httpretty.register_uri(
+            method=httpretty.HEAD,
+            uri=digest_media_type_path.format(org='ibmcom', repo='ibm-operator-catalog', tag='missing'),
+            status=404
+        )
+
+    def tearDown(self):
+        httpretty.disable()
+        httpretty.reset()
+
+    def _repo(self, tag):
+        return DockerRepo(Image(IMG_NAME, 'docker.io/ibmcom/ibm-operator-catalog:{}'.format(tag)))
+
+    def test_resolve_manifest(self):
+        m = self._repo('manifest').resolve_manifest()
+        self.assertIsInstance(m, ManifestDescriptor)
+        self.assertEqual(m.digest, 'sha256:manifest')
+        self.assertEqual(m.media_type, 'application/vnd.docker.distribution.manifest.v2+json')
+        self.assertEqual(m.size, 1234)
+        self.assertFalse(m.is_manifest_list())
+        self.assertTrue(self._repo('oci_index').resolve_manifest().is_manifest_list())
+        self.assertTrue(self._repo('manifest_list').resolve_manifest().is_manifest_list())
+
+        # Single HEAD request accepting every manifest type, no body downloaded
+        request = httpretty.last_request()
+        self.assertEqual(request.method, 'HEAD')
+        for media_type in DockerRepo.ACCEPTED_MEDIA_TYPES:
+            self.assertIn(media_type, request.headers['accept'])
+
+        with self.assertRaises(ManifestNotFound):
+            self._repo('missing').resolve_manifest()
+
+    def test_get_digest(self):
+        self.assertEqual(self._repo('oci_index').get_manifest_list_digest(), 'sha256:oci_index')
+        self.assertEqual(self._repo('manifest').get_image_digest(), 'sha256:manifest')
+        with self.assertRaises(ManifestListNotFound):
+            self._repo('manifest').get_manifest_list_digest()
+        with self.assertRaises(ManifestNotFound):
+            self._repo('manifest_list').get_image_digest()
+
+
+class TestQuayTagIndex(unittest.TestCase):
+    PAGES = 5
+    PER_PAGE = 3
+
+    def setUp(self):
+        httpretty.enable()
+        httpretty.reset()
+        self.pages_served = []
+
+        # Replay the quay tag api, PAGES pages of PER_PAGE tags each
+        def tags_callback(request, uri, response_headers):
+            page = int(request.querystring['page'][0])
+            self.pages_served.append(page)
+            tags = []
+            for i in range(self.PER_PAGE):
+                n = (page - 1) * self.PER_PAGE + i
+                tags.append({'name': 'tag{}'.format(n), 'manifest_digest': 'sha256:digest{}'.format(n), 'is_manifest_list': n % 2 == 0})
+            body = {'tags': tags, 'page': page, 'has_additional': page < self.PAGES}
+            return [200, response_headers, json.dumps(body)]
+
+        httpretty.register_uri(
+            method=httpretty.GET,
+            uri='https://quay.io/api/v1/repository/{}/tag/'.format(QUAY_REPO),
+            body=tags_callback
+        )
+        httpretty.register_uri(
+            method=httpretty.GET,
+            uri='https://quay.io/api/v1/repository/hybridappio/private/tag/',
+            status=403,
+            body='forbidden'
+        )
+        self.index = QuayTagIndex(page_limit=self.PER_PAGE)
+
+    def tearDown(self):
+        httpretty.disable()
+        httpretty.reset()
+
+    def _repo(self, tag):
+        return QuayRepo(Image(IMG_NAME, 'quay.io/{}:{}'.format(QUAY_REPO, tag)), tag_index=self.index)
+
+    def test_lazy_lookup(self):
+        # Only pages up to the requested tag are fetched
+        self.assertEqual(self._repo('tag4').get_manifest_list_digest(), 'sha256:digest4')
+        self.assertEqual(self.pages_served, [1, 2])
+
+        # Tags already seen are answered from memory
+        self.assertEqual(self._repo('tag1').get_image_digest(), 'sha256:digest1')
+        self.assertEqual(self.pages_served, [1, 2])
+        self.assertEqual(len(self.index.get_tags(QUAY_REPO)), 5)
+        self.assertEqual(self.index.get_tags(QUAY_REPO)['tag0'], ('sha256:digest0', True))
+
+        self.assertEqual(self._repo('tag13').get_image_digest(), 'sha256:digest13')
+        self.assertEqual(self.pages_served, [1, 2, 3, 4, 5])
+        self.assertEqual(self.index.pages_fetched, 5)
+
+    def test_errors(self):
+        # Same exceptions as the specificTag lookup
+        with self.assertRaises(ManifestNotFound):
+            self._repo('tag4').get_image_digest()
+        with self.assertRaises(ManifestListNotFound):
+            self._repo('tag3').get_manifest_list_digest()
+        with self.assertRaises(ManifestNotFound):
+            self._repo('unknown').get_image_digest()
+        self.assertEqual(self.pages_served, [1, 2, 3, 4, 5])
+        # Listing is exhausted, further misses are answered without api calls
+        with self.assertRaises(ManifestListNotFound):
+            self._repo('unknown2').get_manifest_list_digest()
+        self.assertEqual(self.pages_served, [1, 2, 3, 4, 5])
+
+        with self.assertRaises(MissingCredentials):
+            QuayRepo(Image(IMG_NAME, 'quay.io/hybridappio/private:tag'), tag_index=self.index).get_image_digest()
+
+    def test_resolve_digests(self):
+        images = [Image(IMG_NAME, 'quay.io/{}:tag{}'.format(QUAY_REPO, n)) for n in range(1, 15, 2)]
+        results = list(resolve_digests(images, max_workers=4, quay_tag_index=self.index))
+        self.assertTrue(all(r.ok() for r in results))
+        self.assertEqual(sorted(r.digest for r in results), sorted('sha256:digest{}'.format(n) for n in range(1, 15, 2)))
+        # One api call per page rather than one per image
+        self.assertEqual(sorted(self.pages_served), [1, 2, 3, 4, 5])
+
+
+class TestArtifactoryRepoGetDigests(unittest.TestCase):
+    BASE = 'https://na.artifactory.example.com/artifactory'
+
+    def setUp(self):
+        httpretty.enable()
+        httpretty.reset()
+        self.queries = []
+
+        # Stand in for AQL, knows the manifests of every image except image5
+        def aql_callback(request, uri, response_headers):
+            query = request.body.decode('utf-8')
+            self.queries.append(query)
+            criteria = json.loads(query[len('items.find('):query.index(').include(')])
+            results = []
+            for c in criteria['$or']:
+                item = {k: v for d in c['$and'] for k, v in d.items()}
+                if not item['path'].endswith('image5/release-2.0'):
+                    results.append(dict(item, sha256='aql_{}'.format(item['path'].split('/')[-2])))
+            return [200, response_headers, json.dumps({'results': results})]
+
+        httpretty.register_uri(method=httpretty.POST, uri=self.BASE + '/api/search/aql', body=aql_callback)
+        self.images = [Image(IMG_NAME, 'hyc-team-docker-local.artifactory.example.com/cicd/image{}:release-2.0'.format(i)) for i in range(7)]
+
+    def tearDown(self):
+        httpretty.disable()
+        httpretty.reset()
+
+    def _get_digests(self, **kwargs):
+        return ArtifactoryRepo.get_digests(self.images, artifactory_base=self.BASE, artifactory_user='user', artifactory_key='key', **kwargs)
+
+    @patch.object(ArtifactoryRepo, '_get_raw_image_digest')
+    def test_get_digests(self, mock_stat):
+        mock_stat.return_value = 'stat_image5'
+        results = self._get_digests(chunk_size=3)
+
+        # Results are returned in input order
+        self.assertEqual([r.image for r in results], self.images)
+        self.assertEqual([r.digest for r in results], ['sha256:aql_image{}'.format(i) if i != 5 else 'sha256:stat_image5' for i in range(7)])
+        # 7 images in chunks of 3, and a single stat for the path AQL did not return
+        self.assertEqual(len(self.queries), 3)
+        self.assertEqual(mock_stat.call_count, 1)
+        self.assertIn('{"repo": "hyc-team-docker-local"}, {"path": "cicd/image0/release-2.0"}, {"name": "manifest.json"}', self.queries[0])
+        self.assertEqual(httpretty.last_request().headers['Authorization'], 'Basic dXNlcjprZXk=')
+
+    @patch.object(ArtifactoryRepo, '_get_raw_manifest_list_digest')
+    def test_get_manifest_list_digests(self, mock_stat):
+        mock_stat.side_effect = ManifestListNotFound('missing')
+        results = self._get_digests(manifest_list=True)
+
+        self.assertEqual(len(self.queries), 1)
+        self.assertIn('list.manifest.json', self.queries[0])
+        # Failed fallbacks are returned per image
+        failed = [r for r in results if not r.ok()]
+        self.assertEqual([r.image for r in failed], [self.images[5]])
+        self.assertIsInstance(failed[0].error, ManifestListNotFound)
+        self.assertTrue(all(r.manifest_list for r in results))
+
+    @patch.object(ArtifactoryRepo, '_get_raw_image_digest')
+    def test_aql_unavailable(self, mock_stat):
+        httpretty.register_uri(method=httpretty.POST, uri=self.BASE + '/api/search/aql', status=403, body='forbidden')
+        mock_stat.return_value = 'stat'
+        results = self._get_digests()
+        self.assertEqual(mock_stat.call_count, 7)
+        self.assertTrue(all(r.digest == 'sha256:stat' for r in results))
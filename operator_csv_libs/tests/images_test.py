@@ -1,5 +1,5 @@
 import unittest
-from ..images import Image
+from ..images import Image, ImageSet
 
 IMG_NAME = "dummyImageName"
 IMAGE_WITH_DIGEST = "hyc-cp4mcm-team-docker-local.artifactory.swg-devops.com/cicd/cp4mcm/cp4mcm-orchestrator-catalog@sha256:dummy_sha"
@@ -187,5 +187,74 @@ class TestImages(unittest.TestCase):
         self.assertEqual(self.imgWithTag.image, self.imgWithTag.get_image())
         self.assertEqual(self.imgWithoutTag.image, self.imgWithoutTag.get_image())
 
+    def test_registry_port(self):
+        img = Image(IMG_NAME, "localhost:5000/cicd/cp4mcm-orchestrator-catalog")
+        self.assertEqual(img.image_repo, "localhost:5000/cicd")
+        self.assertEqual(img.image_name, "cp4mcm-orchestrator-catalog")
+        self.assertEqual(img.tag, "latest")
+
+        img.set_tag("release-2.0")
+        self.assertEqual(img.image, "localhost:5000/cicd/cp4mcm-orchestrator-catalog:release-2.0")
+        img.set_digest("sha256:dummy_sha")
+        self.assertEqual(img.image, "localhost:5000/cicd/cp4mcm-orchestrator-catalog@sha256:dummy_sha")
+
+    def test_tag_and_digest(self):
+        img = Image(IMG_NAME, "localhost:5000/cicd/catalog:release-2.0@sha256:dummy_sha")
+        self.assertEqual((img.image_name, img.tag, img.digest), ("catalog", "release-2.0", "sha256:dummy_sha"))
+
+        img.set_digest("sha256:new_dummy_sha")
+        self.assertEqual(img.image, "localhost:5000/cicd/catalog:release-2.0@sha256:new_dummy_sha")
+
+    def test_get_reference(self):
+        self.assertIs(Image(IMG_NAME, "nginx").get_reference(), Image(IMG_NAME, "docker.io/library/nginx:latest").get_reference())
+        self.assertEqual(self.imgWithTag.get_reference().get_tag_key(), IMAGE_WITH_TAG)
+
+    def test_equality(self):
+        self.assertEqual(Image("a", "nginx", "d1", "c1"), Image("b", "docker.io/library/nginx:latest", "d2", "c2"))
+        self.assertEqual(len({Image(None, "nginx"), Image(None, "docker.io/nginx:latest")}), 1)
+        self.assertNotEqual(self.imgWithTag, self.imgWithDigest)
+        self.assertNotEqual(self.imgWithTag, IMAGE_WITH_TAG)
+        with self.assertRaises(AttributeError):
+            self.imgWithTag.extra = True
+
+
+class TestImageSet(unittest.TestCase):
+    class Result:
+        def __init__(self, image, digest=None, error=None):
+            self.image, self.digest, self.error = image, digest, error
+
+        def ok(self):
+            return self.error is None
+
+    def test_dedupe(self):
+        images = ImageSet([
+            Image("operator", IMAGE_WITH_TAG, DEPLOYMENT, "manager"),
+            Image("operand", IMAGE_WITH_TAG, DEPLOYMENT, "operand"),
+            Image("nginx", "nginx"),
+            Image("proxy", "docker.io/library/nginx:latest"),
+        ])
+        self.assertEqual(len(images), 2)
+        self.assertEqual(images.get_usage_count(), 4)
+        self.assertEqual([i.name for i in images], ["operator", "nginx"])
+        self.assertEqual([i.container for i in images.get_usages(IMAGE_WITH_TAG)], ["manager", "operand"])
+        self.assertIn("nginx:latest", images)
+        self.assertNotIn(IMAGE_WITH_DIGEST, images)
+
+        self.assertFalse(images.add(Image("again", "nginx")))
+        self.assertTrue(images.add(Image(None, IMAGE_WITH_DIGEST)))
+
+    def test_apply_digests(self):
+        usages = [Image("a", IMAGE_WITH_TAG), Image("b", IMAGE_WITH_TAG), Image("c", "nginx"), Image("d", "nginx")]
+        images = ImageSet(usages)
+        results = [self.Result(image, digest="sha256:dummy_sha") if image.name == "a" else self.Result(image, error=Exception())
+                   for image in images]
+
+        self.assertEqual(images.apply_digests(results), 2)
+        self.assertEqual([i.image for i in usages[:2]], [IMAGE_WITH_DIGEST] * 2)
+        self.assertEqual([i.image for i in usages[2:]], ["nginx"] * 2)
+        # Now found under the pinned reference
+        self.assertEqual(len(images.get_usages(IMAGE_WITH_DIGEST)), 2)
+        self.assertEqual(images.get_usages(IMAGE_WITH_TAG), [])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
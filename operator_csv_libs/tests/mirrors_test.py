@@ -0,0 +1,88 @@
+import unittest
+import os
+import yaml
+from ..mirrors import MirrorMap, MirrorReport
+from ..csv import ClusterServiceVersion
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OPERATOR_IMAGE = 'quay.io/cp4mcm/ibm-management-orchestrator@sha256:9c1840496d49b95a1d02a44cc0269f6a4a0bcec2711eda9812da9dd8b0fa6990'
+RELATED_IMAGE = 'cp.icr.io/cp/cp4mcm/cp4mcm-operator-catalog@sha256:b2aeba0e620b4325bda303af3024e7dafc809dd637ca99c50788a3d6a0e6234f'
+MIRROR = 'mirror.example.com:5000'
+
+ICSP = {
+    'apiVersion': 'operator.openshift.io/v1alpha1',
+    'kind': 'ImageContentSourcePolicy',
+    'spec': {'repositoryDigestMirrors': [
+        {'source': 'quay.io/cp4mcm', 'mirrors': [MIRROR + '/cp4mcm', 'other.example.com/cp4mcm']},
+        {'source': 'cp.icr.io/cp', 'mirrors': [MIRROR + '/cp']},
+        {'source': 'cp.icr.io/cp', 'mirrors': ['ignored.example.com/cp']},
+        {'source': 'registry.example.com/none', 'mirrors': []},
+    ]}
+}
+
+
+class TestMirrorMap(unittest.TestCase):
+    def setUp(self):
+        self.mirrors = MirrorMap({
+            'quay.io/org': MIRROR + '/org',
+            'quay.io/org/special': MIRROR + '/special',
+            'docker.io/library': MIRROR + '/hub',
+            'localhost:5000': MIRROR + '/local/',
+        })
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.mirrors.rewrite('quay.io/org/img:1.0'), MIRROR + '/org/img:1.0')
+        self.assertEqual(self.mirrors.rewrite('quay.io/org/sub/img@sha256:abc'), MIRROR + '/org/sub/img@sha256:abc')
+        self.assertEqual(self.mirrors.rewrite('quay.io/org/special/img:1.0@sha256:abc'), MIRROR + '/special/img:1.0@sha256:abc')
+        self.assertEqual(self.mirrors.match('quay.io/org/special/img'), ('quay.io/org/special', MIRROR + '/special'))
+        # A whole repository can be a source too
+        self.assertEqual(self.mirrors.rewrite('quay.io/org/special'), MIRROR + '/special')
+
+    def test_component_boundaries(self):
+        self.assertIsNone(self.mirrors.rewrite('quay.io/organisation/img:1.0'))
+        self.assertIsNone(self.mirrors.rewrite('quay.io/img:1.0'))
+        self.assertIsNone(self.mirrors.match('docker.io/org/img'))
+
+    def test_canonical_matching(self):
+        # Tag and digest are kept as written, an implicit latest stays implicit
+        self.assertEqual(self.mirrors.rewrite('nginx'), MIRROR + '/hub/nginx')
+        self.assertEqual(self.mirrors.rewrite('docker.io/nginx:1.25'), MIRROR + '/hub/nginx:1.25')
+        self.assertEqual(self.mirrors.rewrite('localhost:5000/ns/img:2'), MIRROR + '/local/ns/img:2')
+
+    def test_add_replaces_rule(self):
+        self.assertEqual(self.mirrors.rewrite('quay.io/org/img'), MIRROR + '/org/img')
+        self.mirrors.add('quay.io/org', 'other.example.com/org')
+        self.assertEqual(self.mirrors.rewrite('quay.io/org/img'), 'other.example.com/org/img')
+        self.assertEqual(len(self.mirrors), 4)
+        with self.assertRaises(ValueError):
+            self.mirrors.add('', MIRROR)
+
+    def test_from_icsp(self):
+        mirrors = MirrorMap.from_icsp(ICSP)
+        self.assertEqual(mirrors.get_rules(), {'quay.io/cp4mcm': MIRROR + '/cp4mcm', 'cp.icr.io/cp': MIRROR + '/cp'})
+        idms = {'kind': 'ImageDigestMirrorSet', 'spec': {'imageDigestMirrors': [{'source': 'quay.io/a', 'mirrors': [MIRROR + '/a']}]}}
+        self.assertEqual(len(MirrorMap.from_icsp([ICSP, idms])), 3)
+
+    def test_apply_csv(self):
+        with open(THIS_DIR + '/test_files/valid_csv.yaml', 'r') as stream:
+            csv_sample = yaml.safe_load(stream)
+        c = ClusterServiceVersion(csv_sample)
+        report = MirrorMap.from_icsp(ICSP).apply(c)
+
+        updated = c.get_updated_csv()
+        deployment = updated['spec']['install']['spec']['deployments'][0]
+        self.assertEqual(deployment['spec']['template']['spec']['containers'][0]['image'], OPERATOR_IMAGE.replace('quay.io', MIRROR))
+        self.assertEqual(deployment['spec']['template']['metadata']['annotations']['olm.relatedImage.cp4mcm-catalog'], RELATED_IMAGE.replace('cp.icr.io', MIRROR))
+        self.assertEqual(updated['spec']['relatedImages'][0]['image'], RELATED_IMAGE.replace('cp.icr.io', MIRROR))
+        # The original is left alone
+        self.assertEqual(c.original_csv['spec']['relatedImages'][0]['image'], RELATED_IMAGE)
+
+        self.assertEqual(report.get_rule_counts(), {'quay.io/cp4mcm': 1, 'cp.icr.io/cp': 2})
+        operator, = report.get_by_rule()['quay.io/cp4mcm']
+        self.assertEqual((operator.original, operator.deployment), (OPERATOR_IMAGE, deployment['name']))
+        self.assertEqual(report.unmatched, [])
+
+        # Nothing matches the mirrors themselves
+        report = MirrorMap.from_icsp(ICSP).apply(c, MirrorReport())
+        self.assertEqual((len(report.matches), len(report.unmatched)), (0, 3))
@@ -59,3 +59,9 @@ class TestOperatorimage(unittest.TestCase):
         # Check that digest was updated
         self.assertEqual(self.dummyOperatorimageTag.digest, 'sha256:new_dummy_sha')
         self.assertEqual(self.dummyOperatorimageTag.image, NEW_IMAGE_WTIH_DIGEST)
+
+    def test_equality(self):
+        other = Operatorimage(deployment='other', container='other', image=IMAGE_WITH_TAG)
+        self.assertEqual(self.dummyOperatorimageTag, other)
+        self.assertEqual(len({self.dummyOperatorimageTag, other, self.dummyOperatorimageDigest}), 2)
+        self.assertNotEqual(self.dummyOperatorimageTag, self.dummyOperatorimageDigest)
@@ -1,5 +1,6 @@
 import unittest
-from ..package import Package, PACKAGE_FILE_FORMAT, Channel
+import copy
+from ..package import Package, PACKAGE_FILE_FORMAT, Channel, promote_channels
 
 # CSV mocks
 csv_name = 'candidate'
@@ -124,4 +125,66 @@ class TestChannel(unittest.TestCase):
         self.channel.set_name(newName)
         self.assertEqual(self.channel.get_name(), newName)
     
-        
\ No newline at end of file
+        
+
+class TestPackageIndex(unittest.TestCase):
+    def setUp(self):
+        self.package = Package(package={
+            'packageName': 'dummy',
+            'defaultChannel': '2.1-stable',
+            'channels': [
+                {'name': '2.0-candidate', 'currentCSV': 'dummy.v2.0.1'},
+                {'name': '2.0-fast', 'currentCSV': 'dummy.v2.0.0'},
+                {'name': '2.1-candidate', 'currentCSV': 'dummy.v2.1.3'},
+                {'name': '2.1-fast', 'currentCSV': 'dummy.v2.1.2'},
+                {'name': '2.2-candidate', 'currentCSV': 'dummy.v2.2.0'},
+            ]
+        })
+
+    def test_get_formatted_is_fresh(self):
+        formatted = self.package.get_formatted()
+        formatted['channels'].append({'name': 'junk', 'currentCSV': ''})
+        other = Package(operator='other', default_channel='1.0-fast')
+        self.assertEqual(other.get_formatted(), {'channels': [], 'defaultChannel': '1.0-fast', 'packageName': 'other'})
+        self.assertEqual(len(self.package.get_formatted()['channels']), 5)
+        self.assertEqual(Package.PACKAGE_FILE_FORMAT, {'channels': [], 'defaultChannel': '{}-{}', 'packageName': ''})
+
+    def test_index_follows_changes(self):
+        channel = self.package.get_channel('2.2-candidate')
+        channel.set_name('2.2-preview')
+        self.assertIsNone(self.package.get_channel('2.2-candidate'))
+        self.assertIs(self.package.get_channel('2.2-preview'), channel)
+
+        # Channels added to the list directly are picked up too
+        self.package.channels.append(Channel('3.0-candidate', 'dummy.v3.0.0'))
+        self.assertEqual(self.package.get_channel('3.0-candidate').get_current_csv(), 'dummy.v3.0.0')
+
+    def test_promote_channels(self):
+        promoted = self.package.promote_channels('{}-candidate', '{}-fast')
+        self.assertEqual(promoted, [('2.0-candidate', '2.0-fast', 'dummy.v2.0.1'), ('2.1-candidate', '2.1-fast', 'dummy.v2.1.3')])
+        self.assertEqual(self.package.get_channel('2.1-fast').get_current_csv(), 'dummy.v2.1.3')
+        self.assertIsNone(self.package.get_channel('2.2-fast'))
+
+        promoted = self.package.promote_channels('2.2-candidate', '2.2-fast', create=True)
+        self.assertEqual(promoted, [('2.2-candidate', '2.2-fast', 'dummy.v2.2.0')])
+        self.assertEqual(self.package.get_channel('2.2-fast').get_current_csv(), 'dummy.v2.2.0')
+
+        with self.assertRaises(ValueError):
+            self.package.promote_channels('{}-{}', '{}-fast')
+
+    def test_promote_channels_bulk(self):
+        packages = [Package(operator='op{}'.format(i)) for i in range(50)]
+        for i, p in enumerate(packages):
+            p.create_channel('1.0-candidate', 'op{}.v1.0.1'.format(i))
+            p.create_channel('1.0-fast', 'op{}.v1.0.0'.format(i))
+
+        results = promote_channels(packages, '{}-candidate', '{}-fast', max_workers=8)
+        self.assertEqual([p for p, _ in results], packages)
+        for i, (p, promoted) in enumerate(results):
+            self.assertEqual(promoted, [('1.0-candidate', '1.0-fast', 'op{}.v1.0.1'.format(i))])
+            self.assertEqual(p.get_formatted()['channels'][1], {'name': '1.0-fast', 'currentCSV': 'op{}.v1.0.1'.format(i)})
+
+    def test_copy(self):
+        other = copy.deepcopy(self.package)
+        other.update_channel('2.0-fast', 'changed')
+        self.assertEqual(self.package.get_channel('2.0-fast').get_current_csv(), 'dummy.v2.0.0')
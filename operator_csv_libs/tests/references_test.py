@@ -0,0 +1,51 @@
+import unittest
+from ..references import parse_reference, split_reference, clear_cache, InvalidReference
+
+
+class TestReferences(unittest.TestCase):
+    def test_split_reference(self):
+        self.assertEqual(split_reference('quay.io/org/img:1.0'), ('quay.io/org', 'img', '1.0', None))
+        self.assertEqual(split_reference('quay.io/org/img@sha256:abc'), ('quay.io/org', 'img', None, 'sha256:abc'))
+        self.assertEqual(split_reference('quay.io/org/img:1.0@sha256:abc'), ('quay.io/org', 'img', '1.0', 'sha256:abc'))
+        self.assertEqual(split_reference('localhost:5000/ns/img'), ('localhost:5000/ns', 'img', None, None))
+        self.assertEqual(split_reference('localhost:5000/ns/img:2@sha256:abc'), ('localhost:5000/ns', 'img', '2', 'sha256:abc'))
+        self.assertEqual(split_reference('nginx'), ('', 'nginx', None, None))
+
+    def test_parse_reference(self):
+        ref = parse_reference('localhost:5000/ns/img:1.0@sha256:abc')
+        self.assertEqual((ref.registry, ref.path, ref.name, ref.tag, ref.digest), ('localhost:5000', 'ns', 'img', '1.0', 'sha256:abc'))
+        self.assertEqual(str(ref), 'localhost:5000/ns/img:1.0@sha256:abc')
+
+        ref = parse_reference('quay.io/org/sub/img@sha256:abc')
+        self.assertEqual((ref.registry, ref.path, ref.name, ref.tag, ref.digest), ('quay.io', 'org/sub', 'img', None, 'sha256:abc'))
+
+        ref = parse_reference('org/img')
+        self.assertEqual((ref.registry, ref.path, ref.name, ref.tag), ('docker.io', 'org', 'img', 'latest'))
+        self.assertEqual(ref.get_tag_key(), 'docker.io/org/img:latest')
+
+    def test_canonical(self):
+        ref = parse_reference('docker.io/library/nginx:latest')
+        for image in ('nginx', 'nginx:latest', 'docker.io/nginx', 'index.docker.io/library/nginx', 'library/nginx:latest'):
+            self.assertIs(parse_reference(image), ref, image)
+        self.assertIsNot(parse_reference('nginx:1.0'), ref)
+        self.assertIsNot(parse_reference('localhost/nginx'), ref)
+
+        clear_cache()
+        self.assertIs(parse_reference('nginx'), parse_reference('docker.io/library/nginx'))
+
+    def test_equality(self):
+        ref = parse_reference('quay.io/org/img:1.0')
+        clear_cache()
+        # A new object once evicted, still equal
+        other = parse_reference('quay.io/org/img:1.0')
+        self.assertIsNot(ref, other)
+        self.assertEqual(ref, other)
+        self.assertEqual(hash(ref), hash(other))
+        self.assertNotEqual(ref, parse_reference('quay.io/org/img:1.1'))
+        self.assertNotEqual(ref, 'quay.io/org/img:1.0')
+
+    def test_invalid(self):
+        for image in ('', 'quay.io/org/', 'img:', 'img@', 'img@sha256:a@b', None):
+            with self.assertRaises(InvalidReference):
+                parse_reference(image)
+        self.assertTrue(issubclass(InvalidReference, ValueError))
@@ -0,0 +1,194 @@
+import unittest
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+from ..scheduler import RequestScheduler, TokenBucket, get_scheduler, set_scheduler
+from ..sessions import SessionPool
+from .. import imagerepo
+from ..imagerepo import QuayRepo, DockerRepo, RateLimited, resolve_digests
+from ..images import Image
+
+BODY = b'{ "tags": [ { "is_manifest_list" : false, "manifest_digest" : "sha256:dummy_sha" } ] }'
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """ Fake quay api answering the first `throttle` requests per path with 429
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            seen = server.seen.get(self.path, 0)
+            server.seen[self.path] = seen + 1
+        try:
+            time.sleep(server.delay)
+            if seen < server.throttle:
+                self.send_response(429)
+                for k, v in server.throttle_headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', '9')
+                self.end_headers()
+                self.wfile.write(b'throttled')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(BODY)))
+            for k, v in server.ok_headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(BODY)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.seen = {}
+        self.server.delay = 0
+        self.server.throttle = 0
+        self.server.throttle_headers = {'Retry-After': '0'}
+        self.server.ok_headers = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = 'http://127.0.0.1:{}/api/v1/repository'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _lookup(self, scheduler, n=1, workers=1):
+        pool = SessionPool(pool_size=workers, scheduler=scheduler)
+        images = [Image(None, 'quay.io/org/image{}:tag'.format(i)) for i in range(n)]
+        try:
+            with patch.object(QuayRepo, 'QUAY_BASE_URL', self.base), \
+                    patch.object(imagerepo, 'get_session', pool.get_session):
+                return list(resolve_digests(images, max_workers=workers))
+        finally:
+            pool.close()
+
+    def test_retry_after(self):
+        self.server.throttle = 2
+        scheduler = RequestScheduler(backoff_base=0.01)
+        results = self._lookup(scheduler)
+        self.assertEqual(results[0].digest, 'sha256:dummy_sha')
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(scheduler.retries, 2)
+
+    def test_backoff_without_retry_after(self):
+        self.server.throttle = 2
+        self.server.throttle_headers = {}
+        scheduler = RequestScheduler(backoff_base=0.01)
+        self.assertTrue(self._lookup(scheduler)[0].ok())
+        self.assertEqual(scheduler.retries, 2)
+
+    def test_retries_exhausted(self):
+        self.server.throttle = 10
+        scheduler = RequestScheduler(max_retries=2, backoff_base=0.01)
+        results = self._lookup(scheduler)
+        self.assertIsInstance(results[0].error, RateLimited)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_host_concurrency(self):
+        self.server.delay = 0.05
+        scheduler = RequestScheduler(concurrency=2)
+        results = self._lookup(scheduler, n=12, workers=8)
+        self.assertTrue(all(r.ok() for r in results))
+        self.assertLessEqual(self.server.max_in_flight, 2)
+
+    def test_rate_limit(self):
+        scheduler = RequestScheduler(rate=50, burst=1)
+        start = time.monotonic()
+        self._lookup(scheduler, n=10, workers=4)
+        # First request uses the initial token, the rest wait for 1/50s each
+        self.assertGreaterEqual(time.monotonic() - start, 9 / 50 * 0.9)
+
+    def test_rate_limit_remaining(self):
+        self.server.ok_headers = {'RateLimit-Remaining': '0;w=21600', 'RateLimit-Reset': '1'}
+        scheduler = RequestScheduler(backoff_max=0.2)
+        start = time.monotonic()
+        self._lookup(scheduler, n=2)
+        # Exhausted quota pauses the host (capped at backoff_max) before the next request
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_get_retry_after(self):
+        scheduler = RequestScheduler()
+        class Resp:
+            def __init__(self, headers):
+                self.headers = headers
+        self.assertEqual(scheduler._get_retry_after(Resp({'Retry-After': '3'})), 3.0)
+        self.assertEqual(scheduler._get_retry_after(Resp({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})), 0.0)
+        self.assertIsNone(scheduler._get_retry_after(Resp({'Retry-After': 'soon'})))
+        self.assertIsNone(scheduler._get_retry_after(Resp({})))
+
+    def test_host_limits(self):
+        scheduler = RequestScheduler(concurrency=8, host_limits={'registry-1.docker.io': {'concurrency': 2}})
+        scheduler.set_host_limits('quay.io', concurrency=4, rate=10)
+        self.assertEqual(scheduler.get_concurrency('registry-1.docker.io'), 2)
+        self.assertEqual(scheduler.get_concurrency('quay.io'), 4)
+        self.assertEqual(scheduler.get_concurrency('other'), 8)
+        self.assertEqual(scheduler._get_host('quay.io').bucket.rate, 10)
+
+    def test_set_scheduler(self):
+        default = get_scheduler()
+        try:
+            scheduler = RequestScheduler()
+            set_scheduler(scheduler)
+            self.assertIs(get_scheduler(), scheduler)
+        finally:
+            set_scheduler(default)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_acquire(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        # Burst is served immediately
+        self.assertLess(time.monotonic() - start, 0.05)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.015)
+
+
+class TestResolveDigestsFairness(unittest.TestCase):
+    def test_slow_registry_does_not_stall_batch(self):
+        # Docker hub (registry-1.docker.io) is slow and may only use 2 of the 6 workers, quay lookups keep flowing
+        scheduler = RequestScheduler(concurrency=6, host_limits={'registry-1.docker.io': {'concurrency': 2}})
+        images = [Image(None, 'docker.io/org/slow{}:tag'.format(i)) for i in range(6)]
+        images += [Image(None, 'quay.io/org/fast{}:tag'.format(i)) for i in range(12)]
+
+        running = {'docker.io': 0}
+        max_running = {'docker.io': 0}
+        lock = threading.Lock()
+        def slow(repo):
+            with lock:
+                running['docker.io'] += 1
+                max_running['docker.io'] = max(max_running['docker.io'], running['docker.io'])
+            time.sleep(0.2)
+            with lock:
+                running['docker.io'] -= 1
+            return 'sha256:slow'
+
+        with patch.object(imagerepo, 'get_scheduler', return_value=scheduler), \
+                patch.object(DockerRepo, 'get_image_digest', autospec=True, side_effect=slow), \
+                patch.object(QuayRepo, 'get_image_digest', return_value='sha256:fast'):
+            order = [r.digest for r in resolve_digests(images, max_workers=6)]
+
+        self.assertLessEqual(max_running['docker.io'], 2)
+        # Every fast lookup finishes before the slow registry has worked through its images
+        self.assertEqual(order.index('sha256:slow'), 12)
+        self.assertEqual(order.count('sha256:slow'), 6)
@@ -0,0 +1,88 @@
+import unittest
+import itertools
+from ..semver import Version, Range, VersionIndex, InvalidVersion, parse_version, parse_range
+
+
+class TestVersion(unittest.TestCase):
+    def test_parse(self):
+        v = Version.parse('v2.1.1-202009111050+build.5')
+        self.assertEqual((v.major, v.minor, v.patch, v.prerelease, v.build), (2, 1, 1, '202009111050', 'build.5'))
+        self.assertEqual(str(v), '2.1.1-202009111050+build.5')
+        self.assertEqual(Version.parse('2.1', partial=True), Version(2, 1, 0))
+        for invalid in ('2.1', '01.0.0', '1.0.0-', 'latest', None):
+            with self.assertRaises(InvalidVersion):
+                Version.parse(invalid)
+
+    def test_precedence(self):
+        ordered = ['1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta', '1.0.0-beta', '1.0.0-beta.2', '1.0.0-beta.11',
+                   '1.0.0-rc.1', '1.0.0', '1.0.1', '1.2.0', '1.10.0', '2.0.0']
+        versions = [Version.parse(v) for v in ordered]
+        self.assertEqual(sorted(reversed(versions)), versions)
+        # Build metadata doesn't count
+        self.assertEqual(Version.parse('1.0.0+a'), Version.parse('1.0.0+b'))
+        self.assertEqual(len({Version.parse('1.0.0+a'), Version.parse('1.0.0')}), 1)
+
+
+    def test_memoized(self):
+        self.assertIs(parse_version('2.1.1'), Version.parse('2.1.1'))
+        self.assertEqual(Version.parse('2.1', partial=True), Version(2, 1, 0))
+        with self.assertRaises(InvalidVersion):
+            Version.parse('2.1')
+        self.assertIs(parse_range('>=1.0.0 <1.2.0'), parse_range('>=1.0.0 <1.2.0'))
+
+
+class TestRange(unittest.TestCase):
+    def test_contains(self):
+        r = Range('>=1.0.0 <1.2.0')
+        self.assertIn('1.0.0', r)
+        self.assertIn('1.1.9', r)
+        self.assertNotIn('1.2.0', r)
+        self.assertNotIn('0.9.9', r)
+        # Pre-releases sort before their release
+        self.assertIn('1.2.0-rc.1', r)
+        self.assertIn(Version.parse('2.1.0'), Range('<2.1.1-202009111050'))
+
+    def test_alternatives(self):
+        r = Range('>= 1.0.0 < 1.1.0 || 2.0.0 || >3.0')
+        self.assertIn('1.0.5', r)
+        self.assertIn('2.0.0', r)
+        self.assertIn('3.0.1', r)
+        self.assertNotIn('2.0.1', r)
+        self.assertNotIn('3.0.0', r)
+        self.assertNotIn('1.5.0', Range('!=1.5.0'))
+
+    def test_invalid(self):
+        for invalid in ('', '>=', '>=1.0.0 ||', '~1.0.0', '>=a.b.c'):
+            with self.assertRaises(InvalidVersion):
+                Range(invalid)
+
+    def test_compiled(self):
+        # The compiled intervals agree with evaluating every comparator
+        operators = {
+            '=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+            '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+            '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+        }
+        bounds = ['1.0.0', '1.1.0-rc.1', '1.1.0', '1.2.0']
+        versions = [Version.parse(v) for v in ('0.9.0', '1.0.0', '1.0.5', '1.1.0-rc.1', '1.1.0', '1.1.1', '1.2.0', '2.0.0')]
+        for (op1, v1), (op2, v2) in itertools.product(itertools.product(operators, bounds), repeat=2):
+            r = Range('{}{} {}{}'.format(op1, v1, op2, v2))
+            for v in versions:
+                expected = operators[op1](v, Version.parse(v1)) and operators[op2](v, Version.parse(v2))
+                self.assertEqual(v in r, expected, '{} in {}'.format(v, r))
+        self.assertEqual(Range('>1.0.0 <1.0.0').intervals, [])
+
+
+class TestVersionIndex(unittest.TestCase):
+    def test_covered(self):
+        index = VersionIndex((v, 'op.v' + v) for v in ('1.1.0', '1.0.0', '2.0.0', '1.0.1', '1.1.0-rc.1', '1.2.0'))
+        self.assertEqual(len(index), 6)
+        self.assertEqual([str(v) for v in index.get_versions()], ['1.0.0', '1.0.1', '1.1.0-rc.1', '1.1.0', '1.2.0', '2.0.0'])
+        self.assertEqual(index.covered('>=1.0.1 <1.2.0'), ['op.v1.0.1', 'op.v1.1.0-rc.1', 'op.v1.1.0'])
+        self.assertEqual(index.covered('<1.1.0 !=1.0.1 || >=1.0.0 <=1.0.0 || >1.5'), ['op.v1.0.0', 'op.v1.1.0-rc.1', 'op.v2.0.0'])
+        self.assertEqual(index.covered(parse_range('>2.0.0')), [])
+
+        index.add('1.0.1', 'again')
+        self.assertEqual(index.covered('=1.0.1'), ['op.v1.0.1', 'again'])
+        # Without a value the version is returned
+        self.assertEqual(VersionIndex([('1.0.0', None)]).covered('1.0.0'), [Version(1, 0, 0)])
@@ -0,0 +1,85 @@
+import unittest
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+from ..sessions import SessionPool, get_session, get_session_pool
+from .. import imagerepo
+from ..imagerepo import QuayRepo
+from ..images import Image
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = b'{ "tags": [ { "is_manifest_list" : true, "manifest_digest" : "sha256:dummy_sha" } ] }'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = SessionPool(pool_size=4, pool_sizes={'quay.io': 16})
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_get_session(self):
+        quay = self.pool.get_session('https://quay.io/api/v1/repository/a/b/tag/')
+        # Same host shares a session, other hosts and credentials do not
+        self.assertIs(quay, self.pool.get_session('https://quay.io/v2/a/b/manifests/c'))
+        self.assertIsNot(quay, self.pool.get_session('https://registry-1.docker.io/v2/a/b/manifests/c'))
+        self.assertIsNot(quay, self.pool.get_session('https://quay.io/v2/a/b/manifests/c', auth=('user', 'key')))
+        self.assertEqual(self.pool.get_session('https://quay.io/', auth=('user', 'key')).auth, ('user', 'key'))
+
+    def test_pool_size(self):
+        self.assertEqual(self.pool.get_session('https://quay.io/').get_adapter('https://quay.io/')._pool_maxsize, 16)
+        self.assertEqual(self.pool.get_session('https://docker.io/').get_adapter('https://docker.io/')._pool_maxsize, 4)
+
+        self.pool.set_pool_size('artifactory.example.com', 2)
+        self.assertEqual(self.pool.get_pool_size('artifactory.example.com'), 2)
+        session = self.pool.get_session('https://artifactory.example.com:443/artifactory')
+        self.assertEqual(session.get_adapter('https://artifactory.example.com/')._pool_maxsize, 2)
+
+    def test_thread_safe(self):
+        sessions = []
+        def worker():
+            sessions.append(self.pool.get_session('https://quay.io/'))
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(id(s) for s in sessions)), 1)
+
+    def test_default_pool(self):
+        self.assertIs(get_session('https://quay.io/'), get_session_pool().get_session('https://quay.io/'))
+
+    def test_keep_alive_reuse(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+        server.connections = 0
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            base = 'http://127.0.0.1:{}/api/v1/repository'.format(server.server_address[1])
+            with patch.object(QuayRepo, 'QUAY_BASE_URL', base), \
+                    patch.object(imagerepo, 'get_session', self.pool.get_session):
+                for i in range(10):
+                    repo = QuayRepo(Image(None, 'quay.io/hybridappio/image{}:dummy_tag'.format(i)))
+                    self.assertEqual(repo.get_manifest_list_digest(), 'sha256:dummy_sha')
+            # All sequential lookups went over a single connection
+            self.assertEqual(server.connections, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
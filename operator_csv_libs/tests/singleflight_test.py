@@ -0,0 +1,172 @@
+import unittest
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+from ..singleflight import SingleFlight, FlightCancelled
+from ..imagerepo import ImageRepo, QuayRepo, ManifestNotFound, resolve_digests
+from ..images import Image
+
+
+class TestSingleFlight(unittest.TestCase):
+    def _run(self, flight, key, fn, n):
+        results = []
+        errors = []
+        def call():
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def test_coalesce(self):
+        flight = SingleFlight()
+        calls = []
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'sha256:dummy'
+        results, errors = self._run(flight, 'key', fn, 10)
+        self.assertEqual(results, ['sha256:dummy'] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.coalesced, 9)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_exception_shared(self):
+        flight = SingleFlight()
+        error = ManifestNotFound('missing')
+        def fn():
+            time.sleep(0.1)
+            raise error
+        results, errors = self._run(flight, 'key', fn, 5)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(e is error for e in errors))
+
+    def test_not_cached(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+        self.assertEqual(flight.coalesced, 0)
+
+    def test_distinct_keys(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 'a'), 'a')
+        self.assertEqual(flight.do('b', lambda: 'b'), 'b')
+
+
+class TestSingleFlightAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesce(self):
+        flight = SingleFlight()
+        calls = []
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'sha256:dummy'
+        results = await asyncio.gather(*[flight.do_async('key', fn) for _ in range(10)])
+        self.assertEqual(results, ['sha256:dummy'] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.coalesced, 9)
+
+    async def test_exception_shared(self):
+        flight = SingleFlight()
+        async def fn():
+            await asyncio.sleep(0.05)
+            raise ManifestNotFound('missing')
+        results = await asyncio.gather(*[flight.do_async('key', fn) for _ in range(3)], return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ManifestNotFound) for r in results))
+        self.assertEqual(flight.in_flight(), 0)
+
+    async def test_cancelled_waiter(self):
+        flight = SingleFlight()
+        async def fn():
+            await asyncio.sleep(0.05)
+            return 'sha256:dummy'
+        leader = asyncio.ensure_future(flight.do_async('key', fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do_async('key', fn))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        # Cancelling one waiter does not cancel the shared call
+        self.assertEqual(await leader, 'sha256:dummy')
+
+    async def test_cancelled_leader(self):
+        flight = SingleFlight()
+        started, unwound = [], asyncio.Event()
+        async def fn():
+            started.append(1)
+            try:
+                await asyncio.sleep(0.05)
+                return 'sha256:dummy'
+            except asyncio.CancelledError:
+                # Still tearing down, the key must stay in flight until this is done
+                await asyncio.sleep(0.02)
+                unwound.set()
+                raise
+        leader = asyncio.ensure_future(flight.do_async('key', fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do_async('key', fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        # Followers get an error rather than being cancelled themselves
+        with self.assertRaises(FlightCancelled):
+            await waiter
+        self.assertTrue(unwound.is_set())
+        self.assertEqual(flight.in_flight(), 0)
+
+        # The next caller starts a new call
+        self.assertEqual(await flight.do_async('key', fn), 'sha256:dummy')
+        self.assertEqual(len(started), 2)
+
+    async def test_new_call_waits_for_teardown(self):
+        flight = SingleFlight()
+        async def fn():
+            try:
+                await asyncio.sleep(0.05)
+                return 'sha256:dummy'
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.02)
+                raise
+        leader = asyncio.ensure_future(flight.do_async('key', fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        # The cancelled call is still unwinding, a caller arriving now joins it instead of starting another
+        self.assertEqual(flight.in_flight(), 1)
+        with self.assertRaises(FlightCancelled):
+            await flight.do_async('key', fn)
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class TestImageRepoSingleFlight(unittest.TestCase):
+    def test_duplicate_images(self):
+        flight = SingleFlight()
+        calls = []
+        def fetch(repo):
+            calls.append(repo.image.get_image())
+            time.sleep(0.1)
+            return 'sha256:dummy'
+        images = [Image(None, 'quay.io/org/base:tag') for _ in range(6)] + [Image(None, 'quay.io/org/other:tag')]
+        with patch.object(ImageRepo, 'singleflight', flight), \
+                patch.object(QuayRepo, 'get_image_digest', autospec=True, side_effect=fetch):
+            results = list(resolve_digests(images, max_workers=8))
+        self.assertTrue(all(r.digest == 'sha256:dummy' for r in results))
+        self.assertEqual(sorted(calls), ['quay.io/org/base:tag', 'quay.io/org/other:tag'])
+        self.assertEqual(flight.coalesced, 5)
+
+    def test_lookup_kind(self):
+        # Image and manifest list digests of the same tag are separate lookups
+        flight = SingleFlight()
+        with patch.object(ImageRepo, 'singleflight', flight), \
+                patch.object(QuayRepo, 'get_image_digest', return_value='sha256:image'), \
+                patch.object(QuayRepo, 'get_manifest_list_digest', return_value='sha256:list'):
+            repo = ImageRepo(Image(None, 'quay.io/org/base:tag'))
+            self.assertEqual(repo.get_image_digest(), 'sha256:image')
+            self.assertEqual(repo.get_manifest_list_digest(), 'sha256:list')
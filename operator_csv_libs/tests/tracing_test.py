@@ -0,0 +1,114 @@
+import unittest
+import tempfile
+import os
+import httpretty
+from .. import tracing
+from ..tracing import TraceEvent, LatencyRecorder
+from ..imagerepo import ImageRepo, QuayRepo, ManifestNotFound
+from ..digestcache import DigestCache
+from ..images import Image
+
+QUAY_IMAGE = 'quay.io/hybridappio/ham-application-assembler:dummy_tag'
+QUAY_IMAGE_MISSING = 'quay.io/hybridappio/ham-application-assembler:missing'
+TAG_URL = 'https://quay.io/api/v1/repository/hybridappio/ham-application-assembler/tag/?onlyActiveTags=true&specificTag={}'
+BODY = '{ "tags": [ { "is_manifest_list" : false, "manifest_digest" : "sha256:dummy_sha" } ] }'
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        httpretty.enable()
+        httpretty.reset()
+        httpretty.register_uri(httpretty.GET, TAG_URL.format('dummy_tag'), body=BODY, match_querystring=True)
+        httpretty.register_uri(httpretty.GET, TAG_URL.format('missing'), status=404, body='not found', match_querystring=True)
+
+        self.events = []
+        tracing.subscribe(self.events.append)
+
+    def tearDown(self):
+        tracing.unsubscribe(self.events.append)
+        httpretty.disable()
+        httpretty.reset()
+
+    def _kinds(self, kind):
+        return [e for e in self.events if e.kind == kind]
+
+    def test_request_and_lookup_events(self):
+        self.assertEqual(QuayRepo(Image(None, QUAY_IMAGE)).get_image_digest(), 'sha256:dummy_sha')
+
+        request, = self._kinds(TraceEvent.REQUEST)
+        self.assertEqual(request.backend, 'quay')
+        self.assertEqual(request.host, 'quay.io')
+        self.assertEqual(request.operation, 'get_image_digest')
+        self.assertEqual(request.method, 'GET')
+        self.assertEqual(request.status, 200)
+        self.assertEqual(request.bytes, len(BODY))
+        self.assertEqual(request.retries, 0)
+        self.assertGreaterEqual(request.latency, 0)
+
+        lookup, = self._kinds(TraceEvent.LOOKUP)
+        self.assertEqual((lookup.backend, lookup.host, lookup.operation), ('quay', 'quay.io', 'get_image_digest'))
+        self.assertIsNone(lookup.error)
+        # Events are emitted innermost first
+        self.assertEqual(self.events, [request, lookup])
+        self.assertIsNone(tracing.get_context())
+
+    def test_lookup_error(self):
+        with self.assertRaises(ManifestNotFound):
+            QuayRepo(Image(None, QUAY_IMAGE_MISSING)).get_image_digest()
+        self.assertEqual(self._kinds(TraceEvent.REQUEST)[0].status, 404)
+        self.assertIsInstance(self._kinds(TraceEvent.LOOKUP)[0].error, ManifestNotFound)
+
+    def test_cache_events(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DigestCache(os.path.join(tmp, 'digests.sqlite'))
+            for _ in range(2):
+                ImageRepo(Image(None, QUAY_IMAGE), cache=cache).get_image_digest()
+        cache_events = self._kinds(TraceEvent.CACHE)
+        self.assertEqual([e.cache for e in cache_events], ['miss', 'hit'])
+        self.assertEqual([(e.backend, e.host, e.operation) for e in cache_events], [('quay', 'quay.io', DigestCache.IMAGE)] * 2)
+        # Only the miss went to the registry
+        self.assertEqual(len(self._kinds(TraceEvent.REQUEST)), 1)
+
+    def test_failing_subscriber(self):
+        def broken(event):
+            raise RuntimeError('broken subscriber')
+        tracing.subscribe(broken)
+        try:
+            self.assertEqual(QuayRepo(Image(None, QUAY_IMAGE)).get_image_digest(), 'sha256:dummy_sha')
+        finally:
+            tracing.unsubscribe(broken)
+        self.assertEqual(len(self.events), 2)
+
+    def test_unsubscribe(self):
+        tracing.unsubscribe(self.events.append)
+        self.assertFalse(tracing.enabled())
+        QuayRepo(Image(None, QUAY_IMAGE)).get_image_digest()
+        self.assertEqual(self.events, [])
+
+
+class TestLatencyRecorder(unittest.TestCase):
+    def test_percentiles(self):
+        recorder = LatencyRecorder()
+        for i in range(1, 101):
+            recorder(TraceEvent(TraceEvent.REQUEST, backend='quay', host='quay.io', latency=i / 1000))
+        recorder(TraceEvent(TraceEvent.REQUEST, backend='docker', host='registry-1.docker.io', latency=1.0))
+        # Other kinds are ignored by default
+        recorder(TraceEvent(TraceEvent.LOOKUP, backend='quay', host='quay.io', latency=10.0))
+
+        self.assertEqual(recorder.percentile(('quay', 'quay.io'), 50), 0.05)
+        self.assertEqual(recorder.percentile(('quay', 'quay.io'), 99), 0.099)
+        self.assertEqual(recorder.percentile(('quay', 'quay.io'), 100), 0.1)
+        self.assertIsNone(recorder.percentile(('artifactory', None), 50))
+
+        summary = recorder.summary()
+        self.assertEqual(summary[('quay', 'quay.io')]['count'], 100)
+        self.assertEqual(summary[('docker', 'registry-1.docker.io')]['p90'], 1.0)
+
+        recorder.clear()
+        self.assertEqual(recorder.summary(), {})
+
+    def test_custom_key(self):
+        recorder = LatencyRecorder(kind=None, key=lambda e: e.kind)
+        recorder(TraceEvent(TraceEvent.REQUEST, latency=0.1))
+        recorder(TraceEvent(TraceEvent.LOOKUP, latency=0.2))
+        self.assertEqual(sorted(recorder.get_keys()), [TraceEvent.LOOKUP, TraceEvent.REQUEST])
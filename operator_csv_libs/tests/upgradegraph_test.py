@@ -0,0 +1,118 @@
+import unittest
+import os
+import yaml
+from ..upgradegraph import UpgradeGraph
+from ..csv import ClusterServiceVersion
+from ..package import Package
+from ..semver import Version
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+NAME = 'dummy.v{}'
+
+
+def entry(version, replaces=None, skiprange=None, skips=()):
+    return (NAME.format(version), replaces and NAME.format(replaces), skiprange, [NAME.format(s) for s in skips])
+
+
+class TestUpgradeGraph(unittest.TestCase):
+    def setUp(self):
+        # 1.0.0 <- 1.0.1 <- 1.1.0 (skips 1.0.x) <- 1.1.1 and a z-stream 1.0.2 off 1.0.1
+        self.graph = UpgradeGraph()
+        for name, replaces, skiprange, skips in (
+                entry('1.0.0'),
+                entry('1.0.1', replaces='1.0.0'),
+                entry('1.0.2', replaces='1.0.1'),
+                entry('1.1.0', replaces='1.0.1', skiprange='>=1.0.0 <1.1.0'),
+                entry('1.1.1', replaces='1.1.0')):
+            self.graph.add_entry(name, replaces=replaces, skiprange=skiprange, skips=skips)
+
+    def test_edges(self):
+        self.assertEqual(self.graph.get_upgrades(NAME.format('1.0.0')), [NAME.format('1.0.1'), NAME.format('1.1.0')])
+        self.assertEqual(self.graph.get_upgrades(NAME.format('1.0.2')), [NAME.format('1.1.0')])
+        self.assertEqual(self.graph.get_heads(), [NAME.format('1.1.1')])
+        self.assertEqual(self.graph.get_version(NAME.format('1.0.2')), Version(1, 0, 2))
+
+    def test_reachability(self):
+        self.assertTrue(self.graph.is_reachable(NAME.format('1.0.0'), NAME.format('1.1.1')))
+        self.assertTrue(self.graph.is_reachable(NAME.format('1.0.2'), NAME.format('1.1.1')))
+        self.assertFalse(self.graph.is_reachable(NAME.format('1.1.0'), NAME.format('1.0.2')))
+        self.assertFalse(self.graph.is_reachable('unknown', NAME.format('1.1.1')))
+
+    def test_upgrade_path(self):
+        # The skipRange makes the direct upgrade to 1.1.0 the shortest
+        self.assertEqual(self.graph.get_upgrade_path(NAME.format('1.0.0')), [NAME.format(v) for v in ('1.0.0', '1.1.0', '1.1.1')])
+        self.assertEqual(self.graph.get_upgrade_path(NAME.format('1.0.0'), NAME.format('1.0.2')), [NAME.format(v) for v in ('1.0.0', '1.0.1', '1.0.2')])
+        self.assertEqual(self.graph.get_upgrade_path(NAME.format('1.1.1')), [NAME.format('1.1.1')])
+        self.assertIsNone(self.graph.get_upgrade_path(NAME.format('1.1.0'), NAME.format('1.0.0')))
+
+    def test_incremental(self):
+        # Added before the entry it replaces, and the skipRange picks up versions added later
+        self.graph.add_entry(NAME.format('1.2.1'), replaces=NAME.format('1.2.0'))
+        self.assertEqual(self.graph.get_missing(), {NAME.format('1.2.0'): [NAME.format('1.2.1')]})
+        self.assertFalse(self.graph.is_reachable(NAME.format('1.1.1'), NAME.format('1.2.1')))
+
+        self.graph.add_entry(NAME.format('1.2.0'), skiprange='>=1.1.0 <1.2.0')
+        self.graph.add_entry(NAME.format('1.1.2'), replaces=NAME.format('1.1.1'))
+        self.assertEqual(self.graph.get_missing(), {})
+        self.assertEqual(self.graph.get_heads(), [NAME.format('1.2.1')])
+        self.assertEqual(self.graph.get_upgrades(NAME.format('1.1.2')), [NAME.format('1.2.0')])
+        self.assertEqual(self.graph.get_upgrade_path(NAME.format('1.0.2')), [NAME.format(v) for v in ('1.0.2', '1.1.0', '1.2.0', '1.2.1')])
+
+        with self.assertRaises(ValueError):
+            self.graph.add_entry(NAME.format('1.2.0'))
+
+    def test_channels(self):
+        package = Package(operator='dummy')
+        package.create_channel('1.0-fast', NAME.format('1.0.2'))
+        package.create_channel('1.1-fast', NAME.format('1.1.1'))
+        self.graph.package = package
+
+        self.assertEqual(self.graph.get_channel_head('1.1-fast'), NAME.format('1.1.1'))
+        self.assertIsNone(self.graph.get_channel_head('2.0-fast'))
+        self.assertEqual(self.graph.get_channel_entries('1.0-fast'), [NAME.format(v) for v in ('1.0.0', '1.0.1', '1.0.2')])
+        self.assertEqual(self.graph.validate(), [])
+
+        package.create_channel('2.0-fast', NAME.format('2.0.0'))
+        self.assertEqual(self.graph.validate(), ['Head {} of channel 2.0-fast is not in the graph'.format(NAME.format('2.0.0'))])
+
+    def test_validate(self):
+        self.assertEqual(self.graph.validate(), [])
+        # Without a package the newest head is the target, 1.0.2 has no way forward once the skipRange is gone
+        graph = UpgradeGraph()
+        graph.add_entry(NAME.format('1.0.0'))
+        graph.add_entry(NAME.format('1.0.1'), replaces=NAME.format('1.0.0'))
+        graph.add_entry(NAME.format('1.0.2'), replaces=NAME.format('1.0.1'))
+        graph.add_entry(NAME.format('1.1.0'), replaces=NAME.format('1.0.9'))
+        self.assertEqual(graph.validate(), [
+            '{} is replaced or skipped by {} but is not in the graph'.format(NAME.format('1.0.9'), NAME.format('1.1.0')),
+            '{} can not be upgraded to {}'.format(NAME.format('1.0.0'), NAME.format('1.1.0')),
+            '{} can not be upgraded to {}'.format(NAME.format('1.0.1'), NAME.format('1.1.0')),
+            '{} can not be upgraded to {}'.format(NAME.format('1.0.2'), NAME.format('1.1.0')),
+        ])
+        self.assertEqual(graph.get_stranded(NAME.format('1.0.2')), [NAME.format('1.1.0')])
+
+    def test_build(self):
+        # Ranges resolved in one build and ranges resolved earlier both pick up versions added later
+        graph = UpgradeGraph()
+        graph.add_entry(NAME.format('2.0.0'), skiprange='>=1.0.0 <2.0.0')
+        graph.add_entry(NAME.format('2.1.0'), skiprange='>=2.0.0 <=2.1.0')
+        graph.add_entry(NAME.format('1.0.0'))
+        graph.build()
+        self.assertEqual(graph.get_upgrades(NAME.format('1.0.0')), [NAME.format('2.0.0')])
+        # A range covering its own version doesn't make an edge to itself
+        self.assertEqual(graph.get_upgrades(NAME.format('2.1.0')), [])
+
+        graph.add_entry(NAME.format('1.5.0'))
+        graph.add_entry(NAME.format('2.0.5'))
+        self.assertEqual(graph.get_upgrades(NAME.format('1.5.0')), [NAME.format('2.0.0')])
+        self.assertEqual(graph.get_upgrades(NAME.format('2.0.5')), [NAME.format('2.1.0')])
+        self.assertEqual(graph.get_heads(), [NAME.format('2.1.0')])
+
+    def test_add_csv(self):
+        with open(THIS_DIR + '/test_files/valid_csv.yaml', 'r') as stream:
+            csv_sample = yaml.safe_load(stream)
+        graph = UpgradeGraph([ClusterServiceVersion(csv_sample)])
+        graph.add(ClusterServiceVersion(csv_sample, target_version='2.1.2', replaces='ibm-management-orchestrator.v2.1.1', skiprange='<2.1.2'))
+        self.assertEqual(graph.get_entry_names(), ['ibm-management-orchestrator.v2.1.1', 'ibm-management-orchestrator.v2.1.2'])
+        self.assertEqual(graph.get_upgrade_path('ibm-management-orchestrator.v2.1.1'), ['ibm-management-orchestrator.v2.1.1', 'ibm-management-orchestrator.v2.1.2'])
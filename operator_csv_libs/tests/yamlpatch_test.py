@@ -0,0 +1,87 @@
+import unittest
+import copy
+import yaml
+from .. import yamlpatch
+
+SOURCE = """# comment kept as is
+metadata:
+  name: op.v1.0.0   # trailing comment
+  annotations:
+    quoted: 'single'
+    double: "double"
+    flow: {image: 'quay.io/org/op:1.0', other: x}
+    block: |
+      line one
+spec:
+  version: 1.0.0
+  replicas: 1
+  images:
+  - quay.io/org/op:1.0
+  - quay.io/org/operand:1.0
+"""
+
+
+class TestYamlPatch(unittest.TestCase):
+    def _load(self, text=SOURCE):
+        data, spans = yamlpatch.load_with_spans(text)
+        return data, copy.deepcopy(data), spans
+
+    def test_unchanged(self):
+        data, updated, spans = self._load()
+        self.assertEqual(yamlpatch.patch(SOURCE, spans, data, updated), SOURCE)
+        self.assertEqual(yamlpatch.patch(SOURCE, spans, data, data), SOURCE)
+
+    def test_changed_scalars(self):
+        data, updated, spans = self._load()
+        updated['metadata']['name'] = 'op.v1.0.1'
+        updated['metadata']['annotations']['quoted'] = "it's"
+        updated['metadata']['annotations']['double'] = 'other'
+        updated['metadata']['annotations']['flow']['image'] = 'quay.io/org/op@sha256:abc'
+        updated['spec']['version'] = '1.0.1'
+        updated['spec']['images'][1] = 'quay.io/org/operand@sha256:def'
+
+        patched = yamlpatch.patch(SOURCE, spans, data, updated)
+        self.assertEqual(yaml.safe_load(patched), updated)
+        self.assertIn('  name: op.v1.0.1   # trailing comment\n', patched)
+        self.assertIn("    quoted: 'it''s'\n", patched)
+        self.assertIn('    double: "other"\n', patched)
+        # ':' is only allowed in plain scalars outside flow collections
+        self.assertIn("{image: 'quay.io/org/op@sha256:abc', other: x}", patched)
+        self.assertIn('  - quay.io/org/operand@sha256:def\n', patched)
+        # Everything else is left alone
+        self.assertEqual(patched.splitlines()[:1], SOURCE.splitlines()[:1])
+        self.assertEqual(len(patched.splitlines()), len(SOURCE.splitlines()))
+
+    def test_quoting(self):
+        data, updated, spans = self._load()
+        # Would read back as a float or a mapping when plain
+        updated['spec']['version'] = '1.0'
+        updated['spec']['images'][0] = 'key: value'
+        patched = yamlpatch.patch(SOURCE, spans, data, updated)
+        self.assertIn('  version: "1.0"\n', patched)
+        self.assertEqual(yaml.safe_load(patched), updated)
+
+    def test_unpatchable_changes(self):
+        for change in (
+                lambda d: d['metadata'].__setitem__('namespace', 'x'),
+                lambda d: d['spec']['images'].append('quay.io/org/new:1.0'),
+                lambda d: d['spec'].__setitem__('replicas', 2),
+                lambda d: d['metadata']['annotations'].__setitem__('block', 'line two\n')):
+            data, updated, spans = self._load()
+            change(updated)
+            self.assertIsNone(yamlpatch.patch(SOURCE, spans, data, updated))
+
+    def test_aliases(self):
+        text = 'a: &anchor x\nb: *anchor\n'
+        data, spans = yamlpatch.load_with_spans(text)
+        self.assertIs(spans, yamlpatch.UNPATCHABLE)
+        self.assertIsNone(yamlpatch.patch(text, spans, data, {'a': 'x', 'b': 'y'}))
+
+    def test_c_loader(self):
+        if not hasattr(yaml, 'CSafeLoader'):
+            self.skipTest('LibYAML not available')
+        data, updated, spans = self._load()
+        c_data, c_spans = yamlpatch.load_with_spans(SOURCE, yaml.CSafeLoader)
+        self.assertEqual(c_data, data)
+        updated['spec']['images'][0] = 'quay.io/org/op@sha256:abc'
+        self.assertEqual(yamlpatch.patch(SOURCE, c_spans, c_data, updated), yamlpatch.patch(SOURCE, spans, data, updated))
@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools, inspect, math, threading, time
+
+# Subscribers are kept in a tuple that is replaced, never mutated, so emitters can iterate it without locking
+_subscribers = ()
+_subscribers_lock = threading.Lock()
+
+# Backend and operation of the registry call in progress, picked up by events emitted further down the stack
+_context = ContextVar('operator_csv_libs_trace_context', default=None)
+
+class TraceEvent:
+    """ A single registry interaction.
+
+        `kind` is one of:
+
+        * 'request': one HTTP request, including its retries. Has method, url, status, bytes and retries.
+        * 'lookup': one backend operation, i.e. QuayRepo.get_image_digest. Has error if the operation raised.
+        * 'cache': one DigestCache lookup. `cache` is 'hit' or 'miss'.
+
+        backend and operation are filled in from the enclosing backend operation where there is one.
+    """
+    REQUEST = 'request'
+    LOOKUP = 'lookup'
+    CACHE = 'cache'
+
+    def __init__(self, kind, backend=None, host=None, operation=None, method=None, url=None, status=None, latency=None, bytes=None, retries=0, cache=None, error=None):
+        self.kind = kind
+        self.backend = backend
+        self.host = host
+        self.operation = operation
+        self.method = method
+        self.url = url
+        self.status = status
+        self.latency = latency
+        self.bytes = bytes
+        self.retries = retries
+        self.cache = cache
+        self.error = error
+
+    def __repr__(self):
+        return '<TraceEvent {} backend={} host={} operation={} status={} latency={}>'.format(
+            self.kind, self.backend, self.host, self.operation, self.status, self.latency)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+def subscribe(subscriber):
+    """Call subscriber(event) with a TraceEvent for every registry interaction
+
+    Subscribers are called synchronously on the thread (or event loop) that made the call and should return quickly.
+    Exceptions raised by a subscriber are ignored.
+
+    :param subscriber: Callable taking a TraceEvent
+    :type subscriber: callable
+    """
+    global _subscribers
+    with _subscribers_lock:
+        _subscribers = _subscribers + (subscriber,)
+
+def unsubscribe(subscriber):
+    global _subscribers
+    with _subscribers_lock:
+        _subscribers = tuple(s for s in _subscribers if s != subscriber)
+
+def enabled():
+    """Returns True if anything is subscribed. Emitters check this before building an event
+
+    :rtype: bool
+    """
+    return bool(_subscribers)
+
+def emit(kind, **fields):
+    """Send an event to all subscribers. backend and operation default to the enclosing traced operation
+    """
+    subscribers = _subscribers
+    if not subscribers:
+        return
+    context = _context.get()
+    if context is not None:
+        fields.setdefault('backend', context[0])
+        fields.setdefault('operation', context[1])
+        fields.setdefault('host', context[2])
+    event = TraceEvent(kind, **fields)
+    for subscriber in subscribers:
+        try:
+            subscriber(event)
+        except Exception:
+            pass
+
+def get_context():
+    """Return (backend, operation, host) of the traced operation in progress, or None
+
+    :rtype: tuple
+    """
+    return _context.get()
+
+def traced(operation):
+    """Decorator for backend methods. Emits a 'lookup' event per call and tags events emitted during the call with
+    the backend (the class BACKEND attribute), operation and registry host. A no-op apart from one check when nothing
+    is subscribed.
+
+    :param operation: Operation name, i.e. 'get_image_digest'
+    :type operation: string
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(self, *args, **kwargs):
+                if not _subscribers:
+                    return await fn(self, *args, **kwargs)
+                token, start = _enter(self, operation)
+                try:
+                    result = await fn(self, *args, **kwargs)
+                except Exception as e:
+                    _exit(token, start, e)
+                    raise
+                _exit(token, start, None)
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if not _subscribers:
+                return fn(self, *args, **kwargs)
+            token, start = _enter(self, operation)
+            try:
+                result = fn(self, *args, **kwargs)
+            except Exception as e:
+                _exit(token, start, e)
+                raise
+            _exit(token, start, None)
+            return result
+        return wrapper
+    return decorator
+
+@contextmanager
+def scope(repo, operation):
+    """Tag events emitted inside the block with the backend and host of repo and operation, without emitting a
+    'lookup' event of its own
+    """
+    token, _ = _enter(repo, operation)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def _enter(repo, operation):
+    host = None
+    image = getattr(repo, 'image', None)
+    if image is not None:
+        host = image.get_image_repo().split('/')[0]
+    context = (getattr(repo, 'BACKEND', type(repo).__name__), operation, host)
+    return _context.set(context), time.perf_counter()
+
+def _exit(token, start, error):
+    latency = time.perf_counter() - start
+    emit(TraceEvent.LOOKUP, latency=latency, error=error)
+    _context.reset(token)
+
+class LatencyRecorder:
+    """ Subscriber collecting latencies per key, (backend, host) for 'request' events by default, and reporting
+        percentiles.
+
+        Usage::
+
+            recorder = LatencyRecorder()
+            tracing.subscribe(recorder)
+            ...
+            print(recorder.summary())
+    """
+    def __init__(self, kind=TraceEvent.REQUEST, key=None):
+        """
+        :param kind: Event kind to record, None for all (default: {'request'})
+        :type kind: string
+
+        :param key: Function mapping an event to its aggregation key (default: {(event.backend, event.host)})
+        :type key: callable
+        """
+        self.kind = kind
+        self.key = key or (lambda event: (event.backend, event.host))
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if event.latency is None or (self.kind is not None and event.kind != self.kind):
+            return
+        key = self.key(event)
+        with self._lock:
+            self._latencies.setdefault(key, []).append(event.latency)
+
+    def get_keys(self):
+        with self._lock:
+            return list(self._latencies)
+
+    def percentile(self, key, p):
+        """Return the p-th percentile latency in seconds for key, using nearest rank
+
+        :param p: Percentile between 0 and 100
+        :type p: float
+
+        :rtype: float
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if not latencies:
+            return None
+        rank = max(1, math.ceil(p / 100 * len(latencies)))
+        return latencies[min(rank, len(latencies)) - 1]
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Return count, total and latency percentiles per key
+
+        :return: {key: {'count': n, 'total': seconds, 'p50': seconds, ...}}
+        :rtype: dict
+        """
+        summary = {}
+        for key in self.get_keys():
+            with self._lock:
+                latencies = list(self._latencies[key])
+            entry = {'count': len(latencies), 'total': sum(latencies)}
+            for p in percentiles:
+                entry['p{}'.format(p)] = self.percentile(key, p)
+            summary[key] = entry
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._latencies.clear()
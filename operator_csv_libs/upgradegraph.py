@@ -0,0 +1,325 @@
+from collections import deque
+from .semver import Version, VersionIndex, InvalidVersion, parse_range
+
+class UpgradeGraph:
+    """ Upgrade graph of the csvs of one package.
+
+        There is an edge from A to B when a cluster running A can upgrade to B: B replaces A (spec.replaces), B lists A
+        in spec.skips, or the version of A is in the olm.skipRange of B. Heads are the csvs nothing upgrades to from
+        them. Csvs can be added one at a time, skipRange edges are resolved in bulk the next time the graph is queried
+        (see build). Reachability and paths are computed once per target or source and cached until the next csv is
+        added.
+
+        Usage::
+
+            graph = UpgradeGraph(csvs, package=package)
+            graph.get_channel_head('2.1-fast')
+            graph.get_upgrade_path('my-operator.v2.0.0', 'my-operator.v2.1.3')
+            problems = graph.validate()
+    """
+    def __init__(self, csvs=(), package=None):
+        """
+        :param csvs: Csvs of the package
+        :type csvs: list of ClusterServiceVersion
+
+        :param package: Package with the channels, used for channel queries
+        :type package: Package
+        """
+        self.package = package
+        self._entries = {}
+        # name -> {name: None} of csvs it can be upgraded to, and the reverse. Names may be referenced before they are added
+        self._upgrades = {}
+        self._upgrades_from = {}
+        # Entries by version, to find the ones a skipRange covers with binary search
+        self._versions = VersionIndex()
+        # Entries with an olm.skipRange whose edges have been resolved
+        self._ranged = []
+        # Entries added since skipRange edges were last resolved, see build()
+        self._unbuilt = []
+        self._heads = {}
+        self._reaching = {}
+        self._paths = {}
+        for csv in csvs:
+            self.add(csv)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def add(self, csv):
+        """Add a csv to the graph
+
+        :param csv: The csv to add
+        :type csv: ClusterServiceVersion
+
+        :raises ValueError: A csv with the same name was added before
+        """
+        try:
+            replaces = csv.get_replaces()
+        except KeyError:
+            replaces = None
+        self.add_entry(csv.get_versioned_name(), version=csv.get_version(), replaces=replaces,
+                       skiprange=csv.get_skiprange(), skips=csv.get_skips())
+
+    def add_entry(self, name, version=None, replaces=None, skiprange=None, skips=()):
+        """Add a csv to the graph by its upgrade related fields
+
+        :param name: Versioned name, metadata.name
+        :type name: string
+
+        :param version: spec.version, parsed from the name when not given
+        :type version: string
+
+        :param replaces: spec.replaces
+        :type replaces: string
+
+        :param skiprange: olm.skipRange annotation
+        :type skiprange: string
+
+        :param skips: spec.skips
+        :type skips: list
+
+        :raises ValueError: An entry with the same name was added before
+        :raises InvalidVersion: skiprange is not a valid range
+        """
+        if name in self._entries:
+            raise ValueError('{} is already in the upgrade graph'.format(name))
+        entry = _Entry(name, _parse_version(name, version), replaces, parse_range(skiprange) if skiprange else None, tuple(skips or ()))
+        self._entries[name] = entry
+        self._upgrades.setdefault(name, {})
+        self._upgrades_from.setdefault(name, {})
+        if not self._upgrades[name]:
+            self._heads[name] = None
+
+        if replaces:
+            self._add_edge(replaces, name)
+        for skipped in entry.skips:
+            self._add_edge(skipped, name)
+        # skipRange edges are resolved in bulk by build()
+        self._unbuilt.append(entry)
+
+        self._reaching.clear()
+        self._paths.clear()
+
+    def build(self):
+        """Resolve the olm.skipRange edges of the csvs added since the last build. Queries call this, so there is
+        no need to call it directly. Each skipRange is looked up once in a VersionIndex, so adding n csvs and then
+        querying costs O(n log n) plus the edges found, rather than checking every skipRange on every add
+        """
+        if not self._unbuilt:
+            return
+        added, self._unbuilt = self._unbuilt, []
+        # Ranges resolved before only need checking against the new versions
+        if self._ranged:
+            new_versions = VersionIndex((e.version, e) for e in added if e.version is not None)
+            for ranged in self._ranged:
+                for other in new_versions.covered(ranged.skiprange):
+                    self._add_edge(other.name, ranged.name)
+        for entry in added:
+            if entry.version is not None:
+                self._versions.add(entry.version, entry)
+        # New ranges are checked against every version, old and new
+        for entry in added:
+            if entry.skiprange is not None:
+                for other in self._versions.covered(entry.skiprange):
+                    if other is not entry:
+                        self._add_edge(other.name, entry.name)
+                self._ranged.append(entry)
+
+    def _add_edge(self, source, target):
+        self._upgrades.setdefault(source, {})[target] = None
+        self._upgrades_from.setdefault(target, {})[source] = None
+        self._heads.pop(source, None)
+
+    def get_entry_names(self):
+        """Returns the names of all csvs in the order they were added
+
+        :rtype: list
+        """
+        return list(self._entries)
+
+    def get_version(self, name):
+        """Returns the version of a csv
+
+        :rtype: Version
+        """
+        return self._entries[name].version
+
+    def get_upgrades(self, name):
+        """Returns the csvs a cluster running name can upgrade to directly
+
+        :rtype: list
+        """
+        self.build()
+        return [n for n in self._upgrades.get(name, ()) if n in self._entries]
+
+    def get_heads(self):
+        """Returns the csvs nothing upgrades to from them, oldest version first
+
+        :rtype: list
+        """
+        self.build()
+        return sorted(self._heads, key=self._version_key)
+
+    def get_channel_head(self, channel):
+        """Returns the currentCSV of a channel of the package
+
+        :param channel: Channel name
+        :type channel: string
+
+        :return: Name, or None if there is no package or no such channel
+        :rtype: string
+        """
+        c = self.package.get_channel(channel) if self.package is not None else None
+        return c.get_current_csv() if c is not None else None
+
+    def get_channel_entries(self, channel):
+        """Returns the csvs that can upgrade to the head of channel, including the head
+
+        :rtype: list
+        """
+        head = self.get_channel_head(channel)
+        if head is None or head not in self._entries:
+            return []
+        reaching = self._get_reaching(head)
+        return [n for n in self._entries if n in reaching]
+
+    def is_reachable(self, source, target):
+        """Returns True if a cluster running source can get to target through one or more upgrades
+
+        :rtype: bool
+        """
+        return source in self._entries and source in self._get_reaching(target)
+
+    def get_upgrade_path(self, source, target=None):
+        """Returns the shortest sequence of upgrades from source to target. When several are equally short the one
+        through newer versions is used
+
+        :param source: Name of the installed csv
+        :type source: string
+
+        :param target: Name of the csv to upgrade to (default: {the newest head reachable from source})
+        :type target: string
+
+        :return: Names from source to target, or None if target can't be reached
+        :rtype: list
+        """
+        if source not in self._entries:
+            return None
+        parents = self._get_paths(source)
+        if target is None:
+            heads = [h for h in self.get_heads() if h in parents]
+            if not heads:
+                return None
+            target = heads[-1]
+        if target not in parents:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
+
+    def get_missing(self):
+        """Returns the names referenced by replaces or skips that are not in the graph
+
+        :return: {missing name: [names referring to it]}
+        :rtype: dict
+        """
+        self.build()
+        return {n: list(targets) for n, targets in self._upgrades.items() if n not in self._entries and targets}
+
+    def get_stranded(self, head):
+        """Returns the csvs that can't upgrade to head
+
+        :rtype: list
+        """
+        reaching = self._get_reaching(head)
+        return [n for n in self._entries if n not in reaching]
+
+    def validate(self):
+        """Check that the csvs form a connected upgrade graph: every replaces and skips refers to a known csv, every
+        channel head exists, and every csv can upgrade to the newest head (or, with a package, the head of some channel)
+
+        :return: Descriptions of the problems found, empty if there are none
+        :rtype: list
+        """
+        problems = []
+        for missing, referrers in self.get_missing().items():
+            problems.append('{} is replaced or skipped by {} but is not in the graph'.format(missing, ', '.join(referrers)))
+
+        heads = []
+        if self.package is not None:
+            for c in self.package.get_channels():
+                if c.get_current_csv() not in self._entries:
+                    problems.append('Head {} of channel {} is not in the graph'.format(c.get_current_csv(), c.get_name()))
+                else:
+                    heads.append(c.get_current_csv())
+        elif self.get_heads():
+            heads = self.get_heads()[-1:]
+
+        stranded = set(self._entries)
+        for head in heads:
+            stranded.difference_update(self._get_reaching(head))
+        for name in self._entries:
+            if name in stranded:
+                problems.append('{} can not be upgraded to {}'.format(name, ' or '.join(heads)))
+        return problems
+
+    def _get_reaching(self, target):
+        # Names that can reach target, found walking edges backwards once per target
+        self.build()
+        reaching = self._reaching.get(target)
+        if reaching is None:
+            reaching = {target} if target in self._entries else set()
+            queue = deque(reaching)
+            while queue:
+                for source in self._upgrades_from.get(queue.popleft(), ()):
+                    if source not in reaching and source in self._entries:
+                        reaching.add(source)
+                        queue.append(source)
+            self._reaching[target] = reaching
+        return reaching
+
+    def _get_paths(self, source):
+        # Breadth first search from source, newest upgrade first, as a name -> previous name tree
+        self.build()
+        parents = self._paths.get(source)
+        if parents is None:
+            parents = {source: None}
+            queue = deque([source])
+            while queue:
+                name = queue.popleft()
+                for target in sorted(self.get_upgrades(name), key=self._version_key, reverse=True):
+                    if target not in parents:
+                        parents[target] = name
+                        queue.append(target)
+            self._paths[source] = parents
+        return parents
+
+    def _version_key(self, name):
+        version = self._entries[name].version
+        return (version is not None, version if version is not None else Version(0))
+
+class _Entry:
+    __slots__ = ('name', 'version', 'replaces', 'skiprange', 'skips')
+
+    def __init__(self, name, version, replaces, skiprange, skips):
+        self.name = name
+        self.version = version
+        self.replaces = replaces
+        self.skiprange = skiprange
+        self.skips = skips
+
+def _parse_version(name, version):
+    # spec.version, or the part of metadata.name after '.v'
+    if version is None and '.v' in name:
+        version = name.rsplit('.v', 1)[1]
+    if version is None:
+        return None
+    try:
+        return Version.parse(str(version))
+    except InvalidVersion:
+        return None
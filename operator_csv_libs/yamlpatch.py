@@ -0,0 +1,141 @@
+""" Minimal-diff writing of yaml documents.
+
+    load_with_spans() parses a document and records where each scalar is in the source text. patch() then compares
+    the parsed data against an updated copy and, as long as only string scalars changed, returns the source text with
+    just those scalars replaced. Key order, comments, quoting and line folding of everything else stay as they were.
+"""
+import io, json, yaml
+
+# Spans of documents that can't be patched safely, i.e. documents using anchors and aliases
+UNPATCHABLE = None
+
+_PLAIN_STYLES = (None, '')
+_STR_TAG = 'tag:yaml.org,2002:str'
+_MERGE_TAG = 'tag:yaml.org,2002:merge'
+
+_analyzer = yaml.emitter.Emitter(io.StringIO())
+_resolver = yaml.resolver.Resolver()
+
+def load_with_spans(text, Loader=yaml.SafeLoader):
+    """Parse a yaml document and record the source span of every scalar
+
+    :param text: yaml document
+    :type text: string
+
+    :param Loader: Loader class, i.e. yaml.CSafeLoader
+    :type Loader: type
+
+    :return: (data, spans) where spans mirrors data with (start, end, style, flow) tuples in place of scalars, or
+             UNPATCHABLE if the document can't be patched
+    :rtype: tuple
+    """
+    loader = Loader(text)
+    try:
+        node = loader.get_single_node()
+        data = loader.construct_document(node) if node is not None else None
+    finally:
+        loader.dispose()
+    try:
+        spans = _get_spans(node, set(), False)
+    except _Unpatchable:
+        spans = UNPATCHABLE
+    return data, spans
+
+def patch(text, spans, original, updated):
+    """Return text with the scalars that differ between original and updated replaced
+
+    Subtrees that are the same object in original and updated are skipped without comparing them.
+
+    :param text: Source text original was loaded from
+    :type text: string
+
+    :param spans: Spans returned by load_with_spans
+    :type spans: dict
+
+    :return: Patched text, or None if updated can't be expressed by replacing scalars, i.e. keys or list items
+             were added or removed, a block scalar or non string value changed
+    :rtype: string
+    """
+    if spans is UNPATCHABLE:
+        return None
+    edits = []
+    if not _diff(spans, original, updated, edits):
+        return None
+    if not edits:
+        return text
+    # Apply back to front so earlier offsets stay valid
+    edits.sort(reverse=True)
+    parts = []
+    end = len(text)
+    for start, stop, replacement in edits:
+        parts.append(text[stop:end])
+        parts.append(replacement)
+        end = start
+    parts.append(text[:end])
+    return ''.join(reversed(parts))
+
+class _Unpatchable(Exception):
+    pass
+
+def _get_spans(node, seen, flow):
+    if id(node) in seen:
+        # An alias, the same node is referenced from more than one place
+        raise _Unpatchable()
+    seen.add(id(node))
+    if isinstance(node, yaml.MappingNode):
+        flow = flow or bool(node.flow_style)
+        spans = {}
+        for key, value in node.value:
+            if key.tag == _MERGE_TAG or not isinstance(key, yaml.ScalarNode):
+                raise _Unpatchable()
+            spans[key.value] = _get_spans(value, seen, flow)
+        return spans
+    if isinstance(node, yaml.SequenceNode):
+        flow = flow or bool(node.flow_style)
+        return [_get_spans(item, seen, flow) for item in node.value]
+    return (node.start_mark.index, node.end_mark.index, node.style, flow)
+
+def _diff(spans, original, updated, edits):
+    if original is updated:
+        return True
+    if isinstance(original, dict):
+        if not isinstance(updated, dict) or not isinstance(spans, dict) or original.keys() != updated.keys():
+            return False
+        for key in original:
+            if key not in spans or not _diff(spans[key], original[key], updated[key], edits):
+                return False
+        return True
+    if isinstance(original, list):
+        if not isinstance(updated, list) or not isinstance(spans, list) or len(original) != len(updated):
+            return False
+        for span, a, b in zip(spans, original, updated):
+            if not _diff(span, a, b, edits):
+                return False
+        return True
+    if type(original) is type(updated) and original == updated:
+        return True
+    if not isinstance(spans, tuple) or not isinstance(original, str) or not isinstance(updated, str):
+        return False
+    start, end, style, flow = spans
+    replacement = _render(updated, style, flow)
+    if replacement is None:
+        return False
+    edits.append((start, end, replacement))
+    return True
+
+def _render(value, style, flow=True):
+    """ Render value as a single line scalar, keeping the original quoting where the value allows it """
+    if style in ('|', '>'):
+        return None
+    analysis = _analyzer.analyze_scalar(value)
+    if style in _PLAIN_STYLES:
+        # Plain only if it reads back as the same string where it is, i.e. 'a:b' is fine outside [] and {}
+        allow_plain = analysis.allow_flow_plain if flow else analysis.allow_block_plain
+        if value and not analysis.multiline and allow_plain \
+                and _resolver.resolve(yaml.ScalarNode, value, (True, False)) == _STR_TAG:
+            return value
+    elif style == "'":
+        if not analysis.multiline and analysis.allow_single_quoted:
+            return "'{}'".format(value.replace("'", "''"))
+    # JSON strings are valid yaml double quoted scalars
+    return json.dumps(value)
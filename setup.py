@@ -13,5 +13,8 @@ setup(
         'dohq-artifactory',
         'slack_log_handler',
         'requests'
-    ]
+    ],
+    extras_require={
+        'async': ['aiohttp']
+    }
 )
\ No newline at end of file